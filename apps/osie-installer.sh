@@ -127,6 +127,9 @@ statedir=${TMPDIR:-/tmp}/osie-statedir-$hardware_id
 metadata=$statedir/metadata
 userdata=$statedir/userdata
 mkdir -p "$statedir"
+# drivers the initramfs recorded for hardware it had no profile for, osie logs
+# them (see installer/alpine/moduleprofiles.py)
+[ -d /etc/modprobe-profiles ] && cp -r /etc/modprobe-profiles "$statedir"
 
 reason='unable to fetch metadata'
 echo "metadata:"
@@ -73,51 +73,68 @@ EOF
 facility=$(sed -nr 's|.*\bfacility=(\S+).*|\1|p' /proc/cmdline)
 syslog_host=$(sed -nr 's|.*\bsyslog_host=(\S+).*|\1|p' /proc/cmdline)
 
+# docker starts up while the clock and metadata are sorted out
+service docker start
+
 ensure_time
 
-hardware_id=$(rcurl -sSL --connect-timeout 60 https://metadata.packet.net/metadata | jq -r .hardware_id)
+md=$(rcurl -sSL --connect-timeout 60 https://metadata.packet.net/metadata | jq -S .)
+hardware_id=$(echo "$md" | jq -r .hardware_id)
 statedir=${TMPDIR:-/tmp}/osie-statedir-$hardware_id
 metadata=$statedir/metadata
 mkdir -p "$statedir"
+# drivers the initramfs recorded for hardware it had no profile for, osie logs
+# them (see installer/alpine/moduleprofiles.py)
+[ -d /etc/modprobe-profiles ] && cp -r /etc/modprobe-profiles "$statedir"
 
 echo "metadata:"
-rcurl -sSL --connect-timeout 60 https://metadata.packet.net/metadata |
-	jq -S . |
+echo "$md" |
 	tee "$metadata" |
 	jq .
 
 arch=$(uname -m)
 packet_base_url=$(sed -nr 's|.*\bpacket_base_url=(\S+).*|\1|p' /proc/cmdline)
 packet_bootdev_mac=$(sed -nr 's|.*\bpacket_bootdev_mac=(\S+).*|\1|p' /proc/cmdline)
-facility=$(jq -r .facility "$metadata")
-phone_home_url=$(jq -r .phone_home_url "$metadata")
-tinkerbell=$(jq -r .phone_home_url "$metadata" | sed -e 's|^http://||' -e 's|/.*||')
+facility=$(echo "$md" | jq -r .facility)
+phone_home_url=$(echo "$md" | jq -r .phone_home_url)
+tinkerbell=$(echo "$phone_home_url" | sed -e 's|^http://||' -e 's|/.*||')
 
 trap fail EXIT
 
-service docker start
+# dockerd is usable as soon as it answers on its socket, so check often instead
+# of sleeping for seconds at a time
 i=0
+echo "Waiting for docker to start up"
 # shellcheck disable=SC2169
-until docker info >/dev/null || [[ $i -gt 5 ]]; do
-	echo "Sleeping to wait for docker to start up"
-	sleep 3
+until [[ -S /var/run/docker.sock ]] && docker info >/dev/null 2>&1 || [[ $i -ge 180 ]]; do
+	sleep 0.1
 	i=$((i + 1))
 done
 docker info
 
-reason='unable to fetch/load osie-runner image'
-if ! docker images "osie-runner:$arch" | grep osie >/dev/null; then
-	rcurl "${packet_base_url:-http://install.$facility.packet.net/misc/osie/current}/osie-runner-$arch.tar.gz" |
+# syntax: load_image $name
+load_image() {
+	docker images "$1:$arch" | grep osie >/dev/null && return
+	rcurl "${packet_base_url:-http://install.$facility.packet.net/misc/osie/current}/$1-$arch.tar.gz" |
 		docker load |
 		tee
-fi
+}
 
-reason='unable to fetch/load osie image'
-if ! docker images "osie:$arch" | grep osie >/dev/null; then
-	rcurl "${packet_base_url:-http://install.$facility.packet.net/misc/osie/current}/osie-$arch.tar.gz" |
-		docker load |
-		tee
-fi
+# Both images are fetched and loaded at the same time. osie-runner only needs
+# its own image to start connecting to hegel, it waits for the osie image to be
+# loaded (the status in $statedir/osie-image) when it first runs osie.
+echo loading >"$statedir/osie-image"
+(
+	if load_image osie; then
+		echo 0
+	else
+		echo 1
+	fi >"$statedir/osie-image.tmp"
+	mv "$statedir/osie-image.tmp" "$statedir/osie-image"
+) &
+
+reason='unable to fetch/load osie-runner image'
+load_image osie-runner
 
 # stop mdev from messing with us once and for all
 rm -f /sbin/mdev
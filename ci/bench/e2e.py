@@ -0,0 +1,657 @@
+#!/usr/bin/env python3
+"""
+Hermetic end to end provisioning benchmark.
+
+Provisions sparse loop device backed disks, shaped like one of the
+ci/cpr/*.cpr.json plans, through the real osie-runner and osie images: a local
+hegel stand-in hands run.py a provisioning push, which runs wipe.sh and then
+osie.sh (and so cpr.sh) in the osie container just as on a machine. What the
+install fetches, the image (--image-dir, laid out like an image_uri directory:
+image.tar.gz, kernel.tar.gz, initrd.tar.gz and modules.tar.gz) and the grub
+templates, is served from here, and the phone-home events osie sends are
+recorded. Their arrival times split the install into stages:
+
+    hegel      runner start to its first hegel Get
+    wipe       wipe.sh and the env check, up to provisioning.104.01
+    fetch      osie start and the image download, up to provisioning.104.50
+    prepare    up to provisioning.105
+    cpr        partitioning, raid and filesystems, until cpr.json is written
+    extract    image extraction, up to provisioning.106
+    configure  kernel, grub and the rest of the os setup, up to provisioning.108
+    finish     cleanup, up to provisioning.109
+    total      runner start to provisioning.109
+
+The containers run on a private docker network with a dhcp server for the
+early phone-home of custom images, and osie only touches the loop disks
+(OSIE_DISKS). They still run privileged with the host's /dev though, so only
+run this as root on a disposable, BIOS booted bench machine with docker,
+dnsmasq, losetup, mdadm and openssl, grpcio and the osie and osie-runner images
+loaded.
+
+    sudo ci/bench/e2e.py --image-dir images/ubuntu_18_04 --plan c1.small.x86 \\
+        --save build/bench/$(git rev-parse --short HEAD).json
+    sudo ci/bench/e2e.py --image-dir images/ubuntu_18_04 --plan c1.small.x86 \\
+        --compare build/bench/baseline.json
+
+hegel serves the push both typed and as JSON, and the runner takes the form it
+prefers. --hegel-form typed or --hegel-form json serves and has the runner use
+only that form, to time the two against each other. The bytes each form puts
+on the wire are printed.
+"""
+
+import argparse
+import glob
+import http.server
+import json
+import os
+import re
+import shutil
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse as parse
+from concurrent import futures
+
+here = os.path.dirname(os.path.abspath(__file__))
+top = os.path.normpath(os.path.join(here, "..", ".."))
+sys.path.insert(0, os.path.join(top, "osie-runner"))
+
+GB = 1 << 30
+BRIDGE = "osiebench0"
+NETWORK = "osie-bench"
+
+# name, from, to, points are phone-home event types, "get" for the first hegel
+# Get and "cpr" for when cpr.json was written
+STAGES = (
+    ("wipe", "get", "provisioning.104.01"),
+    ("fetch", "provisioning.104.01", "provisioning.104.50"),
+    ("prepare", "provisioning.104.50", "provisioning.105"),
+    ("cpr", "provisioning.105", "cpr"),
+    ("extract", "cpr", "provisioning.106"),
+    ("configure", "provisioning.106", "provisioning.108"),
+    ("finish", "provisioning.108", "provisioning.109"),
+)
+
+DISK_RE = re.compile(r"/dev/(sd[a-z]+|vd[a-z]+|nvme\d+n\d+)(p?)(\d*)\b")
+
+
+class BenchError(Exception):
+    pass
+
+
+def run(*cmd, **kwargs):
+    return subprocess.run(
+        cmd, check=True, stdout=subprocess.PIPE, universal_newlines=True, **kwargs
+    ).stdout.strip()
+
+
+def load_plan(plan):
+    with open(os.path.join(top, "ci", "cpr", plan + ".cpr.json")) as f:
+        return json.load(f)
+
+
+def plan_disks(storage):
+    return [d["device"] for d in storage["disks"]]
+
+
+def rewrite_storage(storage, loops):
+    """The storage config with its disks and partitions moved to the loop
+    devices in loops, a map of disk to loop device."""
+
+    def sub(m):
+        disk = "/dev/" + m.group(1)
+        if disk not in loops:
+            return m.group(0)
+        if not m.group(3):
+            return loops[disk]
+        return "%sp%s" % (loops[disk], m.group(3))
+
+    return json.loads(DISK_RE.sub(sub, json.dumps(storage)))
+
+
+def block_disk(name, sysfs="/sys/class/block"):
+    """The disk a block device (loop1, loop1p2) is or is a partition of."""
+    if os.path.exists(os.path.join(sysfs, name, "partition")):
+        return os.path.basename(os.path.realpath(os.path.join(sysfs, name, "..")))
+    return name
+
+
+def md_on_disks(disks, sysfs="/sys/class/block"):
+    """The md arrays with a member on one of disks (names, not paths)."""
+    mds = []
+    for md in sorted(glob.glob(os.path.join(sysfs, "md*"))):
+        slaves = os.listdir(os.path.join(md, "slaves"))
+        if any(block_disk(s, sysfs) in disks for s in slaves):
+            mds.append(os.path.basename(md))
+    return mds
+
+
+class LoopDisks:
+    """Sparse files of size bytes attached as loop devices, one per disk."""
+
+    def __init__(self, directory, disks, size):
+        self.loops = {}
+        try:
+            for i, disk in enumerate(disks):
+                path = os.path.join(directory, "disk%d.img" % i)
+                with open(path, "wb") as f:
+                    f.truncate(size)
+                self.loops[disk] = run(
+                    "losetup", "--find", "--show", "--partscan", path
+                )
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        # arrays cpr built on the disks keep the loop devices busy
+        names = set(os.path.basename(loop) for loop in self.loops.values())
+        for md in md_on_disks(names):
+            subprocess.call(["mdadm", "--stop", "/dev/" + md])
+        for loop in self.loops.values():
+            subprocess.call(["losetup", "-d", loop])
+        self.loops = {}
+
+
+def serve_path(url, image_dir, grub_dir):
+    """The local file for a request path, None if there is none.
+
+    /image/NAME is NAME in the image dir, /osie/grub/OS/PLAN/FILE is the repo's
+    grub/OS-PLAN-FILE, as osie.sh asks for it under BASEURL.
+    """
+    path = parse.urlparse(url).path
+    if ".." in path.split("/"):
+        return None
+    if path.startswith("/image/"):
+        name = path[len("/image/") :]
+        if not name or "/" in name:
+            return None
+        return os.path.join(image_dir, name)
+    if path.startswith("/osie/grub/"):
+        name = path[len("/osie/grub/") :].replace("/", "-")
+        return os.path.join(grub_dir, name)
+    return None
+
+
+class Events:
+    """Everything posted to the servers, with the time it came in."""
+
+    def __init__(self):
+        self.events = []
+        self.cond = threading.Condition()
+
+    def add(self, path, body):
+        with self.cond:
+            self.events.append({"time": time.time(), "path": path, "body": body})
+            self.cond.notify_all()
+
+    def wait(self, event_types, timeout):
+        """Waits for an event of one of event_types, returns its type or None
+        on timeout."""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                for e in self.events:
+                    if event_type_of(e) in event_types:
+                        return event_type_of(e)
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return None
+                self.cond.wait(left)
+
+    def failure(self):
+        with self.cond:
+            for e in self.events:
+                if event_type_of(e) == "failure":
+                    return e["body"].get("reason", "unknown")
+
+
+def event_type_of(event):
+    body = event["body"]
+    return body.get("type") if isinstance(body, dict) else None
+
+
+def make_handler(events, image_dir, grub_dir):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):
+            pass
+
+        def do_GET(self):
+            path = serve_path(self.path, image_dir, grub_dir)
+            if not path or not os.path.isfile(path):
+                self.send_error(404)
+                return
+            with open(path, "rb") as f:
+                self.send_response(200)
+                self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+                self.end_headers()
+                shutil.copyfileobj(f, self.wfile, 1 << 20)
+
+        def do_PUT(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            try:
+                body = json.loads(body.decode())
+            except ValueError:
+                body = body.decode(errors="replace")
+            events.add(self.path, body)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        do_POST = do_PUT
+
+    return Handler
+
+
+def serve(address, handler, context=None):
+    server = http.server.ThreadingHTTPServer(address, handler)
+    if context:
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_cert(directory, ip):
+    """A self signed certificate for ip, osie trusts it through
+    CURL_CA_BUNDLE."""
+    key = os.path.join(directory, "bench-key.pem")
+    cert = os.path.join(directory, "bench-ca.pem")
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=%s" % ip,
+            "-addext",
+            "subjectAltName=IP:%s" % ip,
+            "-keyout",
+            key,
+            "-out",
+            cert,
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return cert, context
+
+
+def hardware(plan, storage, image_uri, gateway):
+    """The provisioning push hegel would send for an instance with a custom
+    image on the loop disks."""
+    os_version = {"image_tag": "bench", "os_slug": "ubuntu_18_04"}
+    return {
+        "bonding_mode": 4,
+        "facility_code": "bench",
+        "id": "b3c4e1d0-0000-4000-8000-000000000001",
+        "network_ports": [
+            {
+                "data": {"bond": "bond0", "mac": "02:00:00:00:00:%02x" % i},
+                "name": "eth%d" % i,
+                "type": "data",
+            }
+            for i in range(2)
+        ],
+        "plan_slug": plan,
+        "preinstalled_operating_system_version": dict(os_version, storage=storage),
+        "instance": {
+            "crypted_root_password": "bench",
+            "id": "b3c4e1d0-0000-4000-8000-000000000002",
+            "hostname": "bench",
+            "ip_addresses": [
+                {
+                    "address": gateway.rsplit(".", 1)[0] + ".10",
+                    "address_family": 4,
+                    "cidr": 24,
+                    "gateway": gateway,
+                    "netmask": "255.255.255.0",
+                    "management": True,
+                    "public": False,
+                }
+            ],
+            "operating_system_version": dict(os_version),
+            "storage": storage,
+            "userdata": "#!/bin/sh\nimage_uri=%s\n" % image_uri,
+            "network_ready": True,
+        },
+        "state": "provisioning",
+    }
+
+
+class Hegel:
+    """Answers the runner's Get with doc and keeps its Subscribe open, as JSON
+    (hegel.Hegel), typed (hardware.proto) or both."""
+
+    def __init__(self, address, doc, forms=("typed", "json")):
+        import grpc
+
+        self.gets = []
+        self.wire_bytes = {}
+        self.stopped = threading.Event()
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+        hegel = self
+
+        def subscribe(context):
+            # only read if the Get did not finish the install
+            while context.is_active() and not hegel.stopped.wait(1):
+                pass
+            return iter(())
+
+        if "json" in forms:
+            import hegel_pb2
+            import hegel_pb2_grpc
+
+            resp = hegel_pb2.GetResponse(JSON=json.dumps(doc))
+            self.wire_bytes["json"] = resp.ByteSize()
+
+            class Servicer(hegel_pb2_grpc.HegelServicer):
+                def Get(self, request, context):
+                    hegel.gets.append(time.time())
+                    return resp
+
+                def Subscribe(self, request, context):
+                    return subscribe(context)
+
+            hegel_pb2_grpc.add_HegelServicer_to_server(Servicer(), self.server)
+
+        if "typed" in forms:
+            import hardware_pb2_grpc
+            from hardware import from_dict
+
+            msg = from_dict(doc)
+            self.wire_bytes["typed"] = msg.ByteSize()
+
+            class HardwareServicer(hardware_pb2_grpc.HardwareHegelServicer):
+                def Get(self, request, context):
+                    hegel.gets.append(time.time())
+                    return msg
+
+                def Subscribe(self, request, context):
+                    return subscribe(context)
+
+            hardware_pb2_grpc.add_HardwareHegelServicer_to_server(
+                HardwareServicer(), self.server
+            )
+
+        self.server.add_insecure_port(address)
+        self.server.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.server.stop(0)
+
+
+class Network:
+    """A docker bridge network with dnsmasq handing out leases on it."""
+
+    def __init__(self, directory, subnet, gateway):
+        self.gateway = gateway
+        run(
+            "docker",
+            "network",
+            "create",
+            "--driver=bridge",
+            "--subnet=" + subnet,
+            "--gateway=" + gateway,
+            "--opt=com.docker.network.bridge.name=" + BRIDGE,
+            NETWORK,
+        )
+        prefix = gateway.rsplit(".", 1)[0]
+        self.dnsmasq = subprocess.Popen(
+            [
+                "dnsmasq",
+                "--keep-in-foreground",
+                "--port=0",
+                "--bind-interfaces",
+                "--interface=" + BRIDGE,
+                "--dhcp-range=%s.100,%s.200,1h" % (prefix, prefix),
+                "--dhcp-leasefile=" + os.path.join(directory, "leases"),
+            ]
+        )
+
+    def close(self):
+        self.dnsmasq.terminate()
+        self.dnsmasq.wait()
+        subprocess.call(["docker", "network", "rm", NETWORK])
+
+
+def stages(start, gets, events, cpr_time):
+    """Seconds per stage, from the runner start, the hegel Get times, the
+    phone-home events and when cpr.json was written.
+
+    The env check for a custom image runs osie once before the install, so the
+    points after provisioning.104.01 are taken from the events after it.
+    """
+    points = {"get": gets[0] if gets else None, "cpr": cpr_time}
+    after = 0
+    for e in events:
+        t = event_type_of(e)
+        if t == "provisioning.104.01":
+            points[t] = e["time"]
+            after = e["time"]
+    for e in events:
+        t = event_type_of(e)
+        if t and t not in points and e["time"] >= after:
+            points[t] = e["time"]
+
+    out = {}
+    for name, begin, end in STAGES:
+        if points.get(begin) and points.get(end):
+            out[name] = {"seconds": points[end] - points[begin]}
+    if points["get"]:
+        out["hegel"] = {"seconds": points["get"] - start}
+    if points.get("provisioning.109"):
+        out["total"] = {"seconds": points["provisioning.109"] - start}
+    return out
+
+
+def hegel_forms(args):
+    return sorted(set(args.hegel_forms or ("typed", "json")))
+
+
+def provision(args, directory):
+    storage = load_plan(args.plan)
+    gateway = args.gateway
+    statedir = os.path.join(directory, "statedir")
+    os.mkdir(statedir)
+
+    events = Events()
+    cert, context = make_cert(statedir, gateway)
+    handler = make_handler(
+        events, os.path.abspath(args.image_dir), os.path.join(top, "grub")
+    )
+    tinkerbell = "http://%s:%d" % (gateway, args.http_port)
+    image_uri = "https://%s:%d/image" % (gateway, args.https_port)
+    forms = hegel_forms(args)
+
+    disks = network = hegel = None
+    servers = []
+    try:
+        disks = LoopDisks(directory, plan_disks(storage), args.disk_size * GB)
+        storage = rewrite_storage(storage, disks.loops)
+        network = Network(directory, args.subnet, gateway)
+        # the servers listen on the bridge only
+        servers.append(serve((gateway, args.http_port), handler))
+        servers.append(serve((gateway, args.https_port), handler, context))
+        hegel = Hegel(
+            "%s:%d" % (gateway, args.hegel_port),
+            hardware(args.plan, storage, image_uri, gateway),
+            forms,
+        )
+        for form, n in sorted(hegel.wire_bytes.items()):
+            print("e2e: hegel %s push is %d bytes" % (form, n), file=sys.stderr)
+        with open(os.path.join(statedir, "cmdline"), "w") as f:
+            f.write("tinkerbell=%s facility=bench\n" % tinkerbell)
+
+        env = {
+            # the runner only honors the overrides below in bench mode
+            "OSIE_BENCH": "1",
+            "STATEDIR_HOST": statedir,
+            "KERNEL_CMDLINE_FILE": "/statedir/cmdline",
+            "HEGEL_AUTHORITY": "%s:%d" % (gateway, args.hegel_port),
+            "HEGEL_INSECURE": "1",
+            # the runner's choice when hegel serves both
+            "HEGEL_HARDWARE": forms[0] if len(forms) == 1 else "",
+            "OSIE_DOCKER_NET": NETWORK,
+            "OSIE_DISKS": " ".join(sorted(disks.loops.values())),
+            "BASEURL": tinkerbell + "/osie",
+            "CURL_CA_BUNDLE": "/statedir/" + os.path.basename(cert),
+        }
+        cmd = ["docker", "run", "--rm", "-t", "--privileged", "--network", NETWORK]
+        cmd += ["-v", statedir + ":/statedir"]
+        cmd += ["-v", "/var/run/docker.sock:/var/run/docker.sock"]
+        for name, value in sorted(env.items()):
+            cmd += ["-e", "%s=%s" % (name, value)]
+        cmd += [args.runner_image]
+
+        start = time.time()
+        runner = subprocess.Popen(cmd, stdout=sys.stderr)
+        deadline = time.monotonic() + args.timeout
+        while not events.wait(("provisioning.109", "failure"), 5):
+            if runner.poll() is not None or time.monotonic() > deadline:
+                break
+        try:
+            # run.py exits once osie wrote cleanup.sh
+            runner.wait(60)
+        except subprocess.TimeoutExpired:
+            runner.kill()
+            runner.wait()
+
+        failure = events.failure()
+        if failure:
+            raise BenchError("osie failed: %s" % failure)
+        if not events.wait(("provisioning.109",), 0):
+            raise BenchError(
+                "no provisioning.109, runner exited with %s" % runner.returncode
+            )
+
+        cpr = os.path.join(statedir, "cpr.json")
+        cpr_time = os.stat(cpr).st_mtime if os.path.exists(cpr) else None
+        return stages(start, hegel.gets, events.events, cpr_time)
+    finally:
+        for server in servers:
+            server.shutdown()
+        if hegel:
+            hegel.stop()
+        if network:
+            network.close()
+        if disks:
+            disks.close()
+
+
+def git_commit():
+    try:
+        return run("git", "-C", top, "rev-parse", "HEAD")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance=1.25):
+    regressions = []
+    for name, base in sorted(baseline.items()):
+        got = results.get(name)
+        if not got:
+            continue
+        if got["seconds"] > base["seconds"] * tolerance:
+            regressions.append(
+                "%s: %.1fs, was %.1fs" % (name, got["seconds"], base["seconds"])
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark a provision end to end")
+    parser.add_argument(
+        "--image-dir",
+        required=True,
+        help="directory with image.tar.gz, kernel.tar.gz, initrd.tar.gz and modules.tar.gz",
+    )
+    parser.add_argument(
+        "--plan",
+        default="c1.small.x86",
+        choices=sorted(
+            os.path.basename(p)[: -len(".cpr.json")]
+            for p in glob.glob(os.path.join(top, "ci", "cpr", "*.cpr.json"))
+        ),
+    )
+    parser.add_argument("--disk-size", type=int, default=16, help="GiB per disk")
+    parser.add_argument("--runner-image", default="osie-runner:x86_64")
+    parser.add_argument("--subnet", default="172.31.250.0/24")
+    parser.add_argument("--gateway", default="172.31.250.1")
+    parser.add_argument("--http-port", type=int, default=8080)
+    parser.add_argument("--https-port", type=int, default=8443)
+    parser.add_argument("--hegel-port", type=int, default=42115)
+    parser.add_argument(
+        "--hegel-form",
+        dest="hegel_forms",
+        action="append",
+        choices=("typed", "json"),
+        help="hardware document forms hegel serves, default both",
+    )
+    parser.add_argument("--timeout", type=int, default=3600, help="seconds")
+    parser.add_argument("--save", metavar="FILE", help="write the results to FILE")
+    parser.add_argument(
+        "--compare", metavar="FILE", help="fail on regressions against FILE"
+    )
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix="bench-e2e-")
+    try:
+        results = provision(args, directory)
+    except (BenchError, OSError, subprocess.CalledProcessError) as e:
+        print("e2e: %s" % e, file=sys.stderr)
+        return 1
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    order = [s[0] for s in STAGES] + ["hegel", "total"]
+    for name in sorted(results, key=order.index):
+        print("%-10s %10.1fs" % (name, results[name]["seconds"]))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(
+                {
+                    "commit": git_commit(),
+                    "plan": args.plan,
+                    "hegel_forms": hegel_forms(args),
+                    "results": results,
+                },
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("plan") != args.plan:
+            print(
+                "e2e: baseline is for %s, not %s" % (baseline.get("plan"), args.plan),
+                file=sys.stderr,
+            )
+            return 1
+        regressions = compare(results, baseline["results"], args.tolerance)
+        for r in regressions:
+            print("regression: " + r, file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+import pytest
+
+import e2e
+
+
+def test_rewrite_storage():
+    storage = {
+        "disks": [{"device": "/dev/sda"}, {"device": "/dev/nvme0n1"}],
+        "raid": [{"devices": ["/dev/sda3", "/dev/nvme0n1p3", "/dev/sdaa3"]}],
+        "filesystems": [{"mount": {"device": "/dev/md/ROOT"}}],
+    }
+    loops = {"/dev/sda": "/dev/loop1", "/dev/nvme0n1": "/dev/loop10"}
+    assert e2e.rewrite_storage(storage, loops) == {
+        "disks": [{"device": "/dev/loop1"}, {"device": "/dev/loop10"}],
+        # disks without a loop device are left alone
+        "raid": [{"devices": ["/dev/loop1p3", "/dev/loop10p3", "/dev/sdaa3"]}],
+        "filesystems": [{"mount": {"device": "/dev/md/ROOT"}}],
+    }
+
+
+@pytest.mark.parametrize("plan", ["c1.small.x86", "m1.xlarge.x86"])
+def test_rewrite_plan(plan):
+    storage = e2e.load_plan(plan)
+    disks = e2e.plan_disks(storage)
+    loops = {d: "/dev/loop%d" % i for i, d in enumerate(disks)}
+    rewritten = e2e.rewrite_storage(storage, loops)
+    assert e2e.plan_disks(rewritten) == sorted(loops.values())
+    for d in disks:
+        assert d not in str(rewritten)
+
+
+def event(t, event_type):
+    return {"time": t, "path": "/phone-home", "body": {"type": event_type}}
+
+
+def test_stages():
+    events = [
+        # the env check of a custom image before the install
+        event(105, "provisioning.104.50"),
+        event(110, "provisioning.104.01"),
+        event(130, "provisioning.104.50"),
+        event(140, "provisioning.105"),
+        {"time": 141, "path": "/events", "body": "not json"},
+        event(200, "provisioning.106"),
+        event(260, "provisioning.108"),
+        event(265, "provisioning.109"),
+    ]
+    got = e2e.stages(100, [102, 150], events, 170)
+    assert {name: s["seconds"] for name, s in got.items()} == {
+        "hegel": 2,
+        "wipe": 8,
+        "fetch": 20,
+        "prepare": 10,
+        "cpr": 30,
+        "extract": 30,
+        "configure": 60,
+        "finish": 5,
+        "total": 165,
+    }
+
+
+def test_stages_incomplete():
+    got = e2e.stages(100, [], [event(110, "provisioning.104.01")], None)
+    assert got == {}
+
+
+def test_compare():
+    baseline = {
+        "total": {"seconds": 100},
+        "cpr": {"seconds": 10},
+        "gone": {"seconds": 1},
+    }
+    results = {"total": {"seconds": 124}, "cpr": {"seconds": 13}}
+    assert e2e.compare(results, baseline) == ["cpr: 13.0s, was 10.0s"]
+    assert e2e.compare(results, baseline, tolerance=1.5) == []
+
+
+def test_md_on_disks(tmpdir):
+    block = tmpdir.ensure("class", "block", dir=True)
+    for disk, part in (("loop1", None), ("loop10", "loop10p1"), ("loop2", "loop2p3")):
+        d = tmpdir.ensure("devices", disk, dir=True)
+        if part:
+            d.ensure(part, "partition")
+            block.join(part).mksymlinkto(d.join(part))
+    for md, slaves in (("md0", ["loop10p1"]), ("md1", ["loop2p3", "loop10p1"])):
+        d = tmpdir.ensure("devices", md, "slaves", dir=True)
+        for s in slaves:
+            d.ensure(s)
+        block.join(md).mksymlinkto(d.dirpath())
+
+    sysfs = str(block)
+    assert e2e.block_disk("loop10p1", sysfs) == "loop10"
+    assert e2e.block_disk("loop1", sysfs) == "loop1"
+    # loop1 is not loop10p1's disk
+    assert e2e.md_on_disks({"loop1"}, sysfs) == []
+    assert e2e.md_on_disks({"loop2"}, sysfs) == ["md1"]
+    assert e2e.md_on_disks({"loop1", "loop10"}, sysfs) == ["md0", "md1"]
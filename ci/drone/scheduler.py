@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Packs the provisioning test matrix onto facilities by capacity.
+
+Every (plan, os) run goes to a facility that has the plan in stock, normal
+capacity before limited. Each facility runs at most --facility-limit tests at
+once, and a plan that is limited in a facility only --limited-limit. Within
+those limits the runs are placed longest and most constrained first, each on
+the facility where it would finish earliest, so the whole matrix finishes as
+early as it can instead of queueing behind the few machines of a constrained
+facility. The run length
+per plan comes from a previous tester.py --results file or --duration.
+
+The output is a tester.py runs file. Each run carries its planned "start" in
+seconds, and tester.py holds it back until then.
+
+    ./scheduler.py drone-data.json v1234 --capacity capacity.json >runs.json
+
+Without --capacity the capacity is fetched from the API, the same data
+supplier.py prints.
+"""
+
+import argparse
+import heapq
+import json
+import os
+import statistics
+import sys
+
+# better first
+LEVELS = ("normal", "limited")
+PREFERRED = ("ewr1", "sjc1", "iad1", "atl1")
+DURATION = 1800
+FACILITY_LIMIT = 4
+LIMITED_LIMIT = 1
+
+
+def by_plan(capacity):
+    """Turns the api's facility -> plan -> level capacity into plan -> level
+    -> facilities."""
+    cap = {}
+    for fac in sorted(capacity):
+        for plan, v in capacity[fac].items():
+            cap.setdefault(plan, {}).setdefault(v["level"], []).append(fac)
+    return cap
+
+
+def durations(results):
+    """The median test-time per plan of the successful runs in a tester.py
+    results file."""
+    times = {}
+    for r in results["runs"]:
+        if not r.get("error") and r.get("test_time"):
+            times.setdefault(r["plan"], []).append(r["test_time"])
+    return {plan: statistics.median(t) for plan, t in times.items()}
+
+
+def matrix(hwtests, v):
+    """The runs for the hwtests of a drone-data.json, as prov-test.sh.j2 sets
+    them up."""
+    runs = []
+    for plan, info in sorted(hwtests.items()):
+        for slug in info["oses"]:
+            runs.append(
+                {
+                    "hostname": "osie-test-%s-%s"
+                    % (
+                        plan.replace("_", "-").replace(".", "-"),
+                        slug.replace("_", "-"),
+                    ),
+                    "plan": plan,
+                    "os": slug,
+                    "ipxe_script_url": "http://blob1-nrt1.packet.net/osie-testing/%s/%s-%s.ipxe"
+                    % (v, plan, slug),
+                }
+            )
+    return runs
+
+
+class Slots:
+    """Times at which each of limit concurrent slots frees up."""
+
+    def __init__(self, limit):
+        self.free = [0.0] * limit
+
+    def next(self):
+        return self.free[0]
+
+    def take(self, end):
+        heapq.heapreplace(self.free, end)
+
+
+def schedule(
+    runs,
+    capacity,
+    plan_durations=None,
+    duration=DURATION,
+    facility_limit=FACILITY_LIMIT,
+    limited_limit=LIMITED_LIMIT,
+    limits=None,
+):
+    """Assigns a facility and start time to each run, returns the scheduled
+    runs ordered by start and the runs that fit nowhere."""
+    cap = by_plan(capacity)
+    plan_durations = plan_durations or {}
+    limits = limits or {}
+    facilities = {}
+    pairs = {}
+
+    def rank(fac, level):
+        preferred = PREFERRED.index(fac) if fac in PREFERRED else len(PREFERRED)
+        return (LEVELS.index(level), preferred, fac)
+
+    def length(run):
+        return plan_durations.get(run["plan"], duration)
+
+    def choices(run):
+        return sum(len(cap.get(run["plan"], {}).get(level, ())) for level in LEVELS)
+
+    scheduled = []
+    unschedulable = []
+    # longest first, the runs with the fewest facilities to go to first among
+    # equally long ones so they still get them
+    for run in sorted(runs, key=lambda r: (-length(r), choices(r), r["hostname"])):
+        best = None
+        for level in LEVELS:
+            for fac in cap.get(run["plan"], {}).get(level, ()):
+                fslots = facilities.setdefault(
+                    fac, Slots(limits.get(fac, facility_limit))
+                )
+                pslots = None
+                if level == "limited":
+                    pslots = pairs.setdefault((fac, run["plan"]), Slots(limited_limit))
+                start = max(fslots.next(), pslots.next() if pslots else 0.0)
+                key = (start + length(run), rank(fac, level))
+                if best is None or key < best[0]:
+                    best = (key, fac, level, start, fslots, pslots)
+
+        if best is None:
+            unschedulable.append(run)
+            continue
+
+        (end, _), fac, level, start, fslots, pslots = best
+        fslots.take(end)
+        if pslots:
+            pslots.take(end)
+        scheduled.append(dict(run, facility=fac, level=level, start=start))
+
+    scheduled.sort(key=lambda r: (r["start"], r["hostname"]))
+    return scheduled, unschedulable
+
+
+def makespan(scheduled, plan_durations=None, duration=DURATION):
+    plan_durations = plan_durations or {}
+    return max(
+        (r["start"] + plan_durations.get(r["plan"], duration) for r in scheduled),
+        default=0,
+    )
+
+
+def get_capacity():
+    import packet
+
+    m = packet.Manager(os.getenv("PACKET_API_TOKEN"))
+    return m.get_capacity(legacy="include")
+
+
+def parse_limit(s):
+    fac, _, n = s.partition("=")
+    return fac, int(n)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="schedule the provisioning tests")
+    parser.add_argument("testplan", type=argparse.FileType(), help="drone-data.json")
+    parser.add_argument("v", help="osie version under test")
+    parser.add_argument(
+        "--capacity", type=argparse.FileType(), help="recorded get_capacity() json"
+    )
+    parser.add_argument(
+        "--history", type=argparse.FileType(), help="previous tester.py results"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=DURATION, help="seconds per run"
+    )
+    parser.add_argument("--facility-limit", type=int, default=FACILITY_LIMIT)
+    parser.add_argument("--limited-limit", type=int, default=LIMITED_LIMIT)
+    parser.add_argument(
+        "--limit",
+        type=parse_limit,
+        action="append",
+        default=[],
+        metavar="FACILITY=N",
+        help="per facility --facility-limit",
+    )
+    args = parser.parse_args(argv)
+
+    capacity = json.load(args.capacity) if args.capacity else get_capacity()
+    plan_durations = durations(json.load(args.history)) if args.history else {}
+    runs = matrix(json.load(args.testplan)["hwtests"], args.v)
+
+    scheduled, unschedulable = schedule(
+        runs,
+        capacity,
+        plan_durations,
+        args.duration,
+        args.facility_limit,
+        args.limited_limit,
+        dict(args.limit),
+    )
+    for r in unschedulable:
+        print(
+            "%s is unavailable everywhere, skipping %s" % (r["plan"], r["hostname"]),
+            file=sys.stderr,
+        )
+    print(
+        "%d runs, done in %.0fs"
+        % (len(scheduled), makespan(scheduled, plan_durations, args.duration)),
+        file=sys.stderr,
+    )
+    print(json.dumps(scheduled, indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
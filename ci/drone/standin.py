@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+A local stand-in for the device API, to load test tester.py offline.
+
+Serves the create, get and delete device endpoints tester.py uses. Devices
+stay queued for --queued seconds, provision for --provision seconds give or
+take --jitter and then go active on 127.0.0.1, where a listener greets like an
+ssh server. --error-rate of the requests are answered with a 504. The requests
+and connections it served are counted, so the polling and pooling show up.
+
+    ./standin.py serve --port 8000 --ssh-port 2222
+    ./standin.py load -n 500 --provision 60
+"""
+
+import argparse
+import asyncio
+import collections
+import http.server
+import itertools
+import json
+import random
+import socketserver
+import sys
+import threading
+import time
+import uuid
+
+import tester
+
+
+class Devices:
+    def __init__(self, queued, provision, jitter, error_rate):
+        self.queued = queued
+        self.provision = provision
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.devices = {}
+        self.lock = threading.Lock()
+        self.requests = collections.Counter()
+        self.connections = 0
+
+    def create(self, body):
+        provision = self.provision * random.uniform(1 - self.jitter, 1 + self.jitter)
+        device = dict(body, id=str(uuid.uuid4()))
+        with self.lock:
+            self.devices[device["id"]] = (time.monotonic(), provision, device)
+        return self.view(device["id"])
+
+    def view(self, device_id):
+        with self.lock:
+            created, provision, device = self.devices[device_id]
+        elapsed = time.monotonic() - created
+        if elapsed < self.queued:
+            state, ips = "queued", []
+        elif elapsed < self.queued + provision:
+            state, ips = "provisioning", []
+        else:
+            state = "active"
+            ips = [{"address": "127.0.0.1", "address_family": 4, "public": True}]
+        return dict(device, state=state, ip_addresses=ips)
+
+    def delete(self, device_id):
+        with self.lock:
+            del self.devices[device_id]
+
+
+def make_handler(devices):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def setup(self):
+            super().setup()
+            with devices.lock:
+                devices.connections += 1
+
+        def reply(self, status, body=None):
+            data = json.dumps(body).encode() if body is not None else b""
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def route(self, method):
+            n = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(n).decode()) if n else None
+            parts = self.path.strip("/").split("/")
+            name = "%s /%s" % (method, parts[0])
+            with devices.lock:
+                devices.requests[name] += 1
+            if random.random() < devices.error_rate:
+                return self.reply(504, {"errors": ["Gateway Timeout"]})
+
+            try:
+                if method == "POST" and len(parts) == 3 and parts[2] == "devices":
+                    return self.reply(201, devices.create(body))
+                if len(parts) == 2 and parts[0] == "devices":
+                    if method == "GET":
+                        return self.reply(200, devices.view(parts[1]))
+                    if method == "DELETE":
+                        devices.delete(parts[1])
+                        return self.reply(204)
+            except KeyError:
+                return self.reply(404, {"errors": ["Not found"]})
+            self.reply(404, {"errors": ["Not found"]})
+
+        def do_GET(self):
+            self.route("GET")
+
+        def do_POST(self):
+            self.route("POST")
+
+        def do_DELETE(self):
+            self.route("DELETE")
+
+    return Handler
+
+
+class SSHGreeter(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.request.sendall(b"SSH-2.0-OpenSSH_standin\r\n")
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def start(devices, host="127.0.0.1", port=0, ssh_port=0):
+    """Serves the api and the ssh greeting in the background, returns both
+    servers."""
+    api = Server((host, port), make_handler(devices))
+    ssh = Server((host, ssh_port), SSHGreeter)
+    for s in (api, ssh):
+        threading.Thread(target=s.serve_forever, daemon=True).start()
+    return api, ssh
+
+
+def load(devices, n, plans, concurrency, connections, stagger, fast, slow):
+    api_server, ssh_server = start(devices)
+    api = tester.API(
+        "http://127.0.0.1:%d" % api_server.server_address[1], "standin", connections
+    )
+    t = tester.Tester(
+        api,
+        "standin",
+        ssh_port=ssh_server.server_address[1],
+        fast=fast,
+        slow=slow,
+        expected={"queued": devices.queued, "provisioning": devices.provision},
+    )
+    plans = itertools.cycle(plans)
+    runs = [
+        tester.Run("load-%d" % i, next(plans), "standin", "http://standin/ipxe")
+        for i in range(n)
+    ]
+    started = time.monotonic()
+    try:
+        asyncio.get_event_loop().run_until_complete(t.run(runs, concurrency, stagger))
+    finally:
+        api.close()
+        api_server.shutdown()
+        ssh_server.shutdown()
+
+    summary = tester.summarize(runs)
+    summary.update(
+        wall_time=time.monotonic() - started,
+        api_requests=dict(devices.requests),
+        api_connections=devices.connections,
+        requests_per_run=sum(devices.requests.values()) / float(n),
+    )
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="stand in for the device api")
+    parser.add_argument("--queued", type=float, default=2, help="seconds")
+    parser.add_argument("--provision", type=float, default=20, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.25, help="fraction")
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    sub = parser.add_subparsers(dest="command")
+
+    p = sub.add_parser("serve", help="serve until interrupted")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8000)
+    p.add_argument("--ssh-port", type=int, default=2222)
+
+    p = sub.add_parser("load", help="run a batch of tester runs against it")
+    p.add_argument("-n", type=int, default=100, help="runs")
+    p.add_argument("--plan", action="append", help="default c3.small.x86")
+    p.add_argument("--concurrency", type=int)
+    p.add_argument("--connections", type=int, default=8)
+    p.add_argument("--stagger", type=float, default=1, help="seconds")
+    p.add_argument("--fast", type=float, default=0.5, help="seconds")
+    p.add_argument("--slow", type=float, default=5, help="seconds")
+
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_usage(sys.stderr)
+        return 2
+
+    devices = Devices(args.queued, args.provision, args.jitter, args.error_rate)
+    if args.command == "serve":
+        api, ssh = start(devices, args.host, args.port, args.ssh_port)
+        print(
+            "standin: api on %s:%d, ssh on %s:%d"
+            % (args.host, args.port, args.host, args.ssh_port)
+        )
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    summary = load(
+        devices,
+        args.n,
+        args.plan or ["c3.small.x86"],
+        args.concurrency,
+        args.connections,
+        args.stagger,
+        args.fast,
+        args.slow,
+    )
+    print(json.dumps(summary, indent=2, sort_keys=True))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
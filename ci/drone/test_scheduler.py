@@ -0,0 +1,108 @@
+import json
+import os
+
+import scheduler
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+def fixture(name):
+    with open(os.path.join(here, name)) as f:
+        return json.load(f)
+
+
+def overlap(runs, duration, key):
+    """The most runs with the same key running at once."""
+    events = []
+    for r in runs:
+        events.append((r["start"], 1, key(r)))
+        events.append((r["start"] + duration, -1, key(r)))
+    most = {}
+    running = {}
+    # ends sort before starts at the same time
+    for _, delta, k in sorted(events):
+        running[k] = running.get(k, 0) + delta
+        most[k] = max(most.get(k, 0), running[k])
+    return most
+
+
+def test_by_plan():
+    cap = scheduler.by_plan(fixture("capacity-fixture.json"))
+    assert cap["c1.large.arm"] == {
+        "limited": ["ewr1"],
+        "normal": ["nrt1", "sjc1"],
+        "unavailable": ["dfw2"],
+    }
+
+
+def test_schedule_fixture():
+    capacity = fixture("capacity-fixture.json")
+    cap = scheduler.by_plan(capacity)
+    runs = scheduler.matrix(fixture("drone-data.json")["hwtests"], "v1")
+
+    scheduled, unschedulable = scheduler.schedule(runs, capacity, facility_limit=4)
+
+    assert len(scheduled) + len(unschedulable) == len(runs)
+    assert {r["plan"] for r in unschedulable} == {"x1.small.x86"}
+    for r in scheduled:
+        assert r["facility"] in cap[r["plan"]][r["level"]]
+    assert all(
+        n <= 4 for n in overlap(scheduled, 1800, lambda r: r["facility"]).values()
+    )
+    limited = [r for r in scheduled if r["level"] == "limited"]
+    assert all(
+        n <= 1
+        for n in overlap(limited, 1800, lambda r: (r["facility"], r["plan"])).values()
+    )
+    # c1.large.arm.xda is only limited in nrt1, its 3 runs go one after the other
+    assert scheduler.makespan(scheduled) == 3 * 1800
+
+
+def test_schedule_prefers_normal():
+    capacity = {"ams1": {"p": {"level": "limited"}}, "dfw2": {"p": {"level": "normal"}}}
+    runs = [{"hostname": "a", "plan": "p"}]
+    scheduled, _ = scheduler.schedule(runs, capacity)
+    assert scheduled[0]["facility"] == "dfw2"
+
+
+def test_schedule_spreads_past_busy_facilities():
+    capacity = {fac: {"p": {"level": "normal"}} for fac in ("ams1", "ewr1")}
+    runs = [{"hostname": str(i), "plan": "p"} for i in range(3)]
+
+    scheduled, _ = scheduler.schedule(
+        runs, capacity, duration=10, facility_limit=1, limits={"ams1": 2}
+    )
+
+    assert sorted((r["facility"], r["start"]) for r in scheduled) == [
+        ("ams1", 0),
+        ("ams1", 0),
+        ("ewr1", 0),
+    ]
+
+
+def test_schedule_uses_history():
+    capacity = {"ewr1": {"big": {"level": "normal"}, "small": {"level": "normal"}}}
+    runs = [
+        {"hostname": "b", "plan": "big"},
+        {"hostname": "s1", "plan": "small"},
+        {"hostname": "s2", "plan": "small"},
+    ]
+    history = {
+        "runs": [
+            {"plan": "big", "test_time": 100, "error": None},
+            {"plan": "small", "test_time": 10, "error": None},
+            {"plan": "small", "test_time": 5000, "error": "timed out"},
+        ]
+    }
+    durations = scheduler.durations(history)
+    assert durations == {"big": 100, "small": 10}
+
+    scheduled, _ = scheduler.schedule(runs, capacity, durations, facility_limit=2)
+
+    # the long run starts right away, the short ones share the other slot
+    assert [(r["hostname"], r["start"]) for r in scheduled] == [
+        ("b", 0),
+        ("s1", 0),
+        ("s2", 10),
+    ]
+    assert scheduler.makespan(scheduled, durations) == 100
@@ -1,176 +1,417 @@
 #!/usr/bin/env python3
-
-from __future__ import print_function
-
+"""
+Provisions and tests a batch of devices from one process.
+
+Each run creates a custom_ipxe device that boots the osie under test, waits for
+it to go active and greet on ssh, then deletes it. time-to-active is measured
+from the create to the ssh greeting and test-time to the delete, and both are
+reported as percentiles across the batch.
+
+All runs share one pool of keep-alive connections to the API. Each device
+state is polled often around when the device is expected to leave it and less
+the further off that is. The expected durations come from the runs of the same
+plan that already got through the state, or from EXPECTED until one did.
+Throttling and 5xx answers are retried with jittered exponential backoff.
+
+    ./tester.py --runs runs.json --results results.json
+
+runs.json is a list of {"hostname", "plan", "facility", "ipxe_script_url"}
+objects, as scheduler.py writes them. A run is started "start" seconds into the
+batch if it has one, other keys are kept in the results. Without --runs the device
+described by the DEVICE_* environment variables is tested, as prov-test.sh
+does. standin.py serves a local stand-in of the API to load test this offline.
+"""
+
+import argparse
+import asyncio
 import datetime
-import functools
+import http.client
+import json
 import os
-import socket
+import queue
+import random
+import statistics
 import sys
+import threading
 import time
-
-import packet
-
-project = os.environ["PACKET_PROJECT_ID"]
-token = os.environ["PACKET_API_TOKEN"]
-hostname = os.environ["DEVICE_HOSTNAME"]
-ipxe_script_url = os.environ["DEVICE_IPXE_SCRIPT_URL"]
-plan = os.environ["DEVICE_PLAN"]
-facility = os.environ["DEVICE_FACILITY"]
-
-timeout = 600
-
-if sys.version_info[0] == 2:
-    oldprint = print
-
-    def myprint(*args, **kwargs):
-        flush = kwargs.pop("flush", False)
-        f = kwargs.get("file", sys.stdout)
-
-        oldprint(*args, **kwargs)
-
-        if flush:
-            f.flush()
-
-    print = functools.update_wrapper(myprint, print)
-
-print = functools.partial(print, hostname + ":", flush=True)
-
-
-class Device:
-    def __init__(self, manager):
-        self.m = manager
-        self.dev = None
+import urllib.parse as parse
+from concurrent import futures
+
+API_URL = "https://api.packet.net"
+TIMEOUT = 3600
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# seconds, until a run of the plan got through the state
+EXPECTED = {"queued": 60, "provisioning": 900}
+FAST = 5
+SLOW = 60
+
+
+class APIError(Exception):
+    def __init__(self, status, message):
+        super().__init__("%d %s" % (status, message))
+        self.status = status
+
+
+class API:
+    """The device endpoints over a pool of keep-alive connections, requests
+    run in a thread per connection."""
+
+    def __init__(self, url, token, size=8, timeout=60):
+        u = parse.urlparse(url)
+        self.connection = (
+            http.client.HTTPSConnection
+            if u.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        self.host = u.netloc
+        self.base = u.path.rstrip("/")
+        self.headers = {
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+            "X-Auth-Token": token,
+        }
+        self.timeout = timeout
+        self.pool = queue.LifoQueue()
+        for _ in range(size):
+            self.pool.put(None)
+        self.executor = futures.ThreadPoolExecutor(max_workers=size)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def _request(self, method, path, body):
+        conn = self.pool.get()
+        try:
+            if conn is None:
+                conn = self.connection(self.host, timeout=self.timeout)
+            data = json.dumps(body) if body is not None else None
+            try:
+                conn.request(method, self.base + path, data, self.headers)
+                resp = conn.getresponse()
+                raw = resp.read()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                raise
+        finally:
+            self.pool.put(conn)
+
+        with self.lock:
+            self.requests += 1
+        if resp.status >= 400:
+            try:
+                message = "; ".join(json.loads(raw.decode())["errors"])
+            except (ValueError, KeyError, TypeError):
+                message = resp.reason
+            raise APIError(resp.status, message)
+        return json.loads(raw.decode()) if raw else None
+
+    async def request(self, method, path, body=None):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.executor, self._request, method, path, body
+        )
+
+    def close(self):
+        self.executor.shutdown()
+        while not self.pool.empty():
+            conn = self.pool.get()
+            if conn:
+                conn.close()
+
+
+class Run:
+    def __init__(self, hostname, plan, facility, ipxe_script_url, start=0, **extra):
+        self.hostname = hostname
+        self.plan = plan
+        self.facility = facility
+        self.ipxe_script_url = ipxe_script_url
+        # seconds into the batch, as planned by scheduler.py
+        self.start = start
+        self.extra = extra
         self.id = None
         self.ip = None
+        self.state = None
+        self.time_to_active = None
+        self.test_time = None
+        self.error = None
+
+    def log(self, *args):
+        print(self.hostname + ":", *args, flush=True)
+
+    def update(self, device):
+        self.id = device["id"]
+        self.state = device["state"]
+        if not self.ip:
+            ips = [
+                ip["address"]
+                for ip in device.get("ip_addresses") or ()
+                if ip["address_family"] == 4 and ip["public"]
+            ]
+            if ips:
+                self.ip = ips[0]
+
+    def result(self):
+        return dict(
+            self.extra,
+            start=self.start,
+            hostname=self.hostname,
+            plan=self.plan,
+            facility=self.facility,
+            id=self.id,
+            time_to_active=self.time_to_active,
+            test_time=self.test_time,
+            error=self.error,
+        )
 
-    def __until(self, func):
-        """
-        Runs `func` in a loop until timeout or func returns Falsy. Will handle
-        504 errors in a way that makes sense. Stop is indicated as Falsy so that
-        funcs do not have to explicitly return anything, Python's implicit None
-        will break the loop.
-        """
-        end = time.time() + timeout
-        while end > time.time():
+    def __repr__(self):
+        return "{} {} {}".format(self.id, self.state, self.ip)
+
+
+def poll_interval(elapsed, expected, fast=FAST, slow=SLOW):
+    """Seconds until the next poll of a state entered elapsed seconds ago that
+    is expected to last expected seconds. Never polls past the expected end and
+    backs off the further from it, before or after."""
+    return max(fast, min(slow, abs((expected or 0) - elapsed) / 4))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def summarize(runs):
+    out = {"runs": len(runs), "failed": sum(1 for r in runs if r.error)}
+    for name in ("time_to_active", "test_time"):
+        values = [getattr(r, name) for r in runs if not r.error]
+        if values:
+            out[name] = {
+                "min": min(values),
+                "p50": percentile(values, 50),
+                "p90": percentile(values, 90),
+                "p99": percentile(values, 99),
+                "max": max(values),
+            }
+    return out
+
+
+class Tester:
+    def __init__(
+        self,
+        api,
+        project,
+        timeout=TIMEOUT,
+        ssh_port=22,
+        fast=FAST,
+        slow=SLOW,
+        expected=EXPECTED,
+    ):
+        self.api = api
+        self.project = project
+        self.timeout = timeout
+        self.ssh_port = ssh_port
+        self.fast = fast
+        self.slow = slow
+        self.defaults = dict(expected)
+        # (plan, state) -> seconds the runs that got through it spent in it
+        self.durations = {}
+
+    def expected(self, plan, state):
+        seen = self.durations.get((plan, state))
+        if seen:
+            return statistics.median(seen)
+        return self.defaults.get(state)
+
+    async def call(self, run, deadline, method, path, body=None):
+        delay = self.fast
+        while True:
             try:
-                if not func():
-                    return
-            except packet.baseapi.Error as e:
-                if "504" in str(e):
-                    print("504")
-                    time.sleep(30)
-                    continue
-                print(e)
-                sys.exit(1)
-
-            time.sleep(10)
-
-        print("timed out")
-        sys.exit(1)
-
-    def create(self, project, hostname, plan, facility, ipxe_script_url):
-        def __create():
-            tt = datetime.datetime.utcnow() + datetime.timedelta(hours=2)
-            d = self.m.create_device(
-                project,
-                hostname,
-                plan,
-                facility,
-                "custom_ipxe",
-                ipxe_script_url=ipxe_script_url,
-                spot_instance=True,
-                spot_price_max=20,
-                termination_time=tt.isoformat(),
+                return await self.api.request(method, path, body)
+            except (APIError, OSError, http.client.HTTPException) as e:
+                if isinstance(e, APIError) and e.status not in RETRY_STATUS:
+                    raise
+                if time.monotonic() + delay > deadline:
+                    raise
+                run.log(e, "retrying")
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+            delay = min(self.slow, delay * 2)
+
+    async def create(self, run, deadline):
+        tt = datetime.datetime.utcnow() + datetime.timedelta(hours=2)
+        device = await self.call(
+            run,
+            deadline,
+            "POST",
+            "/projects/%s/devices" % self.project,
+            {
+                "hostname": run.hostname,
+                "plan": run.plan,
+                "facility": run.facility,
+                "operating_system": "custom_ipxe",
+                "ipxe_script_url": run.ipxe_script_url,
+                "spot_instance": True,
+                "spot_price_max": 20,
+                "termination_time": tt.isoformat(),
+            },
+        )
+        run.update(device)
+
+    async def wait_active(self, run, deadline):
+        since = time.monotonic()
+        state = run.state
+        run.log(run)
+        while run.state != "active":
+            if run.state == "failed":
+                raise RuntimeError("device failed")
+            if time.monotonic() > deadline:
+                raise RuntimeError("timed out waiting for active")
+            wait = poll_interval(
+                time.monotonic() - since,
+                self.expected(run.plan, run.state),
+                self.fast,
+                self.slow,
             )
+            await asyncio.sleep(wait)
+            run.update(await self.call(run, deadline, "GET", "/devices/" + run.id))
+            if run.state != state:
+                now = time.monotonic()
+                self.durations.setdefault((run.plan, state), []).append(now - since)
+                since, state = now, run.state
+                run.log(run)
+
+    async def ssh_greeting(self, ip):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(ip, self.ssh_port), 10
+        )
+        try:
+            return (await asyncio.wait_for(reader.read(100), 10)).decode(
+                errors="replace"
+            )
+        finally:
+            writer.close()
 
-            self.dev = d
-            self.id = d.id
-
-        self.__until(__create)
-
-    def refresh(self):
-        def __refresh():
-            d = self.m.get_device(self.id)
-            self.dev = d
-            if d.ip_addresses and not self.ip:
-                ips = [
-                    ip
-                    for ip in d.ip_addresses
-                    if ip["address_family"] == 4 and ip["public"]
-                ]
-                if ips:
-                    self.ip = ips[0]["address"]
-
-        self.__until(__refresh)
-
-    def state(self):
-        self.refresh()
-        return self.dev.state
-
-    def wait_for_ssh(self):
-        def __wait_for_ssh():
-            if self.state() != "active":
-                print(self, "state is not active")
-                return
-
-            s = socket.socket()
-            s.settimeout(10)
+    async def wait_for_ssh(self, run, deadline):
+        delay = self.fast
+        while True:
             try:
-                s.connect((self.ip, 22))
-                msg = s.recv(100).decode()
-            except socket.error:
-                return True
-
-            if "ssh" in msg.lower():
-                print(self, msg.strip())
-                return
-
-            print(self, "not ssh greeting")
-
-        self.__until(__wait_for_ssh)
-
-    def delete(self):
-        def __delete():
-            self.dev.delete()
-
-        self.__until(__delete)
-
-    def __repr__(self):
-        state = None
-        if self.dev:
-            state = self.dev.state
-        return "{} {} {}".format(self.id, state, self.ip)
-
-
-def main():
-    print("instantiating manager")
-    m = packet.Manager(token)
-    print("instantiating device")
-    d = Device(m)
-    print("creating device")
-    d.create(project, hostname, plan, facility, ipxe_script_url)
-    start = time.time()
-    print(d)
-
-    state = None
-    while True:
-        state, oldstate = d.state(), state
-        if state != oldstate:
-            print(d)
-        if state == "active":
-            break
-        time.sleep(30)
-
-    d.wait_for_ssh()
-    print(d, "time-to-active", time.time() - start)
-    print(d, "deleting")
-    d.delete()
-    print(d, "test-time", time.time() - start)
+                msg = await self.ssh_greeting(run.ip)
+                if "ssh" in msg.lower():
+                    run.log(run, msg.strip())
+                    return
+                run.log(run, "not ssh greeting")
+            except (OSError, asyncio.TimeoutError):
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError("timed out waiting for ssh")
+            await asyncio.sleep(delay)
+            delay = min(self.slow, delay * 1.5)
+
+    async def delete(self, run):
+        deadline = time.monotonic() + 600
+        try:
+            await self.call(run, deadline, "DELETE", "/devices/" + run.id)
+        except APIError as e:
+            if e.status != 404:
+                raise
+
+    async def test(self, run):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        try:
+            await self.create(run, deadline)
+            start = time.monotonic()
+            await self.wait_active(run, deadline)
+            if not run.ip:
+                raise RuntimeError("active without a public ipv4 address")
+            await self.wait_for_ssh(run, deadline)
+            run.time_to_active = time.monotonic() - start
+            run.log(run, "time-to-active", run.time_to_active)
+        except Exception as e:
+            run.error = str(e) or type(e).__name__
+            run.log(run, "failed:", run.error)
+
+        if run.id:
+            run.log(run, "deleting")
+            try:
+                await self.delete(run)
+            except Exception as e:
+                run.error = run.error or "delete failed: %s" % e
+                run.log(run, "delete failed:", e)
+        run.test_time = time.monotonic() - start
+        run.log(run, "test-time", run.test_time)
+
+    async def run(self, runs, concurrency=None, stagger=0, facility_limit=None):
+        limit = len(runs) or 1
+        sem = asyncio.Semaphore(concurrency or limit)
+        facilities = {
+            fac: asyncio.Semaphore(facility_limit or limit)
+            for fac in set(r.facility for r in runs)
+        }
+
+        async def one(run):
+            # spreads the creates out a bit, like prov-test.sh used to
+            await asyncio.sleep(run.start + random.uniform(0, stagger))
+            async with sem, facilities[run.facility]:
+                await self.test(run)
+
+        await asyncio.gather(*(one(r) for r in runs))
+        return runs
+
+
+def env_run():
+    return Run(
+        os.environ["DEVICE_HOSTNAME"],
+        os.environ["DEVICE_PLAN"],
+        os.environ["DEVICE_FACILITY"],
+        os.environ["DEVICE_IPXE_SCRIPT_URL"],
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="provision and test devices")
+    parser.add_argument("--runs", metavar="FILE", help="json list of runs")
+    parser.add_argument("--api-url", default=os.getenv("PACKET_API_URL", API_URL))
+    parser.add_argument("--ssh-port", type=int, default=22)
+    parser.add_argument("--concurrency", type=int, help="default all at once")
+    parser.add_argument("--facility-limit", type=int, help="runs per facility at once")
+    parser.add_argument("--connections", type=int, default=8)
+    parser.add_argument("--stagger", type=float, default=30, help="seconds")
+    parser.add_argument("--timeout", type=int, default=TIMEOUT, help="seconds per run")
+    parser.add_argument("--results", metavar="FILE", help="write the results to FILE")
+    args = parser.parse_args(argv)
+
+    if args.runs:
+        with open(args.runs) as f:
+            runs = [Run(**r) for r in json.load(f)]
+    else:
+        runs = [env_run()]
+
+    api = API(args.api_url, os.environ["PACKET_API_TOKEN"], args.connections)
+    tester = Tester(
+        api, os.environ["PACKET_PROJECT_ID"], args.timeout, ssh_port=args.ssh_port
+    )
+    try:
+        asyncio.get_event_loop().run_until_complete(
+            tester.run(runs, args.concurrency, args.stagger, args.facility_limit)
+        )
+    finally:
+        api.close()
+
+    summary = summarize(runs)
+    summary["api_requests"] = api.requests
+    print(json.dumps(summary, indent=2, sort_keys=True))
+    if args.results:
+        with open(args.results, "w") as f:
+            json.dump(
+                {"summary": summary, "runs": [r.result() for r in runs]},
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+    return 1 if summary["failed"] else 0
 
 
 if __name__ == "__main__":
-    try:
-        main()
-    except Exception as e:
-        print(hostname + ":", e)
+    sys.exit(main())
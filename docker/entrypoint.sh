@@ -27,6 +27,14 @@ exec 3>&1
 exec 2> >(tee /proc/self/fd/3 | logger -n "$RLOGHOST" -P 514 -t "$container_uuid")
 exec 1>&2
 
+# the boot drivers the initramfs recorded for this hardware, logged once so
+# they can be collected into installer/alpine/module-profiles
+for profile in /statedir/modprobe-profiles/*; do
+	[[ -f $profile ]] || continue
+	echo "modprobe-profile ${profile##*/} $(tr '\n' ' ' <"$profile")"
+	rm -f "$profile"
+done
+
 mount | awk '/on \/dev/ {print $3}' | sort -ru
 mount | awk '/on \/dev/ {print $3}' | sort -ru | while read -r mount; do
 	umount "$mount" || :
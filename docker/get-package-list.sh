@@ -54,6 +54,7 @@ packages=(
 	mdadm
 	parted
 	pciutils
+	pigz
 	pv
 	python3
 	sg3-utils
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+# Block map based raw image deployment.
+#
+# A block mapped image is a raw filesystem (or disk) image plus a json block map
+# listing the ranges of the image that hold data, everything else is free space
+# that does not need to be written at all. The block map looks like:
+#
+#   {
+#     "format": "osie-bmap/1",
+#     "image_size": 4294967296,
+#     "block_size": 4096,
+#     "fstype": "ext4",
+#     "ranges": [[0, 1023, "<sha256 of blocks 0-1023>"], ...]
+#   }
+#
+# ranges are inclusive block numbers, sorted and non overlapping, each with the
+# sha256 of its content so corruption is caught per range. `fstype` is the type
+# of filesystem the image holds, or null for whole disk images.
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+FORMAT = "osie-bmap/1"
+CHUNK_SIZE = 8 * 1024 * 1024
+MAX_RANGE_SIZE = 64 * 1024 * 1024
+
+
+class BlockMapError(Exception):
+    pass
+
+
+def load(path):
+    with open(path) as f:
+        bmap = json.load(f)
+
+    if bmap.get("format") != FORMAT:
+        raise BlockMapError("unsupported block map format: %s" % bmap.get("format"))
+
+    bs = bmap["block_size"]
+    if bs <= 0 or bs % 512:
+        raise BlockMapError("block size must be a multiple of 512: %d" % bs)
+
+    blocks = (bmap["image_size"] + bs - 1) // bs
+    prev = -1
+    for first, last, _ in bmap["ranges"]:
+        if first <= prev or last < first or last >= blocks:
+            raise BlockMapError("bad range: %d-%d" % (first, last))
+        prev = last
+
+    return bmap
+
+
+def mapped_bytes(bmap):
+    bs = bmap["block_size"]
+    return sum(
+        min((last + 1) * bs, bmap["image_size"]) - first * bs
+        for first, last, _ in bmap["ranges"]
+    )
+
+
+def _read_exact(f, n):
+    buf = f.read(n)
+    while len(buf) < n:
+        more = f.read(n - len(buf))
+        if not more:
+            raise BlockMapError("image is shorter than the block map says")
+        buf += more
+    return buf
+
+
+def _skip(f, n):
+    if n == 0:
+        return
+    if f.seekable():
+        f.seek(n, os.SEEK_CUR)
+        return
+    while n:
+        n -= len(_read_exact(f, min(n, CHUNK_SIZE)))
+
+
+def write(bmap, image, fd, progress=None):
+    """Writes the mapped ranges of `image` (a file object, seekable or not) to `fd`.
+
+    Only the mapped ranges are written, in large writes at their offset in the
+    image, each range is verified against its checksum. Returns the number of
+    bytes written.
+    """
+    bs = bmap["block_size"]
+    size = bmap["image_size"]
+
+    devsize = os.lseek(fd, 0, os.SEEK_END)
+    if devsize < size:
+        raise BlockMapError(
+            "image (%d bytes) does not fit the device (%d bytes)" % (size, devsize)
+        )
+
+    pos = 0
+    written = 0
+    for first, last, digest in bmap["ranges"]:
+        start = first * bs
+        end = min((last + 1) * bs, size)
+        _skip(image, start - pos)
+
+        h = hashlib.sha256()
+        off = start
+        while off < end:
+            buf = _read_exact(image, min(CHUNK_SIZE, end - off))
+            h.update(buf)
+            off += os.pwrite(fd, buf, off)
+
+        if h.hexdigest() != digest:
+            raise BlockMapError("checksum mismatch for blocks %d-%d" % (first, last))
+
+        pos = end
+        written += end - start
+        if progress:
+            progress(written)
+
+    os.fsync(fd)
+    return written
+
+
+def create(path, block_size=4096, fstype=None):
+    """Generates the block map of a sparse raw image, holes are the unmapped ranges."""
+    size = os.path.getsize(path)
+    ranges = []
+    per_range = MAX_RANGE_SIZE // block_size
+    with open(path, "rb") as f:
+        fd = f.fileno()
+        data = 0
+        while data < size:
+            try:
+                data = os.lseek(fd, data, os.SEEK_DATA)
+            except OSError:
+                # ENXIO, no more data past this offset
+                break
+            hole = os.lseek(fd, data, os.SEEK_HOLE)
+
+            first = data // block_size
+            last = (hole - 1) // block_size
+            while first <= last:
+                end = min(first + per_range - 1, last)
+                f.seek(first * block_size)
+                n = min((end + 1) * block_size, size) - first * block_size
+                h = hashlib.sha256()
+                while n:
+                    buf = f.read(min(n, CHUNK_SIZE))
+                    h.update(buf)
+                    n -= len(buf)
+                ranges.append([first, end, h.hexdigest()])
+                first = end + 1
+            # hole boundaries need not be block aligned, carry on past the
+            # (partially) mapped last block so it is not mapped twice
+            data = (last + 1) * block_size
+
+    return {
+        "format": FORMAT,
+        "image_size": size,
+        "block_size": block_size,
+        "fstype": fstype,
+        "ranges": ranges,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="block map raw image deployment")
+    sub = parser.add_subparsers(dest="command")
+
+    p = sub.add_parser("check", help="validate a block map, optionally for a fs type")
+    p.add_argument("bmap")
+    p.add_argument("fstype", nargs="?")
+
+    p = sub.add_parser("write", help="write the mapped ranges of an image to a device")
+    p.add_argument("bmap")
+    p.add_argument("image", help="raw image, - for stdin")
+    p.add_argument("device")
+
+    p = sub.add_parser("create", help="generate the block map of a sparse raw image")
+    p.add_argument("-b", "--block-size", type=int, default=4096)
+    p.add_argument("-t", "--fstype")
+    p.add_argument("image")
+
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_usage(sys.stderr)
+        return 2
+
+    try:
+        if args.command == "check":
+            bmap = load(args.bmap)
+            if args.fstype and bmap.get("fstype") != args.fstype:
+                print(
+                    "block map is for %s, not %s" % (bmap.get("fstype"), args.fstype),
+                    file=sys.stderr,
+                )
+                return 1
+            return 0
+
+        if args.command == "create":
+            json.dump(create(args.image, args.block_size, args.fstype), sys.stdout)
+            print()
+            return 0
+
+        bmap = load(args.bmap)
+        image = sys.stdin.buffer if args.image == "-" else open(args.image, "rb")
+        fd = os.open(args.device, os.O_WRONLY)
+        try:
+            total = mapped_bytes(bmap)
+            print(
+                "writing %d of %d bytes (%d ranges) to %s"
+                % (total, bmap["image_size"], len(bmap["ranges"]), args.device),
+                file=sys.stderr,
+            )
+            written = write(bmap, image, fd)
+        finally:
+            os.close(fd)
+        print("wrote %d bytes" % written, file=sys.stderr)
+    except (BlockMapError, ValueError, KeyError) as e:
+        print("blockmap: %s" % e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
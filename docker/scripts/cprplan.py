@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+
+# CPR (custom partitioning and raid) compiler.
+#
+# Turns the storage section of the metadata (see ci/cpr/*.cpr.json) into a plan
+# of sgdisk/mdadm/mkfs operations. Each operation lists the operations it depends
+# on, so independent ones, like partitioning different disks or creating
+# filesystems on different arrays, run concurrently. The config is parsed and
+# validated once, up front, before any disk is touched.
+
+import argparse
+import collections
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+RAID_LEVELS = ("0", "1", "4", "5", "6", "10")
+# how the initial resync of new arrays is run, see mdresync.py
+RESYNC_MODES = ("full", "throttle", "defer")
+SIZE_RE = re.compile(r"^(\d+)([KMGTP]?|pct)$")
+
+# rough cost of each kind of operation in seconds, only used to estimate how
+# long a plan will take
+COSTS = {
+    "wipe": 5.0,
+    "partition": 1.0,
+    "raid": 2.0,
+    "mkfs": 3.0,
+    "mkswap": 0.5,
+}
+
+# how long to wait for the device nodes an operation needs to show up
+DEVICE_TIMEOUT = 30
+
+
+class CPRError(Exception):
+    pass
+
+
+Partition = collections.namedtuple("Partition", "number label size device")
+Disk = collections.namedtuple("Disk", "device partitions")
+Raid = collections.namedtuple("Raid", "name level devices")
+Filesystem = collections.namedtuple("Filesystem", "device format point options")
+Config = collections.namedtuple("Config", "disks raids filesystems")
+
+
+class Op:
+    """A step of the plan, one or more commands run in order.
+
+    Commands are (argv, may_fail) tuples. `needs` are the device paths that must
+    exist before the commands can run, `deps` the names of the ops producing them.
+    """
+
+    def __init__(self, name, kind, commands, deps=(), needs=(), cost=None):
+        self.name = name
+        self.kind = kind
+        self.commands = commands
+        self.deps = list(deps)
+        self.needs = list(needs)
+        self.cost = COSTS[kind] if cost is None else cost
+
+    def __repr__(self):
+        return "Op(%r)" % self.name
+
+
+def partition_device(disk, number):
+    # nvme0n1 -> nvme0n1p1, sda -> sda1
+    sep = "p" if disk[-1].isdigit() else ""
+    return "%s%s%d" % (disk, sep, number)
+
+
+def _field(obj, key, where, types):
+    if not isinstance(obj, dict) or key not in obj:
+        raise CPRError("%s: missing %s" % (where, key))
+    value = obj[key]
+    if not isinstance(value, types):
+        raise CPRError("%s: bad %s: %r" % (where, key, value))
+    return value
+
+
+def parse(doc):
+    """Validates a CPR document and returns it as a Config."""
+    disks = []
+    devices = set()
+    for i, d in enumerate(_field(doc, "disks", "cpr", list)):
+        where = "disks[%d]" % i
+        device = _field(d, "device", where, str)
+        if device in devices:
+            raise CPRError("%s: duplicate device %s" % (where, device))
+        devices.add(device)
+
+        parts = []
+        numbers = set()
+        raw = d.get("partitions") or []
+        for j, p in enumerate(raw):
+            pwhere = "%s.partitions[%d]" % (where, j)
+            number = _field(p, "number", pwhere, int)
+            if number < 1 or number in numbers:
+                raise CPRError("%s: bad or duplicate number %d" % (pwhere, number))
+            numbers.add(number)
+
+            size = str(_field(p, "size", pwhere, (int, str)))
+            m = SIZE_RE.match(size)
+            if not m or (m.group(2) == "pct" and not 0 < int(m.group(1)) <= 100):
+                raise CPRError("%s: bad size %r" % (pwhere, size))
+            if int(m.group(1)) == 0 and j != len(raw) - 1:
+                raise CPRError("%s: only the last partition can fill the disk" % pwhere)
+
+            label = str(p.get("label", ""))
+            pdev = partition_device(device, number)
+            devices.add(pdev)
+            parts.append(Partition(number, label, size, pdev))
+        disks.append(Disk(device, parts))
+
+    raids = []
+    for i, r in enumerate(doc.get("raid") or []):
+        where = "raid[%d]" % i
+        name = _field(r, "name", where, str)
+        level = str(_field(r, "level", where, (int, str)))
+        if level not in RAID_LEVELS:
+            raise CPRError("%s: unsupported raid level %s" % (where, level))
+        members = _field(r, "devices", where, list)
+        if not members:
+            raise CPRError("%s: no devices" % where)
+        for m in members:
+            if m not in devices:
+                raise CPRError(
+                    "%s: %s is not a disk or partition of the config" % (where, m)
+                )
+        if name in devices:
+            raise CPRError("%s: duplicate device %s" % (where, name))
+        devices.add(name)
+        raids.append(Raid(name, level, members))
+
+    filesystems = []
+    points = set()
+    for i, f in enumerate(_field(doc, "filesystems", "cpr", list)):
+        where = "filesystems[%d]" % i
+        mount = _field(f, "mount", where, dict)
+        device = _field(mount, "device", where, str)
+        if device not in devices:
+            raise CPRError(
+                "%s: %s is not a disk, partition or raid of the config"
+                % (where, device)
+            )
+        fmt = _field(mount, "format", where, str)
+        point = _field(mount, "point", where, str)
+        if point != "none" and point in points:
+            raise CPRError("%s: duplicate mount point %s" % (where, point))
+        points.add(point)
+        options = [str(o) for o in (mount.get("create") or {}).get("options") or []]
+        filesystems.append(Filesystem(device, fmt, point, options))
+
+    if "/" not in points:
+        raise CPRError("cpr: no filesystem is mounted at /")
+    if not any("BIOS" in p.label for d in disks for p in d.partitions):
+        raise CPRError("cpr: no BIOS partition, nothing to install the bootloader to")
+
+    return Config(disks, raids, filesystems)
+
+
+def load(path):
+    with open(path) as f:
+        try:
+            doc = json.load(f)
+        except ValueError as e:
+            raise CPRError("%s: %s" % (path, e))
+    return parse(doc)
+
+
+def disk_sectors(device):
+    """Size of device in 512 byte sectors, like `blockdev --getsz`."""
+    name = os.path.basename(os.path.realpath(device))
+    with open("/sys/class/block/%s/size" % name) as f:
+        return int(f.read())
+
+
+def _sgdisk_size(size, device, sectors):
+    m = SIZE_RE.match(size)
+    n, unit = int(m.group(1)), m.group(2)
+    if n == 0:
+        # the rest of the disk
+        return "0"
+    if unit != "pct":
+        return "+" + size
+    if sectors is None:
+        # only happens in dry runs without the disk around
+        return "+%dpct" % n
+    return "+%d" % (sectors(device) * n // 100)
+
+
+def plan(config, uefi=False, wipe=False, sectors=disk_sectors, resync="full"):
+    """Returns the ops that set up `config`, dependencies before dependents."""
+    ops = []
+    producer = {}
+
+    for disk in config.disks:
+        deps = []
+        if wipe:
+            name = "wipe %s" % disk.device
+            ops.append(
+                Op(
+                    name,
+                    "wipe",
+                    [
+                        (["blkdiscard", disk.device], True),
+                        (["sgdisk", "-Z", disk.device], False),
+                        (
+                            ["sh", "-c", 'mdadm --zero-superblock "$0"*', disk.device],
+                            False,
+                        ),
+                    ],
+                    needs=[disk.device],
+                )
+            )
+            deps = [name]
+
+        producer[disk.device] = deps[0] if deps else None
+        if not disk.partitions:
+            continue
+
+        # a single sgdisk call for all partitions, it applies them in order
+        argv = ["sgdisk"]
+        for p in disk.partitions:
+            ptype = "8300"
+            if "BIOS" in p.label:
+                ptype = "ef00" if uefi else "ef02"
+            size = _sgdisk_size(p.size, disk.device, sectors)
+            argv += [
+                "-n",
+                "%d:0:%s" % (p.number, size),
+                "-c",
+                "%d:%s" % (p.number, p.label),
+                "-t",
+                "%d:%s" % (p.number, ptype),
+            ]
+        argv.append(disk.device)
+
+        name = "partition %s" % disk.device
+        ops.append(
+            Op(
+                name,
+                "partition",
+                [(argv, False)],
+                deps=deps,
+                needs=[disk.device],
+                cost=COSTS["partition"] + 0.2 * len(disk.partitions),
+            )
+        )
+        for p in disk.partitions:
+            producer[p.device] = name
+
+    for raid in config.raids:
+        name = "raid %s" % raid.name
+        argv = [
+            "mdadm",
+            "--create",
+            raid.name,
+            "--force",
+            "--run",
+            "--level=%s" % raid.level,
+            "--raid-devices=%d" % len(raid.devices),
+        ]
+        commands = [(argv, False)]
+        if resync != "full" and raid.level != "0":
+            # the resync is held back until the install is done, the bitmap
+            # lets it carry on from where it got to
+            argv.append("--bitmap=internal")
+            commands.append((["./mdresync.py", resync, raid.name], True))
+        argv += raid.devices
+        deps = sorted(set(producer[d] for d in raid.devices if producer.get(d)))
+        ops.append(Op(name, "raid", commands, deps=deps, needs=raid.devices))
+        producer[raid.name] = name
+
+    for fs in config.filesystems:
+        if fs.format == "bios":
+            continue
+        if fs.format == "swap":
+            kind, argv = "mkswap", ["mkswap", fs.device]
+        else:
+            kind, argv = "mkfs", ["mkfs." + fs.format, "-F"] + fs.options + [fs.device]
+        deps = [producer[fs.device]] if producer.get(fs.device) else []
+        ops.append(
+            Op(
+                "%s %s" % (kind, fs.device),
+                kind,
+                [(argv, False)],
+                deps=deps,
+                needs=[fs.device],
+            )
+        )
+
+    return ops
+
+
+def expected_duration(ops):
+    """Returns (parallel, serial) duration estimates, parallel is the critical path."""
+    finish = {}
+    for op in ops:
+        finish[op.name] = max([finish[d] for d in op.deps] or [0]) + op.cost
+    return max(finish.values() or [0]), sum(op.cost for op in ops)
+
+
+def format_plan(ops):
+    index = {op.name: i + 1 for i, op in enumerate(ops)}
+    parallel, serial = expected_duration(ops)
+    lines = [
+        "# %d operations, expected duration %.1fs (%.1fs if run serially)"
+        % (len(ops), parallel, serial)
+    ]
+    for op in ops:
+        after = ""
+        if op.deps:
+            after = " after " + ", ".join("[%d]" % index[d] for d in op.deps)
+        lines.append("[%d] %s (%.1fs)%s" % (index[op.name], op.name, op.cost, after))
+        for argv, may_fail in op.commands:
+            cmd = " ".join(shlex.quote(a) for a in argv)
+            lines.append("    %s%s" % (cmd, " || :" if may_fail else ""))
+    return "\n".join(lines)
+
+
+def wait_for_devices(paths, timeout=DEVICE_TIMEOUT):
+    # partition nodes are created by udev after sgdisk re-reads the table
+    deadline = time.time() + timeout
+    for path in paths:
+        while not os.path.exists(path):
+            if time.time() > deadline:
+                raise CPRError("timed out waiting for %s" % path)
+            time.sleep(0.1)
+
+
+def run_op(op):
+    wait_for_devices(op.needs)
+    for argv, may_fail in op.commands:
+        print("cpr: %s: %s" % (op.name, " ".join(argv)), file=sys.stderr)
+        # stdout is reserved for the result
+        rc = subprocess.call(argv, stdout=sys.stderr)
+        if rc and not may_fail:
+            raise CPRError("%s: %s exited with %d" % (op.name, argv[0], rc))
+
+
+def execute(ops, jobs=None, run=run_op):
+    """Runs ops concurrently, each as soon as the ops it depends on are done.
+
+    Stops scheduling new ops on the first failure and raises it once the ones
+    already running are done.
+    """
+    pending = list(ops)
+    done = set()
+    running = {}
+    error = None
+    with ThreadPoolExecutor(max_workers=jobs or max(len(ops), 1)) as pool:
+        while pending or running:
+            if error is None:
+                for op in [op for op in pending if all(d in done for d in op.deps)]:
+                    pending.remove(op)
+                    running[pool.submit(run, op)] = op
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                op = running.pop(future)
+                if future.exception() is not None:
+                    error = error or future.exception()
+                else:
+                    done.add(op.name)
+
+    if error is not None:
+        raise error
+    if pending:
+        raise CPRError(
+            "unsatisfiable dependencies: %s" % ", ".join(op.name for op in pending)
+        )
+
+
+def blkid_uuid(device):
+    return (
+        subprocess.check_output(["blkid", "-s", "UUID", "-o", "value", device])
+        .decode()
+        .strip()
+    )
+
+
+def result(config, uuid=blkid_uuid):
+    """Returns the fstab, root uuid and boot devices of a set up config."""
+    fstab = []
+    seen = set()
+    rootuuid = None
+    for fs in config.filesystems:
+        if fs.format == "bios":
+            continue
+        u = uuid(fs.device)
+        if fs.point == "/":
+            rootuuid = u
+        if u in seen:
+            print(
+                "WARNING: Not adding %s to fstab again (it's already there!)" % u,
+                file=sys.stderr,
+            )
+            continue
+        seen.add(u)
+
+        options, fsck = "errors=remount-ro", 2
+        if fs.format == "swap":
+            options, fsck = "none", 0
+        if fs.point == "/":
+            fsck = 1
+        fstab.append(
+            "UUID=%s\t%s\t%s\t%s\t0\t%d\n" % (u, fs.point, fs.format, options, fsck)
+        )
+
+    bootdevs = [
+        d.device for d in config.disks for p in d.partitions if "BIOS" in p.label
+    ]
+    return {"fstab": "".join(fstab), "rootuuid": rootuuid, "bootdevs": bootdevs}
+
+
+def _bool(value):
+    return value == "true"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="compile and run CPR disk configs")
+    parser.add_argument(
+        "--uefi", type=_bool, default=False, help="true for EFI system partitions"
+    )
+    parser.add_argument(
+        "--wipe", type=_bool, default=False, help="true to wipe disks first"
+    )
+    parser.add_argument(
+        "--resync",
+        choices=RESYNC_MODES,
+        default="full",
+        help="how new arrays resync while the install runs",
+    )
+    parser.add_argument("-j", "--jobs", type=int, help="max concurrent operations")
+    parser.add_argument(
+        "--disk-size",
+        action="append",
+        default=[],
+        metavar="DEV=SECTORS",
+        help="disk size to plan pct sizes with, instead of the actual disk's",
+    )
+    parser.add_argument("command", choices=("plan", "run"), help="plan is a dry run")
+    parser.add_argument("config")
+    args = parser.parse_args(argv)
+
+    sizes = {}
+    for s in args.disk_size:
+        dev, _, n = s.partition("=")
+        sizes[dev] = int(n)
+
+    def sectors(device):
+        if device in sizes:
+            return sizes[device]
+        return disk_sectors(device)
+
+    try:
+        config = load(args.config)
+        if args.command == "plan":
+            have = sectors
+            if not all(
+                d.device in sizes or os.path.exists(d.device) for d in config.disks
+            ):
+                have = None
+            print(format_plan(plan(config, args.uefi, args.wipe, have, args.resync)))
+            return 0
+
+        ops = plan(config, args.uefi, args.wipe, sectors, args.resync)
+        start = time.time()
+        execute(ops, args.jobs)
+        print(
+            "cpr: %d operations done in %.1fs" % (len(ops), time.time() - start),
+            file=sys.stderr,
+        )
+        print(json.dumps(result(config)))
+    except (CPRError, OSError, subprocess.CalledProcessError) as e:
+        print("cpr: %s" % e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
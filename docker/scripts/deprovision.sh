@@ -107,6 +107,16 @@ fi
 
 stimer=$(date +%s)
 
+if ! modprobe ipmi_si ipmi_devintf; then
+	echo "Unable to modprobe si_ipmi or ipmi_devintf"
+fi
+
+# Catalog various BIOS feature states (not yet supported on aarch64), the
+# vendor tools are slow so this runs alongside the disk cleanup
+if [[ $arch == "x86_64" ]]; then
+	stage_run bios_inventory bios_inventory "${HARDWARE_ID}" "${class}" "${facility}"
+fi
+
 if [[ $preserve_data == false ]]; then
 	echo "Not preserving data."
 
@@ -141,51 +151,15 @@ if [[ $preserve_data == false ]]; then
 	if [[ -n $proc_mft ]] && [[ $system_version == "DVT" || $system_version == "EVT2" || $system_version == "100" || $system_version == "0100" ]]; then
 		echo "Skipping NVMe namespace management for $system_version system version"
 	elif ((${#nvme_drives[@]} > 0)); then
+		nvme_stages=()
 		for drive in "${nvme_drives[@]}"; do
-			nvme id-ctrl "$drive"
-			caps=$(nvme id-ctrl "$drive" -o json | jq -r '.oacs')
-			if (((caps & 0x8) == 0)); then
-				echo "Nvme drive $drive has no management capabilities, skipping..."
-				continue
-			fi
-
-			max_bytes=$(nvme id-ctrl "$drive" -o json | jq -r '.tnvmcap')
-			# shellcheck disable=SC2207
-			namespaces=($(nvme list-ns "$drive" -a | cut -d : -f 2))
-			echo "Found ${#namespaces[@]} namespaces on $drive"
-			if ((${#namespaces[@]} > 0)); then
-				for ns in "${namespaces[@]}"; do
-					echo "Deleting namespace $ns from $drive"
-					nvme delete-ns "$drive" -n "$ns"
-				done
-			fi
-			flbas=0
-			nvmemodel=$(nvme id-ctrl "$drive" -o json | jq -r '.mn' | sed -e 's/[[:space:]]*$//')
-			if [[ $nvmemodel == "INTEL SSDPE2KX040T8" ]]; then
-				# Set specific block size depending on physical BD
-				sectors=$((max_bytes / 4097))
-				flbas=1
-			else
-				# default flbas 0 uses 512 byte sector sizes
-				sectors=$((max_bytes / 512))
-			fi
-
-			echo "Creating a single namespace with $sectors sectors on $drive"
-			nsid=$(nvme create-ns "$drive" --nsze=$sectors --ncap=$sectors --flbas $flbas --dps=0 | cut -d : -f 3)
-			ctrl=$(nvme id-ctrl "$drive" -o json | jq '.cntlid')
-
-			echo "Attaching namespace $nsid to ctrl $ctrl on $drive"
-			nvme attach-ns "$drive" -n "$nsid" -c "$ctrl"
-			sleep 2
-
-			echo "Resetting controller $drive"
-			nvme reset "$drive"
-			sleep 2
-
-			echo "Rescanning namespaces on $drive"
-			nvme ns-rescan "$drive"
+			# all drives are reset concurrently
+			stage_run "nvme-reset-${drive##*/}" nvme_reset_namespaces "$drive"
+			nvme_stages+=("nvme-reset-${drive##*/}")
 		done
-		sleep 2
+		stage_wait "${nvme_stages[@]}"
+		# wait for the new namespaces' device nodes
+		udevadm settle
 		nvme list
 		# Resetting namespaces could've removed some previously detected disks
 		# defaults
@@ -262,19 +236,14 @@ fi
 
 # Run packet-hardware inventory to update API components and firmware details
 set_autofail_stage "running packet-hardware inventory"
-
-if ! modprobe ipmi_si ipmi_devintf; then
-	echo "Unable to modprobe si_ipmi or ipmi_devintf"
-fi
-
 if ! packet-hardware inventory --verbose --tinkerbell "${tinkerbell}/hardware-components"; then
 	echo "Warning: packet-hardware inventory failed for server ${id} (${class})"
 fi
 
-# Catalog various BIOS feature states (not yet supported on aarch64)
+# Wait for the BIOS feature inventory started before the disk cleanup
 set_autofail_stage "running bios_inventory"
 if [[ $arch == "x86_64" ]]; then
-	bios_inventory "${HARDWARE_ID}" "${class}" "${facility}"
+	stage_wait bios_inventory
 fi
 
 # Run eclypsium
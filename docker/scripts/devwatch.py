@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+# Waits for devices to show up or go away, driven by kernel uevents.
+#
+# Conditions are checked against the current state of /dev and /sys, once up
+# front and then again every time the kernel sends a uevent, so the wait ends as
+# soon as the event that satisfies it arrives. Not everything sends a uevent (a
+# sysfs attribute changing for example), so conditions are also re-checked every
+# `fallback` seconds. Without access to the uevent socket this degrades to
+# polling.
+
+import argparse
+import glob
+import select
+import socket
+import sys
+import time
+
+NETLINK_KOBJECT_UEVENT = 15
+# kernel uevents, as opposed to the ones re-broadcast by udev
+KERNEL_GROUP = 1
+
+
+class Watcher:
+    def __init__(self, fallback=1.0):
+        self.fallback = fallback
+        try:
+            self.sock = socket.socket(
+                socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT
+            )
+            self.sock.bind((0, KERNEL_GROUP))
+        except (AttributeError, OSError):
+            self.sock = None
+            self.fallback = min(fallback, 0.1)
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _event(self, timeout):
+        """Waits up to timeout for a uevent, returns it as a dict or None."""
+        if self.sock is None:
+            time.sleep(timeout)
+            return None
+
+        r, _, _ = select.select([self.sock], [], [], timeout)
+        if not r:
+            return None
+        data = self.sock.recv(16384)
+        # "action@devpath\0KEY=value\0..."
+        fields = data.split(b"\0")
+        event = {}
+        for f in fields[1:]:
+            k, sep, v = f.decode(errors="replace").partition("=")
+            if sep:
+                event[k] = v
+        return event
+
+    def wait(self, check, timeout, on_event=None):
+        """Waits until check() is true, returns False if that did not happen
+        within timeout seconds."""
+        deadline = time.time() + timeout
+        while True:
+            if check():
+                return True
+            left = deadline - time.time()
+            if left <= 0:
+                return False
+            event = self._event(min(left, self.fallback))
+            if event and on_event:
+                on_event(event)
+
+
+def exists(pattern):
+    return bool(glob.glob(pattern))
+
+
+def appeared(patterns):
+    return lambda: all(exists(p) for p in patterns)
+
+
+def disappeared(patterns):
+    return lambda: not any(exists(p) for p in patterns)
+
+
+def read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def attr_equals(path, value):
+    return lambda: read(path) == value
+
+
+def block_serials():
+    """The wwids and serials of all block devices."""
+    ids = []
+    for name in ("device/wwid", "device/serial", "serial"):
+        for path in glob.glob("/sys/class/block/*/" + name):
+            ids.append(read(path) or "")
+    return ids
+
+
+def serials_present(serials):
+    def check():
+        ids = block_serials()
+        return all(any(s in i for i in ids) for s in serials)
+
+    return check
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="wait for devices using uevents")
+    parser.add_argument(
+        "-t", "--timeout", type=float, default=30, help="seconds, default 30"
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="print the uevents seen"
+    )
+    sub = parser.add_subparsers(dest="command")
+
+    p = sub.add_parser("appear", help="wait for all the paths (globs) to exist")
+    p.add_argument("paths", nargs="+")
+
+    p = sub.add_parser("disappear", help="wait for none of the paths (globs) to exist")
+    p.add_argument("paths", nargs="+")
+
+    p = sub.add_parser("attr", help="wait for a sysfs attribute to have a value")
+    p.add_argument("path")
+    p.add_argument("value")
+
+    p = sub.add_parser("serial", help="wait for block devices with the serials/wwids")
+    p.add_argument("serials", nargs="*")
+
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_usage(sys.stderr)
+        return 2
+
+    if args.command == "appear":
+        check = appeared(args.paths)
+    elif args.command == "disappear":
+        check = disappeared(args.paths)
+    elif args.command == "attr":
+        check = attr_equals(args.path, args.value)
+    else:
+        check = serials_present(args.serials)
+
+    def show(event):
+        print(
+            "uevent: %s %s" % (event.get("ACTION"), event.get("DEVPATH")),
+            file=sys.stderr,
+        )
+
+    start = time.time()
+    with Watcher() as w:
+        ok = w.wait(check, args.timeout, show if args.verbose else None)
+
+    took = time.time() - start
+    if not ok:
+        print(
+            "devwatch: %s timed out after %.1fs" % (args.command, took), file=sys.stderr
+        )
+        return 1
+    print("devwatch: %s done after %.1fs" % (args.command, took), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+
+# Writes whole disk images (the windows and freebsd installs) to a disk.
+#
+# The image is read and checksummed by a feeder thread, decompressed by pigz
+# (gzip if pigz is missing) in its own process, unpacked from a tar archive if
+# need be and read straight into page aligned buffers. Writer threads take the
+# filled buffers and write them with O_DIRECT, so several large writes are in
+# flight while the next buffer is being filled.
+#
+# Runs of all zero blocks are not written out, they are zeroed with BLKZEROOUT
+# (which the kernel turns into a write zeroes or unmap command where the device
+# supports it) or skipped altogether with --skip-zeros when the disk is known to
+# read back zeros already.
+#
+# gzip streams carry a crc that the decompressor checks, the sha256 of the
+# image as read is checked against --sha256 or a sha256sum style file once the
+# stream ends. On any failure the start and end of the disk are zeroed so a
+# partially written image does not boot.
+
+import argparse
+import errno
+import fcntl
+import hashlib
+import mmap
+import os
+import queue
+import shutil
+import stat
+import struct
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+
+CHUNK_SIZE = 8 * 1024 * 1024
+# granularity of the zero detection
+BLOCK_SIZE = 64 * 1024
+# O_DIRECT offsets and lengths must be multiples of the logical block size
+ALIGN = 4096
+# partition tables live in the first and last MiB
+WIPE_SIZE = 1024 * 1024
+
+# _IO(0x12, 127)
+BLKZEROOUT = 0x127F
+
+FORMATS = ("raw", "gz", "tar", "tar.gz")
+ZERO = bytes(BLOCK_SIZE)
+
+
+class ImageError(Exception):
+    pass
+
+
+def guess_format(name):
+    if name.endswith((".tar.gz", ".tgz")):
+        return "tar.gz"
+    if name.endswith(".gz"):
+        return "gz"
+    if name.endswith(".tar"):
+        return "tar"
+    return "raw"
+
+
+def read_sha256_file(path):
+    """The checksum from a sha256sum style file, `<hex digest>  <name>`."""
+    with open(path) as f:
+        fields = f.read().split()
+    if not fields or len(fields[0]) != 64:
+        raise ImageError("no sha256 found in %s" % path)
+    return fields[0].lower()
+
+
+def zero_runs(buf, length, block_size=BLOCK_SIZE):
+    """Splits buf[:length] into (start, end, is_zero) runs of whole blocks,
+    merging adjacent blocks of the same kind."""
+    runs = []
+    start = 0
+    while start < length:
+        end = min(start + block_size, length)
+        zero = buf[start:end] == ZERO[: end - start]
+        if runs and runs[-1][2] == zero:
+            runs[-1][1] = end
+        else:
+            runs.append([start, end, zero])
+        start = end
+    return [tuple(r) for r in runs]
+
+
+def read_full(f, view):
+    """Reads into view until it is full or the stream ends, returns the number
+    of bytes read."""
+    got = 0
+    while got < len(view):
+        n = f.readinto(view[got:])
+        if not n:
+            break
+        got += n
+    return got
+
+
+class Source:
+    """The image, decompressed and unpacked, as a stream (file) of size bytes
+    if known up front."""
+
+    def __init__(self, path, fmt, threads=4):
+        self.sha256 = hashlib.sha256()
+        self.error = None
+        self.proc = None
+        self.tar = None
+        self.input = sys.stdin.buffer if path == "-" else open(path, "rb")
+
+        if fmt.endswith("gz"):
+            decompressor = shutil.which("pigz")
+            cmd = [decompressor, "-dc", "-p", str(threads)]
+            if not decompressor:
+                cmd = ["gzip", "-dc"]
+            self.proc = subprocess.Popen(
+                cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+            )
+            sink, self.stream = self.proc.stdin, self.proc.stdout
+        else:
+            r, w = os.pipe()
+            sink, self.stream = os.fdopen(w, "wb"), os.fdopen(r, "rb")
+
+        self.feeder = threading.Thread(
+            target=self._feed, args=(sink,), name="feeder", daemon=True
+        )
+        self.feeder.start()
+
+        self.file = self.stream
+        self.size = None
+        if fmt.startswith("tar"):
+            try:
+                self._open_tar()
+            except Exception:
+                self.close()
+                raise
+
+    def _open_tar(self):
+        try:
+            self.tar = tarfile.open(fileobj=self.stream, mode="r|")
+        except tarfile.TarError as e:
+            raise ImageError("reading the tar archive failed: %s" % e)
+        for member in self.tar:
+            if member.isfile():
+                break
+        else:
+            raise ImageError("no image file found in the tar archive")
+        self.file = self.tar.extractfile(member)
+        self.size = member.size
+
+    def _feed(self, sink):
+        try:
+            while True:
+                buf = self.input.read(1024 * 1024)
+                if not buf:
+                    break
+                self.sha256.update(buf)
+                sink.write(buf)
+        except Exception as e:
+            self.error = e
+        finally:
+            try:
+                sink.close()
+            except OSError:
+                # the reading end went away, reported by finish
+                pass
+
+    def finish(self):
+        """Reads what is left of the stream (trailing tar members and padding)
+        and returns the sha256 of the input, raising if it could not be read or
+        decompressed in full."""
+        while self.stream.read(CHUNK_SIZE):
+            pass
+        self.feeder.join()
+        if self.proc and self.proc.wait():
+            raise ImageError(
+                "decompressing the image failed (%d)" % self.proc.returncode
+            )
+        if self.error:
+            raise ImageError("reading the image failed: %s" % self.error)
+        return self.sha256.hexdigest()
+
+    def close(self):
+        if self.proc and self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+        self.stream.close()
+        if self.input is not sys.stdin.buffer:
+            self.input.close()
+
+
+class Writer:
+    """Writes chunks of an image at their offset from a pool of threads."""
+
+    def __init__(self, path, threads=4, direct=True, skip_zeros=False):
+        self.fd = os.open(path, os.O_WRONLY)
+        self.dfd = self.fd
+        if direct and hasattr(os, "O_DIRECT"):
+            try:
+                self.dfd = os.open(path, os.O_WRONLY | os.O_DIRECT)
+            except OSError:
+                # not supported by the filesystem (tmpfs)
+                pass
+
+        st = os.fstat(self.fd)
+        self.is_dev = stat.S_ISBLK(st.st_mode)
+        self.size = os.lseek(self.fd, 0, os.SEEK_END) if self.is_dev else None
+        self.skip_zeros = skip_zeros
+        self.zeroout = self.is_dev
+        self.zeros = mmap.mmap(-1, CHUNK_SIZE)
+        self.stats = {"written": 0, "zeroed": 0, "skipped": 0}
+        self.lock = threading.Lock()
+        self.error = None
+
+        self.jobs = queue.Queue()
+        # two buffers per writer, one being written and one being filled
+        self.free = queue.Queue()
+        for _ in range(threads * 2):
+            self.free.put(mmap.mmap(-1, CHUNK_SIZE))
+        self.threads = [
+            threading.Thread(target=self._run, name="writer-%d" % i, daemon=True)
+            for i in range(threads)
+        ]
+        for t in self.threads:
+            t.start()
+
+    def _count(self, key, n):
+        with self.lock:
+            self.stats[key] += n
+
+    def _pwrite(self, view, offset):
+        # the aligned part direct, an unaligned tail through the page cache
+        aligned = len(view) - len(view) % ALIGN
+        fd = self.dfd
+        done = 0
+        while done < len(view):
+            if done >= aligned:
+                fd = self.fd
+            end = aligned if done < aligned else len(view)
+            done += os.pwrite(fd, view[done:end], offset + done)
+
+    def _zero(self, offset, length):
+        if self.skip_zeros:
+            self._count("skipped", length)
+            return
+        self._count("zeroed", length)
+        if self.zeroout and offset % 512 == 0:
+            n = length - length % 512
+            try:
+                fcntl.ioctl(self.fd, BLKZEROOUT, struct.pack("QQ", offset, n))
+                offset += n
+                length -= n
+            except OSError as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL):
+                    raise
+                self.zeroout = False
+        while length:
+            n = min(length, CHUNK_SIZE)
+            self._pwrite(memoryview(self.zeros)[:n], offset)
+            offset += n
+            length -= n
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            buf, offset, length = job
+            try:
+                if not self.error:
+                    view = memoryview(buf)
+                    for start, end, zero in zero_runs(buf, length):
+                        if zero:
+                            self._zero(offset + start, end - start)
+                        else:
+                            self._pwrite(view[start:end], offset + start)
+                            self._count("written", end - start)
+                    view.release()
+            except Exception as e:
+                self.error = e
+            finally:
+                self.free.put(buf)
+
+    def check(self, length):
+        if self.size is not None and length > self.size:
+            raise ImageError(
+                "image (%d bytes) does not fit the device (%d bytes)"
+                % (length, self.size)
+            )
+        if self.error:
+            raise ImageError("writing the image failed: %s" % self.error)
+
+    def copy(self, f):
+        """Writes the stream f from the start of the device, returns its length."""
+        offset = 0
+        while True:
+            buf = self.free.get()
+            n = read_full(f, memoryview(buf))
+            if not n:
+                self.free.put(buf)
+                break
+            self.check(offset + n)
+            self.jobs.put((buf, offset, n))
+            offset += n
+            if n < CHUNK_SIZE:
+                break
+        return offset
+
+    def stop(self):
+        """Waits for the queued writes to finish and the threads to exit."""
+        for _ in self.threads:
+            self.jobs.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
+
+    def finish(self, length):
+        self.stop()
+        self.check(length)
+        if not self.is_dev and os.fstat(self.fd).st_size < length:
+            # trailing zeros skipped on a plain file
+            os.ftruncate(self.fd, length)
+        os.fsync(self.fd)
+
+    def wipe(self):
+        """Zeroes the partition tables at either end of the disk."""
+        size = self.size if self.is_dev else os.fstat(self.fd).st_size
+        for offset in sorted({0, max(0, size - WIPE_SIZE)}):
+            n = min(WIPE_SIZE, size - offset)
+            os.pwrite(self.fd, bytes(n), offset)
+        os.fsync(self.fd)
+
+    def close(self):
+        if self.dfd != self.fd:
+            os.close(self.dfd)
+        os.close(self.fd)
+
+
+def write(
+    path, device, fmt=None, sha256=None, threads=4, direct=True, skip_zeros=False
+):
+    """Writes the image at path (- for stdin) to device, returns the write
+    stats. The device is wiped if the image could not be written in full or does
+    not match sha256."""
+    fmt = fmt or guess_format(path)
+    if fmt not in FORMATS:
+        raise ImageError("unknown image format: %s" % fmt)
+
+    writer = Writer(device, threads, direct, skip_zeros)
+    source = None
+    ok = False
+    try:
+        source = Source(path, fmt, threads)
+        if source.size is not None:
+            writer.check(source.size)
+        start = time.time()
+        length = writer.copy(source.file)
+        writer.finish(length)
+        digest = source.finish()
+        if sha256 and digest != sha256.lower():
+            raise ImageError("checksum mismatch: got %s, want %s" % (digest, sha256))
+        ok = True
+        stats = dict(writer.stats, size=length, seconds=time.time() - start)
+        stats["sha256"] = digest
+        return stats
+    finally:
+        if source:
+            source.close()
+        if not ok:
+            # nothing more gets written once an error is set
+            writer.error = writer.error or ImageError("aborted")
+            writer.stop()
+            writer.wipe()
+        writer.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="write a whole disk image to a disk")
+    sub = parser.add_subparsers(dest="command")
+
+    p = sub.add_parser("write", help="write an image to a device")
+    p.add_argument(
+        "-f", "--format", choices=FORMATS, help="default from the image name"
+    )
+    p.add_argument("--sha256", help="expected sha256 of the image")
+    p.add_argument(
+        "--sha256-file", help="sha256sum style file with the expected sha256"
+    )
+    p.add_argument(
+        "-z",
+        "--skip-zeros",
+        action="store_true",
+        help="do not write zero blocks, the device already reads back zeros",
+    )
+    p.add_argument("-j", "--threads", type=int, default=4)
+    p.add_argument("--no-direct", action="store_true", help="do not use O_DIRECT")
+    p.add_argument("image", help="image file, - for stdin")
+    p.add_argument("device")
+
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_usage(sys.stderr)
+        return 2
+
+    try:
+        sha256 = args.sha256
+        if args.sha256_file:
+            sha256 = read_sha256_file(args.sha256_file)
+        stats = write(
+            args.image,
+            args.device,
+            args.format,
+            sha256,
+            args.threads,
+            not args.no_direct,
+            args.skip_zeros,
+        )
+    except (ImageError, OSError) as e:
+        print("diskimage: %s" % e, file=sys.stderr)
+        return 1
+
+    print(
+        "wrote %d bytes to %s in %.1fs: %d written, %d zeroed, %d skipped, sha256 %s"
+        % (
+            stats["size"],
+            args.device,
+            stats["seconds"],
+            stats["written"],
+            stats["zeroed"],
+            stats["skipped"],
+            stats["sha256"],
+        ),
+        file=sys.stderr,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -103,7 +103,9 @@ git config --global http.sslverify false
 git -C $assetdir init
 git -C $assetdir remote add origin "${gituri}"
 git -C $assetdir fetch origin
-git -C $assetdir checkout "${tag}"
+# only the freebsd images are needed
+GIT_LFS_SKIP_SMUDGE=1 git -C $assetdir checkout "${tag}"
+lfs_pull $assetdir "$arch/latest-freebsd*.raw.gz"
 
 ## Assemble configurables
 ##
@@ -167,7 +169,8 @@ phone_home "${tinkerbell}" '{"type":"provisioning.105"}'
 # Write rootfs to disk
 set_autofail_stage "writing rootfs to disk"
 echo -e "${GREEN}#### Extracting image archive and writing to first disk${NC}"
-zcat "$image" | dd iflag=fullblock conv=sparse bs=32k of="${imagedev}"
+# the disks were wiped on deprovision, zero blocks need not be written
+./diskimage.py write --skip-zeros -f gz "$image" "${imagedev}"
 
 ## TODO: Fix stdout redirection to block device
 #echo "Downloading, extracting and writing image to sda..."
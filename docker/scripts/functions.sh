@@ -122,6 +122,97 @@ function configure_image_cache_dns() {
 	getent hosts github-cloud.githubusercontent.com | awk '{print $1}'
 }
 
+# usage: list_disks
+# lists the disks to install to or wipe, one per line. OSIE_DISKS (space separated) overrides the list, the end to end
+# benchmark (ci/bench/e2e.py) runs the scripts against loop devices this way.
+function list_disks() {
+	if [[ -n ${OSIE_DISKS:-} ]]; then
+		# shellcheck disable=SC2086
+		printf '%s\n' $OSIE_DISKS
+		return
+	fi
+	lsblk -dno name -e1,7,11 | sed 's|^|/dev/|' | sort
+}
+
+sys_class_block=/sys/class/block
+
+# usage: block_disk $name
+# prints the disk a block device (sda, nvme0n1p2, loop1p1) is or is a partition
+# of, as sysfs knows it rather than by its name, loop1 is not loop10p1's disk
+function block_disk() {
+	local name=$1
+	if [[ -e $sys_class_block/$name/partition ]]; then
+		name=$(readlink -f "$sys_class_block/$name/..")
+		name=${name##*/}
+	fi
+	echo "$name"
+}
+
+# usage: md_on_disks $md $disk...
+# returns 0 if any member of the md array (mdN) is one of the disks or one of
+# their partitions
+function md_on_disks() {
+	local md=$1 member disk
+	shift
+	for member in "$sys_class_block/$md"/slaves/*; do
+		[[ -e $member ]] || continue
+		member=$(block_disk "${member##*/}")
+		for disk in "$@"; do
+			[[ $member == "${disk##*/}" ]] && return 0
+		done
+	done
+	return 1
+}
+
+# usage: path_matches $path $glob...
+# returns 0 if $path matches any of the globs
+function path_matches() {
+	local path=$1 glob
+	shift
+	for glob in "$@"; do
+		# shellcheck disable=SC2053
+		[[ $path == $glob ]] && return 0
+	done
+	return 1
+}
+
+# usage: lfs_pull $repodir [$include...]
+# materializes the git-lfs objects of a checkout done with GIT_LFS_SKIP_SMUDGE=1,
+# only the paths matching any of the $include globs if there are any
+function lfs_pull() {
+	local repo=$1
+	shift
+	local includes=("$@")
+	local path paths=()
+
+	if ((${#includes[@]} == 0)); then
+		git -C "$repo" lfs pull
+		return
+	fi
+	while read -r _ _ path; do
+		path_matches "$path" "${includes[@]}" && paths+=("$path")
+	done < <(git -C "$repo" lfs ls-files --long)
+
+	((${#paths[@]} == 0)) && return 0
+
+	echo "pulling git-lfs objects: ${paths[*]}"
+	git -C "$repo" lfs pull --include="$(
+		IFS=,
+		echo "${paths[*]}"
+	)"
+}
+
+# usage: blockmap_usable $bmap $rootfs_format
+# returns 0 if the block mapped raw image described by $bmap can be written
+# over a freshly made $rootfs_format root filesystem. Only ext filesystems are
+# supported since the image's fs has to be grown and given cpr's uuid afterwards.
+function blockmap_usable() {
+	local bmap=$1 format=$2
+
+	[[ $format =~ ^ext[234]$ ]] || return 1
+	./blockmap.py check "$bmap" "$format"
+}
+
 # returns a string of the BIOS vendor: "Dell", "Supermicro", "ASRockRack", or "unknown"
 function detect_bios_vendor() {
 	local vendor=unknown
@@ -313,7 +404,9 @@ function is_loop_dev() {
 # syntax: is_uefi,...
 # returns 0 if true, 1 if false
 function is_uefi() {
-	[[ -d /sys/firmware/efi ]]
+	# disks given in OSIE_DISKS are not what the firmware boots from, leave its
+	# boot entries alone
+	[[ -z ${OSIE_DISKS:-} ]] && [[ -d /sys/firmware/efi ]]
 }
 
 efi_device() {
@@ -597,15 +690,110 @@ function fast_wipe() {
 	} >&2
 }
 
+# usage: nvme_reset_namespaces $drive
+# deletes all the namespaces of nvme controller $drive (/dev/nvmeX) and
+# creates and attaches a single namespace spanning its whole capacity. The
+# controller is identified once, and controller resets and namespace rescans
+# are waited on with devwatch.py rather than with fixed sleeps.
+function nvme_reset_namespaces() {
+	local drive=$1
+	local name=${drive##*/}
+	local idctrl caps max_bytes ctrl model flbas=0 sectors nsid ns namespaces
+
+	idctrl=$(nvme id-ctrl "$drive" -o json)
+	IFS=$'\t' read -r caps max_bytes ctrl model <<<"$(jq -r '[.oacs, .tnvmcap, .cntlid, .mn] | @tsv' <<<"$idctrl")"
+	model=${model%"${model##*[![:space:]]}"}
+	echo "Nvme drive $drive: model=\"$model\" oacs=$caps tnvmcap=$max_bytes cntlid=$ctrl"
+	if (((caps & 0x8) == 0)); then
+		echo "Nvme drive $drive has no management capabilities, skipping..."
+		return 0
+	fi
+
+	# shellcheck disable=SC2207
+	namespaces=($(nvme list-ns "$drive" -a | cut -d : -f 2))
+	echo "Found ${#namespaces[@]} namespaces on $drive"
+	if ((${#namespaces[@]} > 0)); then
+		for ns in "${namespaces[@]}"; do
+			echo "Deleting namespace $ns from $drive"
+			nvme delete-ns "$drive" -n "$ns"
+		done
+	fi
+
+	if [[ $model == "INTEL SSDPE2KX040T8" ]]; then
+		# Set specific block size depending on physical BD
+		sectors=$((max_bytes / 4097))
+		flbas=1
+	else
+		# default flbas 0 uses 512 byte sector sizes
+		sectors=$((max_bytes / 512))
+	fi
+
+	echo "Creating a single namespace with $sectors sectors on $drive"
+	nsid=$(nvme create-ns "$drive" --nsze=$sectors --ncap=$sectors --flbas $flbas --dps=0 | cut -d : -f 3)
+
+	echo "Attaching namespace $nsid to ctrl $ctrl on $drive"
+	nvme attach-ns "$drive" -n "$nsid" -c "$ctrl"
+
+	echo "Resetting controller $drive"
+	nvme reset "$drive"
+	if ! ./devwatch.py -t 30 attr "/sys/class/nvme/$name/state" live; then
+		echo "Nvme controller $drive did not come back after reset" >&2
+		return 1
+	fi
+
+	echo "Rescanning namespaces on $drive"
+	nvme ns-rescan "$drive"
+	if ! ./devwatch.py -t 30 appear "/sys/class/nvme/$name/nvme*n$nsid"; then
+		echo "Namespace $nsid did not show up on $drive" >&2
+		return 1
+	fi
+}
+
+raid_state_dir=/statedir/raid
+
+# usage: raid_query $vendor $name $command...
+# runs a read only controller query, keeping its output as $name in the
+# vendor's state dir for the planner (and for debugging). Exit codes are
+# ignored, some tools encode counts in them.
+function raid_query() {
+	local dir=$raid_state_dir/$1 name=$2
+	shift 2
+
+	mkdir -p "$dir"
+	"$@" >"$dir/$name" 2>&1 || :
+}
+
+# usage: raid_plan $vendor $step...
+# records the mutating steps planned for a controller, nothing means it is clean
+function raid_plan() {
+	local vendor=$1
+	shift
+
+	if (($# == 0)); then
+		: >"$raid_state_dir/$vendor.plan"
+		echo "$vendor controller is already clean, nothing to do"
+		return
+	fi
+	printf '%s\n' "$@" >"$raid_state_dir/$vendor.plan"
+	echo "$vendor controller reset plan:"
+	printf '  %s\n' "$@"
+}
+
 # marvell_reset uses mvcli to reset the raid card to JBODs
-# usage: megaraid_reset disk...
+# usage: marvell_reset
 function marvell_reset() {
+	local dir=$raid_state_dir/marvell vds pd_serials serial vd
+
 	# dmidecode prints error messages on stdout!!!!
 	systemmfg=$(dmidecode -s system-manufacturer | head -1)
 	echo "Marvell hardware raid device is present on system mfg: $systemmfg"
 
-	echo "Marvell-MVCLI - Deleting all VDs"
-	vds=$(mvcli info -o vd | awk '/id:/ {print $2}')
+	raid_query marvell vd mvcli info -o vd
+	raid_query marvell pd mvcli info -o pd
+
+	vds=$(awk '/id:/ {print $2}' "$dir/vd")
+	# shellcheck disable=SC2086
+	raid_plan marvell ${vds:+"delete vd $vds"}
 	for vd in $vds; do
 		echo "Marvell-MVCLI - Deleting VD id:$vd"
 		echo y | mvcli delete -f -o vd -i "$vd"
@@ -614,35 +802,42 @@ function marvell_reset() {
 	# Ensure all physical drives are seen by linux
 	# by matching the serials for the physical drives provided by mvcli
 	# with the block device wwid file
-	pd_serials="$(mvcli info -o pd | awk '/Serial:/ { print $NF }')"
+	pd_serials="$(awk '/Serial:/ { print $NF }' "$dir/pd")"
 
-	udevadm settle
+	[[ -n $vds ]] && udevadm settle
 
-	pd_missing=true
-	while $pd_missing; do
-		sleep 1
-		pd_missing=false
-		echo "Marvell-Reset: Checking for drives..."
+	echo "Marvell-Reset: Waiting for drives..."
+	# shellcheck disable=SC2086
+	if ! ./devwatch.py -t 300 serial $pd_serials; then
 		for serial in $pd_serials; do
 			if ! grep -q "$serial" /sys/class/block/*/device/wwid 2>/dev/null; then
 				echo "Marvell-Reset: Serial missing: $serial"
-				pd_missing=true
 			fi
 		done
-	done
+		return 1
+	fi
 }
 
 # perc_reset uses perccli to reset the raid card to JBODs
 # usage: perc_reset disk...
 function perc_reset() {
+	local dir=$raid_state_dir/perc plan=() percdisk step
+
 	# dmidecode prints error messages on stdout!!!!
 	systemmfg=$(dmidecode -s system-manufacturer | head -1)
-	percmodel=$(perccli64 show all | grep PERC | awk '{print $2}')
 	echo "Dell PERC hardware raid device is present on system mfg: $systemmfg"
 
+	# gather all the controller state up front, once
+	raid_query perc show-all perccli64 show all
+	raid_query perc drives perccli64 /call/eall/sall show all
+	raid_query perc personality perccli64 /c0 show personality
+	raid_query perc vds perccli64 /c0 /vall show
+	raid_query perc jbod perccli64 /c0 show jbod
+	percmodel=$(grep PERC "$dir/show-all" | awk '{print $2}')
+
 	#Query controller for drive state smart alert info
 	#NOTE: disks in JBOD do not appear as Online or GOOD. Show all slot info for err state
-	if perccli64 /call/eall/sall show all | grep "S.M.A.R.T alert flagged by drive" | grep No >/dev/null; then
+	if grep "S.M.A.R.T alert flagged by drive" "$dir/drives" | grep No >/dev/null; then
 		echo "PERCCLI - Controller drive state - OK"
 	else
 		echo "PERCCLI - Controller drive state has problem with SMART data alert! FAIL"
@@ -650,64 +845,122 @@ function perc_reset() {
 	fi
 
 	#Check/set personality
-	if perccli64 /c0 show personality | grep "Current Personality" | grep -E "eHBA|HBA-Mode" >/dev/null; then
+	if grep "Current Personality" "$dir/personality" | grep -E "eHBA|HBA-Mode" >/dev/null; then
 		echo "PERCCLI - Controller in HBA/eHBA-Mode - OK"
 	elif [[ $percmodel == 'PERCH710PMini' || $percmodel == 'PERCH740PMini' ]]; then
 		echo "PERCCLI - Skipping set HBA-Mode. This $percmodel does not support HBA mode"
 	elif [[ $percmodel == 'PERCH745Front' ]]; then
-		echo "PERCCLI - Setting personality to eHBA-Mode"
-		perccli64 /c0 set personality=eHBA
+		plan+=("/c0 set personality=eHBA")
 	else
-		echo "PERCCLI - Setting personality to HBA-Mode"
-		perccli64 /c0 set personality=HBA
+		plan+=("/c0 set personality=HBA")
 	fi
 
 	#Check/delete all VDs!
-	if perccli64 /c0 /vall show | grep "No VD" >/dev/null; then
+	if grep "No VD" "$dir/vds" >/dev/null; then
 		echo "PERCCLI - No VDs configured - OK"
 	else
-		echo "PERCCLI - Deleting all VDs"
 		#This also resets all other configs as well per Dell
-		perccli64 /c0 /vall delete force
+		plan+=("/c0 /vall delete force")
 	fi
 
 	#Check for jbod and enable if needed
-	if perccli64 /c0 show jbod | grep "JBOD      ON" >/dev/null; then
+	if grep "JBOD      ON" "$dir/jbod" >/dev/null; then
 		echo "PERCCLI - JBOD is on - OK"
-	elif perccli64 /c0 show personality | grep "Auto Configure Behavior JBOD" >/dev/null; then
+	elif grep "Auto Configure Behavior JBOD" "$dir/personality" >/dev/null; then
 		echo "PERCCLI - JBOD auto configure is on - OK"
 	elif [[ $percmodel == 'PERCH710PMini' || $percmodel == 'PERCH740PMini' ]]; then
 		echo "PERCCLI - Skipping set JBOD since $percmodel does not support it"
 	else
-		echo "PERCCLI - Enable JBOD"
-		perccli64 /c0 set jbod=on force
+		plan+=("/c0 set jbod=on force")
 	fi
 
 	if [[ $percmodel == 'PERCH710PMini' || $percmodel == 'PERCH740PMini' ]]; then
-		percdisk=$(perccli64 /call/eall/sall show all | grep "[0-9]:[0-9]" | awk '{print $1}' | head -1)
-		echo "PERCCLI - Creating RAID0 HW RAID on $percmodel"
-		perccli64 /c0 add vd r0 name=RAID0 drives="$percdisk"
+		percdisk=$(grep "[0-9]:[0-9]" "$dir/drives" | awk '{print $1}' | head -1)
+		plan+=("/c0 add vd r0 name=RAID0 drives=$percdisk")
+	fi
+
+	# older versions of bash treat empty arrays as unset
+	raid_plan perc ${plan[@]+"${plan[@]}"}
+	((${#plan[@]} == 0)) && return 0
+	for step in "${plan[@]}"; do
+		echo "PERCCLI - $step"
+		# shellcheck disable=SC2086
+		perccli64 $step
+	done
+
+	if [[ $percmodel == 'PERCH710PMini' || $percmodel == 'PERCH740PMini' ]]; then
 		sleep 5
 	fi
 }
 
+# smartarray_reset uses ssacli to clear all logical drives
+# usage: smartarray_reset
 function smartarray_reset() {
+	local slots slot plan=()
+
 	systemmfg=$(dmidecode -s system-manufacturer | head -1)
 	echo "Adaptec hardware RAID device is present on system mfg: $systemmfg"
 
-	slots=$(ssacli ctrl all show detail | awk '/^   Slot: / {print $2}')
+	# one query for all controllers, the slots that have logical drives
+	raid_query smartarray config ssacli ctrl all show config
+
+	slots=$(awk '/ in Slot / {for (i = 1; i < NF; i++) if ($i == "Slot") slot = $(i + 1)} /^ +logicaldrive / {print slot}' "$raid_state_dir/smartarray/config" | sort -u)
+	for slot in $slots; do
+		plan+=("slot=$slot logicaldrive all delete forced")
+	done
+	# older versions of bash treat empty arrays as unset
+	raid_plan smartarray ${plan[@]+"${plan[@]}"}
+	((${#plan[@]} == 0)) && return 0
 
 	echo "Adaptec smart storage array, clearing logical drives"
 	for slot in $slots; do
-		if ssacli controller slot="$slot" logicaldrive all show status >/dev/null; then
-			echo "Clearing logical drives for slot $slot"
-			ssacli controller slot="$slot" logicaldrive all delete forced
-		else
-			echo "Controller slot $slot has no logical drives, skipping"
-		fi
+		echo "Clearing logical drives for slot $slot"
+		ssacli controller slot="$slot" logicaldrive all delete forced
 	done
 }
 
+# megaraid_reset's pseudo JBOD, MegaCli64 -CfgEachDskRaid0 WT RA Direct NoCachedBadBBU
+megaraid_raid0_policy='WriteThrough, ReadAhead, Direct, No Write Cache if Bad BBU'
+
+# usage: megaraid_clean $systemmfg
+# returns 0 if the inspected megaraid controller is already in the state
+# megaraid_reset would leave it in: every drive a JBOD on Dells, elsewhere
+# every drive alone in its own raid0 with the policy megaraid_reset sets.
+# Anything else, a tenant's raid1 or a raid0 spanning two drives included,
+# gets a full reset.
+function megaraid_clean() {
+	local dir=$raid_state_dir/megaraid systemmfg=$1 states pds lds
+
+	grep -E '[1-9][0-9]* foreign config' "$dir/foreign" >/dev/null && return 1
+	states=$(sed -n 's|^Firmware state: ||p' "$dir/pds")
+	[[ -n $states ]] || return 1
+	[[ $states =~ bad ]] && return 1
+	pds=$(grep -c '^Slot Number' "$dir/pds" || :)
+
+	if [[ $systemmfg =~ Dell ]]; then
+		# JBOD mode, every drive a JBOD
+		grep -i 'JBOD: *Enabled' "$dir/jbod" >/dev/null || return 1
+		lds=$(grep -c '^Virtual Drive:' "$dir/ldpd" || :)
+		[[ $lds == 0 ]] || return 1
+		[[ $(grep -vc JBOD <<<"$states") == 0 ]]
+		return
+	fi
+
+	# pseudo JBOD, a single drive raid0 per drive and no drive in two of them
+	grep -i 'JBOD: *Disabled' "$dir/jbod" >/dev/null || return 1
+	[[ $(grep -vc Online <<<"$states") == 0 ]] || return 1
+	awk -v pds="$pds" -v policy="$megaraid_raid0_policy" '
+		function value() { v = $0; sub(/^[^:]*: */, "", v); return v }
+		/^Virtual Drive:/ { lds++ }
+		/^RAID Level *:/ && value() !~ /^Primary-0, Secondary-0/ { bad++ }
+		/^Number Of Drives *:/ && value() != 1 { bad++ }
+		/^Default Cache Policy *:/ && value() != policy { bad++ }
+		/^Slot Number *:/ && used[value()]++ { bad++ }
+		/^Slot Number *:/ { drives++ }
+		END { exit !(lds == pds && drives == pds && !bad) }
+	' "$dir/ldpd"
+}
+
 # megaraid_reset uses MegaCli64 to reset the raid card to JBODs
 # usage: megaraid_reset disk...
 function megaraid_reset() {
@@ -715,8 +968,18 @@ function megaraid_reset() {
 	systemmfg=$(dmidecode -s system-manufacturer | head -1)
 	echo "LSI hardware raid device is present on system mfg: $systemmfg"
 
+	raid_query megaraid pds MegaCli64 -PDList -a0
+	raid_query megaraid ldpd MegaCli64 -LdPdInfo -a0
+	raid_query megaraid foreign MegaCli64 -CfgForeign -Scan -a0
+	raid_query megaraid jbod MegaCli64 -AdpGetProp -EnableJBOD -a0
+	if megaraid_clean "$systemmfg"; then
+		raid_plan megaraid
+		return 0
+	fi
+	raid_plan megaraid "full controller reset"
+
 	enc=$(MegaCli64 -EncInfo -a0 | awk '/Device ID/ {print $4}')
-	slots=$(MegaCli64 -PDList -a0 | awk '/^Slot Number/ {print $3}')
+	slots=$(awk '/^Slot Number/ {print $3}' "$raid_state_dir/megaraid/pds")
 
 	echo "LSI-MegaCLI - Disabling battery warning at boot"
 	MegaCli64 -AdpSetProp BatWarnDsbl 1 -a0
@@ -873,39 +1136,48 @@ function ensure_reachable() {
 	echo -e "${YELLOW}###### OK${NC}"
 }
 
-# Check that our git-lfs mirror server is working
-function github_mirror_check() {
-	echo -e "${YELLOW}###### Checking the health of github-mirror.packet.net...${NC}"
+# syntax: os plan template defaults
+# copies the grub template and defaults bundled into the image for os on plan
+# to template and defaults, fails if os is not bundled. See grubtemplates.py.
+function grub_templates_bundled() {
+	./grubtemplates.py resolve "$@"
+}
 
-	# Clone the repo, and checkout an LFS branch.
-	local timeout=60 # seconds
-	local lfs_testing_uri="https://github-mirror.packet.net/packethost/lfs-testing.git"
-	local lfs_testing_branch="remotes/origin/images-tiny"
-	if ! timeout --preserve-status $timeout git clone -q $lfs_testing_uri; then
-		echo -e "${YELLOW}###### Timeout when cloning the lfs-testing repo${NC}"
-		echo -e "${YELLOW}###### Reacquiring dhcp for publicly routable ip...${NC}"
-		reacquire_dhcp "$(ip_choose_if)"
-		echo -e "${YELLOW}###### Re-checking the health of github-mirror.packet.net...${NC}"
-		if ! timeout --preserve-status $timeout git clone -q $lfs_testing_uri; then
-			echo -e "${YELLOW}###### Timeout when cloning the lfs-testing repo${NC}"
-			return 1
-		fi
-		echo -e "${GREEN}###### Second clone attempt of lfs-testing successful${NC}"
+# syntax: NAME=URL...
+# Probes the endpoints an install needs all at once, see preflight.py. If the
+# github-mirror probe (mirror) did not answer at all, the case the old mirror
+# health check timed out on, dhcp is reacquired for a publicly routable ip and
+# everything is probed again. The results are cached in /statedir,
+# preflight_ok, preflight_missing and preflight_answered ask them.
+function preflight() {
+	echo -e "${YELLOW}###### Checking connectivity to ${*%%=*}...${NC}"
+	if ./preflight.py probe "$@" >/dev/null; then
+		return 0
 	fi
-	cd lfs-testing
-	if ! timeout --preserve-status $timeout git checkout -q $lfs_testing_branch; then
-		cd .. && rm -rf lfs-testing
-		echo -e "${YELLOW}###### Timeout when checking out git-lfs data from lfs-testing${NC}"
+	if [[ " ${*%%=*} " != *" mirror "* ]] || preflight_answered mirror; then
 		return 1
 	fi
-	checksum=$(sha256sum tiny/tiny.img | awk '{ print $1 }')
-	cd .. && rm -rf lfs-testing
+	echo -e "${YELLOW}###### github-mirror did not answer, reacquiring dhcp for publicly routable ip...${NC}"
+	reacquire_dhcp "$(ip_choose_if)"
+	./preflight.py probe --refresh "$@" >/dev/null
+}
 
-	local valid_checksum="7b331c02e313c7599d5a90212e17e6d3cb729bd2e1c9b873c302a63c95a2f9bf"
-	if [[ $checksum != "$valid_checksum" ]]; then
-		echo -e "${YELLOW}###### Test git-lfs checkout from github-mirror had a bad checksum${NC}"
-		return 1
-	fi
+# syntax: NAME
+# whether NAME answered the last preflight with a success
+function preflight_ok() {
+	./preflight.py ok "$1"
+}
+
+# syntax: NAME
+# whether NAME answered the last preflight with a 404
+function preflight_missing() {
+	./preflight.py missing "$1"
+}
+
+# syntax: NAME
+# whether NAME answered the last preflight at all
+function preflight_answered() {
+	./preflight.py answered "$1"
 }
 
 # determine the default interface to use if ip=dhcp is set
@@ -947,3 +1219,51 @@ add_post_install_service() {
 	cp -v target-files/services/packet-post-install.service "$target/etc/systemd/system/packet-post-install.service"
 	ln -s /etc/systemd/system/packet-post-install.service "$target/etc/systemd/system/multi-user.target.wants/packet-post-install.service"
 }
+
+stage_dir=/tmp/stages
+
+# usage: stage_run $name $command [$args...]
+# runs $command in the background as stage $name, its exit code is recorded so
+# that `stage_wait $name` can block on it. A stage may itself stage_wait on the
+# stages it depends on, so that it starts its work as soon as its inputs are ready.
+function stage_run() {
+	local name=$1
+	shift
+
+	mkdir -p "$stage_dir"
+	rm -f "$stage_dir/$name"
+	(
+		# errexit still applies in here, the trap records how the stage ended
+		trap 'rc=$?; echo $rc >"$stage_dir/$name.rc" && mv "$stage_dir/$name.rc" "$stage_dir/$name"' EXIT
+		"$@"
+	) &
+}
+
+# usage: wait_for $timeout $command...
+# runs $command every 100ms until it succeeds, returns 1 if it did not within
+# $timeout seconds, an empty $timeout waits as long as it takes. For what no
+# uevent announces, devices are waited for with devwatch.py.
+function wait_for() {
+	local timeout=$1
+	shift
+	local deadline=$((SECONDS + ${timeout:-0}))
+
+	until "$@"; do
+		[[ -z $timeout ]] || ((SECONDS < deadline)) || return 1
+		sleep 0.1
+	done
+}
+
+# usage: stage_wait $name...
+# waits for the stages to finish, returns 1 if any of them failed
+function stage_wait() {
+	local name rc
+	for name in "$@"; do
+		wait_for "" test -f "$stage_dir/$name"
+		rc=$(<"$stage_dir/$name")
+		if ((rc != 0)); then
+			echo "stage $name failed with exit code $rc" >&2
+			return 1
+		fi
+	done
+}
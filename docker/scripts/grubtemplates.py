@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+# The grub templates, bundled into the osie image.
+#
+# grub/ has an <os>-default-grub.template and .template.default per os, and
+# <os>-<plan>-... files for the plans that need something else. `bundle`
+# copies the ones osie.sh installs into the image along with an index from os
+# and plan to the template and defaults files, resolved the way osie.sh used to
+# fetch them: the plan's template and its .default if the plan has a template,
+# the os default's otherwise. `resolve` looks one up and copies the two files
+# where grub-installer.sh expects them.
+
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+
+INDEX = "index.json"
+NAME = re.compile(r"^(?P<os>[^-]+)-(?P<plan>.+)-grub\.template(?P<default>\.default)?$")
+
+
+class TemplateError(Exception):
+    pass
+
+
+def scan(src):
+    """{os: {plan: set of "template", "default"}} for the files in src."""
+    found = {}
+    for name in sorted(os.listdir(src)):
+        m = NAME.match(name)
+        if not m:
+            continue
+        kind = "default" if m.group("default") else "template"
+        found.setdefault(m.group("os"), {}).setdefault(m.group("plan"), set()).add(kind)
+    return found
+
+
+def index(found):
+    """{os: {plan: [template, defaults]}} for every os and plan in found."""
+    out = {}
+    for os_name, plans in sorted(found.items()):
+        if plans.get("default") != {"template", "default"}:
+            raise TemplateError("%s has no default grub template" % os_name)
+        out[os_name] = {}
+        for plan, kinds in sorted(plans.items()):
+            if "template" in kinds and "default" not in kinds:
+                raise TemplateError(
+                    "%s %s has a grub template but no .default" % (os_name, plan)
+                )
+            use = plan if "template" in kinds else "default"
+            template = "%s-%s-grub.template" % (os_name, use)
+            out[os_name][plan] = [template, template + ".default"]
+    return out
+
+
+def bundle(src, dest):
+    idx = index(scan(src))
+    os.makedirs(dest, exist_ok=True)
+    files = set(f for plans in idx.values() for pair in plans.values() for f in pair)
+    for f in sorted(files):
+        shutil.copyfile(os.path.join(src, f), os.path.join(dest, f))
+    with open(os.path.join(dest, INDEX), "w") as f:
+        json.dump(idx, f, indent=2, sort_keys=True)
+    return idx
+
+
+def resolve(idx, os_name, plan):
+    """The template and defaults file names for os on plan, None if the os is
+    not bundled."""
+    plans = idx.get(os_name)
+    if not plans:
+        return None
+    return plans.get(plan) or plans["default"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="bundled grub templates")
+    sub = parser.add_subparsers(dest="command")
+
+    p = sub.add_parser("bundle", help="copy the templates and write the index")
+    p.add_argument("src", help="the repo's grub directory")
+    p.add_argument("dest")
+    p = sub.add_parser("resolve", help="install the templates for os on plan")
+    p.add_argument("--bundle", default="/home/packet/grub")
+    p.add_argument("os")
+    p.add_argument("plan")
+    p.add_argument("template", help="where to copy grub.template to")
+    p.add_argument("defaults", help="where to copy grub.template.default to")
+
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_usage(sys.stderr)
+        return 2
+
+    try:
+        if args.command == "bundle":
+            idx = bundle(args.src, args.dest)
+            print(
+                "grubtemplates: %d oses, %d plans"
+                % (len(idx), sum(len(p) for p in idx.values())),
+                file=sys.stderr,
+            )
+            return 0
+
+        with open(os.path.join(args.bundle, INDEX)) as f:
+            files = resolve(json.load(f), args.os, args.plan)
+        if not files:
+            print("grubtemplates: %s is not bundled" % args.os, file=sys.stderr)
+            return 1
+        for name, dest in zip(files, (args.template, args.defaults)):
+            shutil.copyfile(os.path.join(args.bundle, name), dest)
+        print("grubtemplates: %s %s uses %s" % (args.os, args.plan, files[0]))
+    except (TemplateError, OSError, ValueError) as e:
+        print("grubtemplates: %s" % e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
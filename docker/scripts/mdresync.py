@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+# Controls the initial resync of newly created md arrays.
+#
+# A fresh RAID1/4/5/6/10 array starts resyncing as soon as it is created and
+# competes with mkfs and the image extraction for disk bandwidth for the whole
+# install. Depending on the storage mode the resync is either left alone
+# (full), throttled through the array's sync_speed_min/max (throttle) or frozen
+# (defer) until the install is done. The arrays are created with a write intent
+# bitmap in the latter modes, so the resync picks up from where it stopped.
+#
+# `status` reports how far each array got, to weigh install time against time
+# to redundancy per plan.
+
+import argparse
+import glob
+import json
+import os
+import sys
+
+SYSFS = "/sys/block"
+# KiB/s, per array
+THROTTLE_MAX = 10000
+
+
+class ResyncError(Exception):
+    pass
+
+
+def md_dir(array, sysfs=SYSFS):
+    """The sysfs md directory of an array given as /dev/md/NAME, /dev/mdN or mdN."""
+    name = os.path.basename(os.path.realpath(array)) if "/" in array else array
+    path = os.path.join(sysfs, name, "md")
+    if not os.path.isdir(path):
+        raise ResyncError("%s is not an md array" % array)
+    return path
+
+
+def arrays(sysfs=SYSFS):
+    return sorted(
+        os.path.basename(os.path.dirname(p))
+        for p in glob.glob(os.path.join(sysfs, "md*", "md"))
+    )
+
+
+def _read(path, name):
+    with open(os.path.join(path, name)) as f:
+        return f.read().strip()
+
+
+def _write(path, name, value):
+    with open(os.path.join(path, name), "w") as f:
+        f.write(str(value))
+
+
+def redundant(level):
+    return level not in ("raid0", "linear", "")
+
+
+def throttle(path, max_speed=THROTTLE_MAX):
+    _write(path, "sync_speed_max", max_speed)
+    # the min speed is guaranteed even with other io going on
+    if int(_read(path, "sync_speed_min").split()[0]) > max_speed:
+        _write(path, "sync_speed_min", max_speed)
+
+
+def defer(path):
+    # interrupts a running resync, the checkpoint is kept in resync_start
+    _write(path, "sync_action", "frozen")
+
+
+def resume(path):
+    _write(path, "sync_speed_min", "system")
+    _write(path, "sync_speed_max", "system")
+    if _read(path, "sync_action") == "frozen":
+        _write(path, "sync_action", "idle")
+
+
+def status(path):
+    """The sync state of an array, sizes in 512 byte sectors."""
+    level = _read(path, "level")
+    st = {"level": level, "action": _read(path, "sync_action")}
+    if not redundant(level):
+        return st
+
+    total = int(_read(path, "component_size")) * 2
+    done = total
+    completed = _read(path, "sync_completed")
+    if "/" in completed:
+        done, total = (int(n) for n in completed.split("/"))
+    else:
+        start = _read(path, "resync_start")
+        if start != "none":
+            done = min(int(start), total)
+
+    st.update(
+        done=done,
+        total=total,
+        remaining=total - done,
+        remaining_pct=round(100.0 * (total - done) / total, 1) if total else 0.0,
+    )
+    return st
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="control md raid resync")
+    parser.add_argument("--sysfs", default=SYSFS, help=argparse.SUPPRESS)
+    sub = parser.add_subparsers(dest="command")
+
+    p = sub.add_parser("throttle", help="limit the resync speed")
+    p.add_argument("--max", type=int, default=THROTTLE_MAX, help="KiB/s")
+    p.add_argument("arrays", nargs="*", help="default all")
+    p = sub.add_parser("defer", help="stop resyncing until resumed")
+    p.add_argument("arrays", nargs="*", help="default all")
+    p = sub.add_parser("resume", help="resync at the system speed limits")
+    p.add_argument("arrays", nargs="*", help="default all")
+    p = sub.add_parser("status", help="print the resync progress as json")
+    p.add_argument("arrays", nargs="*", help="default all")
+
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_usage(sys.stderr)
+        return 2
+
+    try:
+        paths = {a: md_dir(a, args.sysfs) for a in args.arrays or arrays(args.sysfs)}
+        if args.command == "status":
+            out = {a: status(p) for a, p in paths.items()}
+            for a, st in sorted(out.items()):
+                if "remaining" in st:
+                    print(
+                        "mdresync: %s %s %s, %.1f%% (%d sectors) left"
+                        % (
+                            a,
+                            st["level"],
+                            st["action"],
+                            st["remaining_pct"],
+                            st["remaining"],
+                        ),
+                        file=sys.stderr,
+                    )
+            print(json.dumps(out, sort_keys=True))
+            return 0
+
+        for a, p in sorted(paths.items()):
+            if not redundant(_read(p, "level")):
+                continue
+            if args.command == "throttle":
+                throttle(p, args.max)
+            elif args.command == "defer":
+                defer(p)
+            else:
+                resume(p)
+            print("mdresync: %s %s" % (args.command, a), file=sys.stderr)
+    except (ResyncError, OSError, ValueError) as e:
+        print("mdresync: %s" % e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,7 +6,7 @@ set -o nounset
 
 # defaults
 # shellcheck disable=SC2207
-disks=($(lsblk -dno name -e1,7,11 | sed 's|^|/dev/|' | sort))
+disks=($(list_disks))
 userdata='/dev/null'
 
 USAGE="Usage: $0 -M /metadata
@@ -62,6 +62,16 @@ if [[ ${verbose_logging} == true ]]; then
 	set -o xtrace
 fi
 
+raid_resync=$(sed -nr 's|.*\braid_resync=(\S+).*|\1|p' "$userdata")
+raid_resync=${raid_resync:-full}
+case $raid_resync in
+full | throttle | defer) ;;
+*)
+	echo -e "${YELLOW}###### Unknown raid_resync=${raid_resync}, using full${NC}"
+	raid_resync=full
+	;;
+esac
+
 # On errors, run autofail() before exiting
 set_autofail_stage "OSIE startup"
 function autofail() {
@@ -77,7 +87,10 @@ trap autofail EXIT
 OS=$os${tag:+:$tag}
 
 # if $BASEURL is not empty then the user specifically passed in the artifacts
-# location, we should not trample it
+# location, we should not trample it, and fetch the grub templates from there
+# instead of using the ones bundled into the image
+grub_remote=false
+[[ -n ${BASEURL:-} ]] && grub_remote=true
 BASEURL=${BASEURL:-http://install.$facility.packet.net/misc/osie/current}
 
 # if $mirror is not empty then the user specifically passed in the mirror
@@ -154,6 +167,29 @@ else
 	fi
 fi
 
+# Grub config
+os_name=${OS%%:*}
+grubbase="$BASEURL/grub/${os_name//_(arm|image)//}"
+
+# Probe everything the install fetches from up front and at once, the results
+# are reused by the steps below and by a rerun of this install
+set_autofail_stage "preflight"
+probes=("tinkerbell=$tinkerbell")
+if ! [[ -f /statedir/disks-partioned-image-extracted ]]; then
+	configure_image_cache_dns
+	$grub_remote && probes+=("grub=$grubbase/$class/grub.template")
+	if [[ ${OS} =~ : && $custom_image == false ]]; then
+		probes+=("mirror=https://github-mirror.packet.net/packethost/packet-images.git/info/refs?service=git-upload-pack")
+		# the git side of the mirror can be up while its lfs side is not, so
+		# also download the start of a known lfs object (lfs-testing's
+		# tiny/tiny.img) through the batch api
+		probes+=("mirror_lfs=https://github-mirror.packet.net/packethost/lfs-testing.git/info/lfs/objects/batch#7b331c02e313c7599d5a90212e17e6d3cb729bd2e1c9b873c302a63c95a2f9bf")
+	elif [[ -n ${image_uri} ]]; then
+		probes+=("image=${image_uri}/image.tar.gz")
+	fi
+fi
+preflight "${probes[@]}" || echo -e "${YELLOW}###### Some endpoints are unreachable, carrying on${NC}"
+
 ## Begin installation
 ##
 stimer=$(date +%s)
@@ -163,15 +199,17 @@ if ! [[ -f /statedir/disks-partioned-image-extracted ]]; then
 	assetdir=/tmp/assets
 	mkdir $assetdir
 	set_autofail_stage "OS image fetch"
+	# the rootfs is a tarball unless the image ships a usable block mapped raw fs image
+	rootfs=image.tar.gz
+	rootfs_format=$(jq -r '.filesystems[]?.mount | select(.point == "/") | .format' $cprconfig)
 	echo -e "${GREEN}#### Fetching image (and more) via git ${NC}"
-	configure_image_cache_dns
 
 	if [[ ${OS} =~ : && $custom_image == false ]]; then
 		image_tag=$(echo "$OS" | awk -F':' '{print $2}')
 
 		githost="github-mirror.packet.net"
 		# Prefer our local github-mirror, falling back to github.com
-		if ! github_mirror_check; then
+		if ! preflight_ok mirror || ! preflight_ok mirror_lfs; then
 			echo -e "${YELLOW}###### github-mirror health check failed, falling back to using github.com${NC}"
 			githost="github.com"
 		fi
@@ -199,13 +237,27 @@ if ! [[ -f /statedir/disks-partioned-image-extracted ]]; then
 		echo -e "${GREEN}#### Performing a shallow git fetch for: ${image_tag}${NC}"
 		git -C $assetdir fetch --depth 1 origin "${image_tag}"
 		echo -e "${GREEN}#### Performing a checkout of FETCH_HEAD${NC}"
-		git -C $assetdir checkout FETCH_HEAD
+		# lfs objects are pulled afterwards, only the ones the install uses
+		GIT_LFS_SKIP_SMUDGE=1 git -C $assetdir checkout FETCH_HEAD
+		if [[ -f $assetdir/image.bmap.json ]]; then
+			lfs_pull $assetdir image.bmap.json
+			blockmap_usable $assetdir/image.bmap.json "$rootfs_format" && rootfs=image.img.gz
+		fi
+		if [[ $rootfs == image.img.gz ]]; then
+			lfs_pull $assetdir image.bmap.json image.img.gz initrd.tar.gz kernel.tar.gz modules.tar.gz
+		else
+			lfs_pull $assetdir
+		fi
 	elif [[ $image_uri =~ ^https:// ]]; then
 		echo -e "${GREEN}#### Adding custom uri: ${image_uri}${NC}"
-		rcurl "${image_uri}/image.tar.gz" --output "$assetdir/image.tar.gz"
-		rcurl "${image_uri}/initrd.tar.gz" --output "$assetdir/initrd.tar.gz"
-		rcurl "${image_uri}/kernel.tar.gz" --output "$assetdir/kernel.tar.gz"
-		rcurl "${image_uri}/modules.tar.gz" --output "$assetdir/modules.tar.gz"
+		image_files=(image.tar.gz initrd.tar.gz kernel.tar.gz modules.tar.gz)
+		if rcurl -sf "${image_uri}/image.bmap.json" --output $assetdir/image.bmap.json && blockmap_usable $assetdir/image.bmap.json "$rootfs_format"; then
+			rootfs=image.img.gz
+			image_files=(image.bmap.json image.img.gz initrd.tar.gz kernel.tar.gz modules.tar.gz)
+		fi
+		for f in "${image_files[@]}"; do
+			rcurl "${image_uri}/$f" --output "$assetdir/$f"
+		done
 	else
 		echo -e "${RED}#### Image URI is not https: ${image_uri}${NC}"
 		exit 1
@@ -219,7 +271,7 @@ if ! [[ -f /statedir/disks-partioned-image-extracted ]]; then
 	## Assemble configurables
 	##
 	# Image rootfs
-	image="$assetdir/image.tar.gz"
+	image="$assetdir/$rootfs"
 	# Initrd to throw on the target
 	initrd="$assetdir/initrd.tar.gz"
 	# Kernel to throw on the target
@@ -227,14 +279,75 @@ if ! [[ -f /statedir/disks-partioned-image-extracted ]]; then
 	# Modules to throw on the target
 	modules="$assetdir/modules.tar.gz"
 
-	# Grub config
-	grub="$BASEURL/grub/${OS//_(arm|image)//}/$class/grub.template"
-
-	# Check for HW specific grub template otherwise use default template
-	if ! wget --spider "${grub}"; then
-		grub="$BASEURL/grub/${OS//_(arm|image)//}/default/grub.template"
+	if [[ ${OS} =~ ^centos ]] || [[ ${OS} =~ ^rhel ]]; then
+		modulesdest=usr
+	else
+		modulesdest=
 	fi
 
+	# The install below is a graph of stages, each runs in the background as
+	# soon as what it needs is in place:
+	#
+	#   grub_templates ------------------------------------------.
+	#   initrd (unpack) ------------.                             |
+	#   cpr -> rootfs -> kernel ----+-> (kernel+initrd install) --+-> grub install
+	#                 `-> modules ----------------------------------'
+	#
+	# grub templates and the initrd do not depend on the target at all, fetch
+	# (unless bundled) and unpack them while the disks are set up.
+	function fetch_grub_templates() {
+		local template="$grubbase/$class/grub.template"
+
+		if ! $grub_remote && grub_templates_bundled "$os_name" "$class" /tmp/grub.template /tmp/grub.default; then
+			return 0
+		fi
+
+		# Check for HW specific grub template otherwise use default template,
+		# preflight already knows if there is none
+		if preflight_missing grub || ! wget "$template" -O /tmp/grub.template; then
+			template="$grubbase/default/grub.template"
+			wget "$template" -O /tmp/grub.template
+		fi
+		wget "${template}.default" -O /tmp/grub.default
+	}
+
+	function unpack_initrd() {
+		rm -rf /tmp/initrd-stage && mkdir /tmp/initrd-stage
+		tar --warning=no-timestamp -zxf "$initrd" -C /tmp/initrd-stage
+	}
+
+	function install_kernel() {
+		local kversion kernelname initrdname
+
+		tar --warning=no-timestamp -zxf "$kernel" -C $target/boot
+		kversion=$(vmlinuz_version $target/boot/vmlinuz)
+		if [[ -z $kversion ]]; then
+			echo 'unable to extract kernel version' >&2
+			exit 1
+		fi
+
+		kernelname="vmlinuz-$kversion"
+		if [[ ${OS} =~ ^centos ]] || [[ ${OS} =~ ^rhel ]]; then
+			initrdname=initramfs-$kversion.img
+		else
+			initrdname=initrd.img-$kversion
+		fi
+
+		mv $target/boot/vmlinuz "$target/boot/$kernelname" && ln -nsf "$kernelname" $target/boot/vmlinuz
+		cp "$target/boot/$kernelname" /statedir/kernel
+
+		stage_wait initrd
+		mv /tmp/initrd-stage/initrd "$target/boot/$initrdname" && ln -nsf "$initrdname" $target/boot/initrd
+		cp "$target/boot/$initrdname" /statedir/initrd
+	}
+
+	function install_modules() {
+		tar --warning=no-timestamp -zxf "$modules" -C "$target/$modulesdest"
+	}
+
+	stage_run grub_templates fetch_grub_templates
+	stage_run initrd unpack_initrd
+
 	echo -e "${WHITE}Image: $image${NC}"
 	echo -e "${WHITE}Initrd: $initrd${NC}"
 	echo -e "${WHITE}Kernel: $kernel${NC}"
@@ -266,14 +379,33 @@ if ! [[ -f /statedir/disks-partioned-image-extracted ]]; then
 
 	set_autofail_stage "CPR disk config"
 	echo -e "${GREEN}#### Running CPR disk config${NC}"
-	UEFI=$uefi ./cpr.sh $cprconfig "$target" "$preserve_data" "$deprovision_fast" | tee $cprout
+	RAID_RESYNC=$raid_resync UEFI=$uefi ./cpr.sh $cprconfig "$target" "$preserve_data" "$deprovision_fast" | tee $cprout
 
 	mount | grep $target
 
 	# Extract the image rootfs
 	set_autofail_stage "extraction of image rootfs"
-	echo -e "${GREEN}#### Retrieving image archive and installing to target $target ${NC}"
-	tar --xattrs --acls --selinux --numeric-owner --same-owner --warning=no-timestamp -zxpf "$image" -C $target
+	if [[ $rootfs == image.img.gz ]]; then
+		echo -e "${GREEN}#### Writing block mapped image to the root filesystem of target $target ${NC}"
+		rootuuid=$(jq -r .rootuuid $cprout)
+		rootdev=$(blkid -U "$rootuuid")
+		umount -R $target
+		zcat "$image" | ./blockmap.py write "$assetdir/image.bmap.json" - "$rootdev"
+		# the image brings its own fs uuid and size, take over the ones cpr set up
+		e2fsck -fy "$rootdev" || (($? < 4))
+		tune2fs -U "$rootuuid" "$rootdev"
+		resize2fs "$rootdev"
+		./cpr.sh $cprconfig "$target" "$preserve_data" "$deprovision_fast" mount $cprout >/dev/null
+	else
+		echo -e "${GREEN}#### Retrieving image archive and installing to target $target ${NC}"
+		tar --xattrs --acls --selinux --numeric-owner --same-owner --warning=no-timestamp -zxpf "$image" -C $target
+	fi
+
+	# kernel and modules only need the rootfs in place, install them while the
+	# rest of the target is configured
+	echo -e "${GREEN}#### Copying kernel, modules, and initrd to target $target ${NC}"
+	stage_run kernel install_kernel
+	stage_run modules install_modules
 
 	# dump cpr provided fstab into $target
 	jq -r .fstab "$cprout" >$target/etc/fstab
@@ -298,35 +430,12 @@ if ! [[ -f /statedir/disks-partioned-image-extracted ]]; then
 
 	# Install kernel and initrd
 	set_autofail_stage "install of kernel/modules/initrd to target"
-	echo -e "${GREEN}#### Copying kernel, modules, and initrd to target $target ${NC}"
-	tar --warning=no-timestamp -zxf "$kernel" -C $target/boot
-	kversion=$(vmlinuz_version $target/boot/vmlinuz)
-	if [[ -z $kversion ]]; then
-		echo 'unable to extract kernel version' >&2
-		exit 1
-	fi
-
-	kernelname="vmlinuz-$kversion"
-	if [[ ${OS} =~ ^centos ]] || [[ ${OS} =~ ^rhel ]]; then
-		initrdname=initramfs-$kversion.img
-		modulesdest=usr
-	else
-		initrdname=initrd.img-$kversion
-		modulesdest=
-	fi
-
-	mv $target/boot/vmlinuz "$target/boot/$kernelname" && ln -nsf "$kernelname" $target/boot/vmlinuz
-	tar --warning=no-timestamp -zxf "$initrd" && mv initrd "$target/boot/$initrdname" && ln -nsf "$initrdname" $target/boot/initrd
-	tar --warning=no-timestamp -zxf "$modules" -C "$target/$modulesdest"
-	cp "$target/boot/$kernelname" /statedir/kernel
-	cp "$target/boot/$initrdname" /statedir/initrd
+	stage_wait kernel modules
 
 	# Install grub
 	set_autofail_stage "install of grub"
 	echo -e "${GREEN}#### Installing GRUB2${NC}"
-
-	wget "$grub" -O /tmp/grub.template
-	wget "${grub}.default" -O /tmp/grub.default
+	stage_wait grub_templates
 
 	./grub-installer.sh -v -p "$class" -t "$target" -C "$cprout" -D /tmp/grub.default -T /tmp/grub.template
 
@@ -581,6 +690,11 @@ else
 	phone_home "${tinkerbell}" '{"type":"provisioning.108"}'
 fi
 
+# how much of the initial raid resync was left for the installed os, then let
+# it run at full speed
+./mdresync.py status | tee /statedir/raid-resync.json || :
+./mdresync.py resume || :
+
 if [[ $pwhash == "preinstall" ]]; then
 	exit 0
 fi
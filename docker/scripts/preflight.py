@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+# Probes the endpoints an install needs, all at once.
+#
+# Each NAME=URL is requested with a one byte range GET, in parallel, and what
+# came back (the status, or the error if there was no answer) is cached in the
+# statedir. Successes and 404s younger than --ttl are answered from the cache,
+# so osie.sh running again for the same install (after check-env, or on a retry)
+# does not probe again, anything else is probed again. `probe` exits non-zero if
+# any endpoint did not answer at all, `ok`, `missing` and `answered` answer from
+# the cache whether an endpoint answered with a success, with a 404 or at all.
+#
+# A git-lfs batch endpoint with an object id as the fragment
+# (.../info/lfs/objects/batch#OID) is asked for a download of that object
+# instead, and the range GET goes to where the server says the object is. An
+# lfs server that answers but can not hand out the object reports the error
+# code it gave for it, so a mirror whose git side works but whose lfs side does
+# not is not ok.
+#
+#   ./preflight.py probe tinkerbell=http://tinkerbell.ewr1.packet.net \
+#       mirror=https://github-mirror.packet.net/packethost/packet-images.git/info/refs?service=git-upload-pack \
+#       mirror_lfs=https://github-mirror.packet.net/packethost/lfs-testing.git/info/lfs/objects/batch#7b331c02e313c7599d5a90212e17e6d3cb729bd2e1c9b873c302a63c95a2f9bf
+#   ./preflight.py ok mirror
+
+import argparse
+import json
+import os
+import ssl
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent import futures
+
+CACHE = "/statedir/preflight.json"
+TTL = 600
+TIMEOUT = 10
+
+
+LFS_BATCH = "/info/lfs/objects/batch"
+LFS_JSON = "application/vnd.git-lfs+json"
+
+
+def fetch(req, timeout, read=False):
+    """The status req is answered with, and the body of a success if read."""
+    # only reachability is checked and nothing read is trusted, the mirror is
+    # fetched from with certificate checks off anyway
+    context = ssl._create_unverified_context()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout, context=context) as resp:
+            return resp.status, resp.read() if read else None
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+
+def lfs_fetch(url, timeout):
+    """The status a download of the object in url's fragment ends with, through
+    the git-lfs batch api at url and then from the object's storage."""
+    url, _, oid = url.partition("#")
+    # the api wants a size, downloads are looked up by the oid
+    body = {
+        "operation": "download",
+        "transfers": ["basic"],
+        "objects": [{"oid": oid, "size": 0}],
+    }
+    req = urllib.request.Request(
+        url,
+        data=json.dumps(body).encode(),
+        headers={"Accept": LFS_JSON, "Content-Type": LFS_JSON},
+        method="POST",
+    )
+    status, body = fetch(req, timeout, read=True)
+    if status != 200:
+        return status
+    try:
+        obj = json.loads(body.decode())["objects"][0]
+        if "error" in obj:
+            return int(obj["error"]["code"])
+        download = obj["actions"]["download"]
+        headers = dict(download.get("header") or {}, Range="bytes=0-0")
+        req = urllib.request.Request(download["href"], headers=headers)
+    except (KeyError, IndexError, TypeError, ValueError, AttributeError):
+        raise ValueError("bad lfs batch response")
+    return fetch(req, timeout)[0]
+
+
+def probe(url, timeout=TIMEOUT):
+    """The status url answers with, or the error if it did not answer."""
+    start = time.monotonic()
+    result = {"url": url, "status": None, "error": None}
+    try:
+        if LFS_BATCH + "#" in url:
+            result["status"] = lfs_fetch(url, timeout)
+        else:
+            req = urllib.request.Request(url, headers={"Range": "bytes=0-0"})
+            result["status"] = fetch(req, timeout)[0]
+    except (OSError, ValueError) as e:
+        result["error"] = str(getattr(e, "reason", None) or e) or type(e).__name__
+    result["seconds"] = round(time.monotonic() - start, 3)
+    result["time"] = time.time()
+    return result
+
+
+def load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save(path, cache):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".preflight.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+        os.rename(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def fresh(result, url, ttl, now=None):
+    """Whether result can stand in for probing url. Only the answers that would
+    come back the same on a retry are kept, a 5xx or no answer is not."""
+    now = time.time() if now is None else now
+    return (
+        (ok(result) or missing(result))
+        and result["url"] == url
+        and now - result["time"] < ttl
+    )
+
+
+def run(probes, path=CACHE, ttl=TTL, timeout=TIMEOUT, refresh=False):
+    """Probes each name: url of probes that has no fresh cached result, all in
+    parallel, returns the results by name."""
+    cache = load(path)
+    results = {}
+    todo = {}
+    for name, url in probes.items():
+        if not refresh and fresh(cache.get(name), url, ttl):
+            results[name] = dict(cache[name], cached=True)
+        else:
+            todo[name] = url
+
+    if todo:
+        with futures.ThreadPoolExecutor(max_workers=len(todo)) as pool:
+            done = {
+                name: pool.submit(probe, url, timeout) for name, url in todo.items()
+            }
+        for name, f in done.items():
+            cache[name] = results[name] = f.result()
+        save(path, cache)
+    return results
+
+
+def answered(result):
+    return result is not None and result["status"] is not None
+
+
+def ok(result):
+    return answered(result) and result["status"] < 400
+
+
+def missing(result):
+    return answered(result) and result["status"] in (404, 410)
+
+
+def parse_probe(s):
+    name, sep, url = s.partition("=")
+    if not sep or not name or not url:
+        raise argparse.ArgumentTypeError("expected NAME=URL, got %r" % s)
+    return name, url
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="probe the endpoints of an install")
+    parser.add_argument("--cache", default=CACHE, help="results file")
+    sub = parser.add_subparsers(dest="command")
+
+    p = sub.add_parser("probe", help="probe endpoints, print the results as json")
+    p.add_argument("--ttl", type=float, default=TTL, help="seconds to reuse results")
+    p.add_argument("--timeout", type=float, default=TIMEOUT, help="seconds")
+    p.add_argument("--refresh", action="store_true", help="ignore cached results")
+    p.add_argument("probes", nargs="+", type=parse_probe, metavar="NAME=URL")
+    p = sub.add_parser("ok", help="whether NAME answered with a success")
+    p.add_argument("name")
+    p = sub.add_parser("missing", help="whether NAME answered with a 404")
+    p.add_argument("name")
+    p = sub.add_parser("answered", help="whether NAME answered at all")
+    p.add_argument("name")
+
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_usage(sys.stderr)
+        return 2
+
+    if args.command == "ok":
+        return 0 if ok(load(args.cache).get(args.name)) else 1
+    if args.command == "missing":
+        return 0 if missing(load(args.cache).get(args.name)) else 1
+    if args.command == "answered":
+        return 0 if answered(load(args.cache).get(args.name)) else 1
+
+    results = run(dict(args.probes), args.cache, args.ttl, args.timeout, args.refresh)
+    for name, r in sorted(results.items()):
+        print(
+            "preflight: %s %s %s in %.3fs%s"
+            % (
+                name,
+                r["url"],
+                r["status"] or r["error"],
+                r["seconds"],
+                " (cached)" if r.get("cached") else "",
+            ),
+            file=sys.stderr,
+        )
+    print(json.dumps(results, sort_keys=True))
+    return 0 if all(answered(r) for r in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,7 +6,7 @@ set -o nounset
 
 # defaults
 # shellcheck disable=SC2207
-disks=($(lsblk -dno name -e1,7,11 | sed 's|^|/dev/|' | sort))
+disks=($(list_disks))
 
 stimer=$(date +%s)
 
@@ -15,6 +15,8 @@ stimer=$(date +%s)
 mdarrays=($(awk '/md/ {print $4}' /proc/partitions))
 if ((${#mdarrays[*]} != 0)); then
 	for mdarray in "${mdarrays[@]}"; do
+		# with explicitly given disks only the arrays on them are theirs to stop
+		[[ -n ${OSIE_DISKS:-} ]] && ! md_on_disks "$mdarray" "${disks[@]}" && continue
 		echo "MD array: $mdarray"
 		mdadm --stop "/dev/$mdarray"
 		# sometimes --remove fails, according to manpages seems we
@@ -33,7 +35,7 @@ for bd in "${disks[@]}"; do
 	wait -n
 done
 
-if [[ -d /sys/firmware/efi ]]; then
+if is_uefi; then
 	for bootnum in $(efibootmgr | sed -n '/^Boot[0-9A-F]/ s|Boot\([0-9A-F]\{4\}\).*|\1|p'); do
 		efibootmgr -Bb "$bootnum"
 	done
@@ -111,6 +111,13 @@ if $early_phone; then
 	phone_home "${tinkerbell}" '{"instance_id":"'"$(jq -r .id "$metadata")"'"}'
 fi
 
+# the published checksum, if any, is what the image is verified against when
+# it is written
+image_sha256=""
+if rcurl -sfL "$image.sha256" -o /tmp/image.sha256; then
+	image_sha256=$(awk '{print $1; exit}' /tmp/image.sha256)
+fi
+
 set_autofail_stage "checking OS image url is accessible"
 if ! wget --spider "${image}"; then
 	echo "$0: Image URL unavailable: $image" >&2
@@ -146,14 +153,19 @@ phone_home "${tinkerbell}" '{"type":"provisioning.105"}'
 # Write rootfs to disk
 set_autofail_stage "writing rootfs to disk"
 tmpfile=/tmp/image.tar.gz
+write_args=(-f tar.gz)
+if [[ -n $image_sha256 ]]; then
+	write_args+=(--sha256-file /tmp/image.sha256)
+fi
+
 if should_stream "$image" ${tmpfile%/*}; then
 	echo -e "${GREEN}#### Retrieving and extracting image archive to first disk in one shot${NC}"
-	rcurl -sL "$image" | pv -bnti 5 | tar -zxOf- | dd bs=512k of="$install_disk"
+	rcurl -sL "$image" | pv -bnti 5 | ./diskimage.py write "${write_args[@]}" - "$install_disk"
 else
 	echo -e "${GREEN}#### Retrieving image archive${NC}"
 	wget --quiet "$image" -O $tmpfile
 	echo -e "${GREEN}#### Extracting image archive and writing to first disk${NC}"
-	tar -zxf $tmpfile --to-command="dd bs=512k of=$install_disk"
+	./diskimage.py write "${write_args[@]}" $tmpfile "$install_disk"
 fi
 
 ## TODO: Fix stdout redirection to block device
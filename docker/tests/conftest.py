@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the scripts are installed flat into /home/packet, mirror that for the tests
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+)
@@ -0,0 +1,173 @@
+import hashlib
+import io
+import json
+import os
+
+import pytest
+
+import blockmap
+
+BS = 4096
+
+
+def sparse_image(path, size, extents):
+    """Creates a sparse file of `size` bytes with `extents` ({offset: data}) written."""
+    with open(path, "wb") as f:
+        f.truncate(size)
+        for off, data in extents.items():
+            f.seek(off)
+            f.write(data)
+
+
+def device(path, size, fill=b"\xff"):
+    with open(path, "wb") as f:
+        f.write(fill * size)
+    return os.open(path, os.O_RDWR)
+
+
+class Unseekable(io.RawIOBase):
+    def __init__(self, data):
+        self.buf = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        # short reads, like a pipe
+        data = self.buf.read(min(len(b), 1000))
+        b[: len(data)] = data
+        return len(data)
+
+
+@pytest.fixture
+def image(tmpdir):
+    path = str(tmpdir.join("image.img"))
+    sparse_image(
+        path,
+        1024 * BS,
+        {0: b"superblock" * 100, 100 * BS: b"\x01" * (3 * BS), 1023 * BS: b"tail"},
+    )
+    return path
+
+
+def test_create(image):
+    bmap = blockmap.create(image, BS, "ext4")
+
+    assert bmap["format"] == blockmap.FORMAT
+    assert bmap["image_size"] == 1024 * BS
+    assert bmap["fstype"] == "ext4"
+    # tmpfs and friends may not report holes, then the whole image is mapped
+    firsts = [r[0] for r in bmap["ranges"]]
+    assert 0 in firsts
+    assert blockmap.mapped_bytes(bmap) <= bmap["image_size"]
+
+
+def test_create_splits_large_ranges(tmpdir, monkeypatch):
+    monkeypatch.setattr(blockmap, "MAX_RANGE_SIZE", 4 * BS)
+    path = str(tmpdir.join("image.img"))
+    sparse_image(path, 10 * BS, {0: os.urandom(10 * BS)})
+
+    ranges = blockmap.create(path, BS)["ranges"]
+    assert [r[:2] for r in ranges] == [[0, 3], [4, 7], [8, 9]]
+
+
+@pytest.mark.parametrize("seekable", [True, False])
+def test_write_roundtrip(image, tmpdir, seekable):
+    bmap = blockmap.create(image, BS, "ext4")
+    with open(image, "rb") as f:
+        data = f.read()
+
+    fd = device(str(tmpdir.join("dev")), 2048 * BS)
+    src = io.BytesIO(data) if seekable else io.BufferedReader(Unseekable(data))
+    written = blockmap.write(bmap, src, fd)
+    os.close(fd)
+
+    assert written == blockmap.mapped_bytes(bmap)
+    with open(str(tmpdir.join("dev")), "rb") as f:
+        out = f.read()
+    for first, last, _ in bmap["ranges"]:
+        start, end = first * BS, (last + 1) * BS
+        assert out[start:end] == data[start:end]
+    # only mapped ranges are touched
+    assert out[1024 * BS :] == b"\xff" * (1024 * BS)
+
+
+def test_write_skips_unmapped(tmpdir):
+    data = b"a" * BS + b"b" * BS + b"c" * BS
+    bmap = {
+        "format": blockmap.FORMAT,
+        "image_size": len(data),
+        "block_size": BS,
+        "fstype": None,
+        "ranges": [[2, 2, hashlib.sha256(b"c" * BS).hexdigest()]],
+    }
+    fd = device(str(tmpdir.join("dev")), 3 * BS, b"\0")
+    assert blockmap.write(bmap, io.BytesIO(data), fd) == BS
+    os.close(fd)
+
+    with open(str(tmpdir.join("dev")), "rb") as f:
+        assert f.read() == b"\0" * (2 * BS) + b"c" * BS
+
+
+def test_write_checksum_mismatch(image, tmpdir):
+    bmap = blockmap.create(image, BS)
+    bmap["ranges"][0][2] = "0" * 64
+    with open(image, "rb") as f:
+        fd = device(str(tmpdir.join("dev")), 1024 * BS)
+        with pytest.raises(blockmap.BlockMapError, match="checksum"):
+            blockmap.write(bmap, f, fd)
+    os.close(fd)
+
+
+def test_write_too_small(image, tmpdir):
+    bmap = blockmap.create(image, BS)
+    with open(image, "rb") as f:
+        fd = device(str(tmpdir.join("dev")), 10 * BS)
+        with pytest.raises(blockmap.BlockMapError, match="does not fit"):
+            blockmap.write(bmap, f, fd)
+    os.close(fd)
+
+
+def test_write_short_image(image, tmpdir):
+    bmap = blockmap.create(image, BS)
+    fd = device(str(tmpdir.join("dev")), 1024 * BS)
+    with pytest.raises(blockmap.BlockMapError, match="shorter"):
+        blockmap.write(bmap, io.BytesIO(b"short"), fd)
+    os.close(fd)
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        {"format": "bmaptool/2"},
+        {"block_size": 1000},
+        {"ranges": [[4, 2, ""]]},
+        {"ranges": [[0, 2, ""], [2, 3, ""]]},
+        {"ranges": [[0, 1024, ""]]},
+    ],
+)
+def test_load_invalid(tmpdir, change):
+    bmap = {
+        "format": blockmap.FORMAT,
+        "image_size": 1024 * BS,
+        "block_size": BS,
+        "fstype": "ext4",
+        "ranges": [],
+    }
+    bmap.update(change)
+    path = str(tmpdir.join("image.bmap.json"))
+    with open(path, "w") as f:
+        json.dump(bmap, f)
+
+    with pytest.raises(blockmap.BlockMapError):
+        blockmap.load(path)
+
+
+def test_check_fstype(image, tmpdir):
+    path = str(tmpdir.join("image.bmap.json"))
+    with open(path, "w") as f:
+        json.dump(blockmap.create(image, BS, "ext4"), f)
+
+    assert blockmap.main(["check", path]) == 0
+    assert blockmap.main(["check", path, "ext4"]) == 0
+    assert blockmap.main(["check", path, "xfs"]) == 1
@@ -0,0 +1,209 @@
+import glob
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import cprplan
+
+CPRDIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "ci", "cpr"
+)
+
+
+def cpr(name):
+    with open(os.path.join(CPRDIR, name + ".cpr.json")) as f:
+        return json.load(f)
+
+
+def sectors(device):
+    return 1000000
+
+
+@pytest.mark.parametrize("path", sorted(glob.glob(os.path.join(CPRDIR, "*.cpr.json"))))
+def test_ci_configs_compile(path):
+    config = cprplan.load(path)
+    ops = cprplan.plan(config, sectors=sectors)
+    assert ops
+    assert "expected duration" in cprplan.format_plan(ops)
+
+
+def test_plan_raid():
+    config = cprplan.parse(cpr("c1.xlarge.x86"))
+    ops = {op.name: op for op in cprplan.plan(config, wipe=True, sectors=sectors)}
+
+    assert sorted(ops) == [
+        "mkfs /dev/md/ROOT",
+        "mkswap /dev/md/SWAP",
+        "partition /dev/sda",
+        "partition /dev/sdb",
+        "raid /dev/md/ROOT",
+        "raid /dev/md/SWAP",
+        "wipe /dev/sda",
+        "wipe /dev/sdb",
+    ]
+    assert ops["partition /dev/sda"].deps == ["wipe /dev/sda"]
+    assert ops["raid /dev/md/ROOT"].deps == ["partition /dev/sda", "partition /dev/sdb"]
+    assert ops["mkfs /dev/md/ROOT"].deps == ["raid /dev/md/ROOT"]
+    assert ops["mkfs /dev/md/ROOT"].commands == [
+        (["mkfs.ext4", "-F", "-L", "ROOT", "/dev/md/ROOT"], False)
+    ]
+
+    argv = ops["partition /dev/sda"].commands[0][0]
+    # fmt: off
+    assert argv == [
+        "sgdisk",
+        "-n", "1:0:+4096", "-c", "1:BIOS", "-t", "1:ef02",
+        "-n", "2:0:+3993600", "-c", "2:SWAPA1", "-t", "2:8300",
+        "-n", "3:0:0", "-c", "3:ROOTA1", "-t", "3:8300",
+        "/dev/sda",
+    ]
+    # fmt: on
+
+
+@pytest.mark.parametrize("resync", ["throttle", "defer"])
+def test_plan_raid_resync(resync):
+    config = cprplan.parse(cpr("c1.xlarge.x86"))
+    ops = {op.name: op for op in cprplan.plan(config, sectors=sectors, resync=resync)}
+
+    (create, _), control = ops["raid /dev/md/ROOT"].commands
+    assert create[:3] == ["mdadm", "--create", "/dev/md/ROOT"]
+    assert "--bitmap=internal" in create
+    assert create[-2:] == ["/dev/sda3", "/dev/sdb3"]
+    assert control == (["./mdresync.py", resync, "/dev/md/ROOT"], True)
+
+    ops = {op.name: op for op in cprplan.plan(config, sectors=sectors)}
+    ((create, _),) = ops["raid /dev/md/ROOT"].commands
+    assert "--bitmap=internal" not in create
+
+
+def test_plan_pct_and_uefi():
+    config = cprplan.parse(cpr("c2.large.arm"))
+    (op,) = cprplan.plan(config, uefi=True, sectors=sectors)[:1]
+    argv = op.commands[0][0]
+    assert "1:0:+500M" in argv
+    assert "2:0:+10000" in argv
+    assert "1:ef00" in argv
+
+    ops = cprplan.plan(config, uefi=True, sectors=None)
+    assert "2:0:+1pct" in ops[0].commands[0][0]
+
+
+def test_plan_mkfs_options_are_strings():
+    config = cprplan.parse(cpr("c2.large.arm"))
+    ops = {op.name: op for op in cprplan.plan(config, sectors=sectors)}
+    argv = ops["mkfs /dev/sda1"].commands[0][0]
+    assert argv == ["mkfs.vfat", "-F", "32", "-n", "BIOS", "/dev/sda1"]
+
+
+def test_nvme_partition_names():
+    assert cprplan.partition_device("/dev/nvme0n1", 2) == "/dev/nvme0n1p2"
+    assert cprplan.partition_device("/dev/sda", 2) == "/dev/sda2"
+
+
+def test_expected_duration():
+    config = cprplan.parse(cpr("c1.xlarge.x86"))
+    ops = cprplan.plan(config, wipe=True, sectors=sectors)
+    parallel, serial = cprplan.expected_duration(ops)
+    # both disks are wiped and partitioned at the same time
+    assert parallel < serial
+    assert parallel == pytest.approx(
+        cprplan.COSTS["wipe"]
+        + ops[1].cost
+        + cprplan.COSTS["raid"]
+        + cprplan.COSTS["mkfs"]
+    )
+
+
+def invalid(change):
+    doc = cpr("c1.xlarge.x86")
+    change(doc)
+    with pytest.raises(cprplan.CPRError):
+        cprplan.parse(doc)
+
+
+def test_invalid_size():
+    invalid(lambda d: d["disks"][0]["partitions"][0].update(size="12X"))
+    invalid(lambda d: d["disks"][0]["partitions"][0].update(size="101pct"))
+    invalid(lambda d: d["disks"][0]["partitions"][0].update(size=0))
+
+
+def test_invalid_references():
+    invalid(lambda d: d["raid"][0]["devices"].append("/dev/sdz1"))
+    invalid(lambda d: d["filesystems"][0]["mount"].update(device="/dev/md/NOPE"))
+    invalid(lambda d: d["raid"][0].update(level="7"))
+    invalid(lambda d: d["disks"][1].update(device="/dev/sda"))
+    invalid(lambda d: d["disks"][0]["partitions"][1].update(number=1))
+
+
+def test_invalid_missing():
+    invalid(lambda d: d.pop("filesystems"))
+    invalid(lambda d: d["filesystems"][0]["mount"].update(point="/srv"))
+    invalid(
+        lambda d: [p.update(label="DATA") for x in d["disks"] for p in x["partitions"]]
+    )
+
+
+def test_execute_order_and_concurrency():
+    config = cprplan.parse(cpr("c1.xlarge.x86"))
+    ops = cprplan.plan(config, wipe=True, sectors=sectors)
+
+    lock = threading.Lock()
+    started = {}
+    finished = {}
+    active = [0, 0]
+
+    def run(op):
+        with lock:
+            started[op.name] = time.time()
+            active[0] += 1
+            active[1] = max(active)
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+            finished[op.name] = time.time()
+
+    cprplan.execute(ops, run=run)
+
+    assert sorted(finished) == sorted(op.name for op in ops)
+    for op in ops:
+        for dep in op.deps:
+            assert finished[dep] <= started[op.name]
+    assert active[1] >= 2
+
+
+def test_execute_failure_stops_scheduling():
+    config = cprplan.parse(cpr("c1.xlarge.x86"))
+    ops = cprplan.plan(config, sectors=sectors)
+    ran = []
+
+    def run(op):
+        ran.append(op.name)
+        if op.name == "partition /dev/sda":
+            raise cprplan.CPRError("boom")
+
+    with pytest.raises(cprplan.CPRError, match="boom"):
+        cprplan.execute(ops, run=run)
+    assert not [name for name in ran if name.startswith(("raid", "mk"))]
+
+
+def test_result():
+    config = cprplan.parse(cpr("c1.xlarge.x86"))
+    res = cprplan.result(config, uuid=lambda dev: "uuid-" + dev.rsplit("/", 1)[1])
+
+    assert res["rootuuid"] == "uuid-ROOT"
+    assert res["bootdevs"] == ["/dev/sda", "/dev/sdb"]
+    assert res["fstab"] == (
+        "UUID=uuid-ROOT\t/\text4\terrors=remount-ro\t0\t1\n"
+        "UUID=uuid-SWAP\tnone\tswap\tnone\t0\t0\n"
+    )
+
+
+def test_dry_run(capsys):
+    path = os.path.join(CPRDIR, "c1.xlarge.x86.cpr.json")
+    assert cprplan.main(["plan", "--wipe=true", path]) == 0
+    out = capsys.readouterr().out
+    assert out.startswith("# 8 operations, expected duration")
+    assert "mdadm --create /dev/md/ROOT" in out
@@ -0,0 +1,102 @@
+import os
+import threading
+import time
+
+import devwatch
+
+
+class FakeSocket:
+    """Stands in for the uevent socket, select() works on its pipe."""
+
+    def __init__(self):
+        self.r, self.w = os.pipe()
+
+    def fileno(self):
+        return self.r
+
+    def recv(self, size):
+        return os.read(self.r, size)
+
+    def send(self, data):
+        os.write(self.w, data)
+
+    def close(self):
+        os.close(self.r)
+        os.close(self.w)
+
+
+def watcher(fallback=10):
+    w = devwatch.Watcher(fallback)
+    if w.sock:
+        w.sock.close()
+    w.sock = FakeSocket()
+    return w
+
+
+def test_event_parsing():
+    with watcher() as w:
+        w.sock.send(
+            b"add@/devices/virtual/block/loop0\0ACTION=add\0"
+            b"DEVPATH=/devices/virtual/block/loop0\0SUBSYSTEM=block\0DEVNAME=loop0\0"
+        )
+        event = w._event(1)
+    assert event == {
+        "ACTION": "add",
+        "DEVPATH": "/devices/virtual/block/loop0",
+        "SUBSYSTEM": "block",
+        "DEVNAME": "loop0",
+    }
+
+
+def test_wait_wakes_on_event(tmpdir):
+    path = str(tmpdir.join("nvme0n1"))
+    seen = []
+
+    def arrive():
+        time.sleep(0.2)
+        open(path, "w").close()
+        w.sock.send(b"add@/x\0ACTION=add\0DEVNAME=nvme0n1\0")
+
+    with watcher(fallback=10) as w:
+        t = threading.Thread(target=arrive)
+        t.start()
+        start = time.time()
+        assert w.wait(devwatch.appeared([path]), 5, seen.append)
+        took = time.time() - start
+        t.join()
+
+    # the fallback re-check is 10s away, so this was the event
+    assert took < 2
+    assert seen == [{"ACTION": "add", "DEVNAME": "nvme0n1"}]
+
+
+def test_wait_checks_current_state_first(tmpdir):
+    path = tmpdir.join("state")
+    path.write("live\n")
+    with watcher() as w:
+        assert w.wait(devwatch.attr_equals(str(path), "live"), 0)
+        assert not w.wait(devwatch.attr_equals(str(path), "resetting"), 0.1)
+        assert w.wait(devwatch.disappeared([str(tmpdir.join("nvme*"))]), 0)
+
+
+def test_wait_times_out():
+    with watcher(fallback=0.05) as w:
+        start = time.time()
+        assert not w.wait(lambda: False, 0.2)
+        assert 0.2 <= time.time() - start < 2
+
+
+def test_serials_present(monkeypatch):
+    ids = ["t10.ATA     SAMSUNG MZ7KM480  S2HSNX0H500123", "S2HSNX0H500456"]
+    monkeypatch.setattr(devwatch, "block_serials", lambda: ids)
+    assert devwatch.serials_present(["S2HSNX0H500123", "S2HSNX0H500456"])()
+    assert not devwatch.serials_present(["S2HSNX0H500123", "S2HSNX0H500789"])()
+    assert devwatch.serials_present([])()
+
+
+def test_cli(tmpdir):
+    path = str(tmpdir.join("sda"))
+    assert devwatch.main(["-t", "0.1", "appear", path]) == 1
+    open(path, "w").close()
+    assert devwatch.main(["-t", "0.1", "appear", path]) == 0
+    assert devwatch.main(["-t", "0.1", "disappear", path]) == 1
@@ -0,0 +1,169 @@
+import gzip
+import hashlib
+import io
+import os
+import tarfile
+
+import pytest
+
+import diskimage
+
+BS = diskimage.BLOCK_SIZE
+MB = 1024 * 1024
+
+
+def disk_image():
+    """Data with zero runs, across chunk boundaries and an unaligned tail."""
+    chunk = diskimage.CHUNK_SIZE
+    return b"".join(
+        [
+            b"\x01" * BS,
+            bytes(3 * BS),
+            os.urandom(chunk - 4 * BS + 100),
+            bytes(chunk),
+            b"tail" * 123,
+        ]
+    )
+
+
+def device(path, size, fill=b"\xff"):
+    with open(path, "wb") as f:
+        f.write(fill * size)
+    return path
+
+
+def source(tmpdir, data, fmt):
+    path = str(tmpdir.join("image." + fmt))
+    if fmt == "raw":
+        with open(path, "wb") as f:
+            f.write(data)
+    elif fmt == "gz":
+        with gzip.open(path, "wb") as f:
+            f.write(data)
+    else:
+        mode = "w:gz" if fmt == "tar.gz" else "w"
+        with tarfile.open(path, mode) as tar:
+            info = tarfile.TarInfo("disk.img")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return path
+
+
+def sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def test_zero_runs():
+    buf = b"a" * BS + bytes(2 * BS) + b"b" + bytes(BS - 1) + bytes(10)
+    assert diskimage.zero_runs(buf, len(buf)) == [
+        (0, BS, False),
+        (BS, 3 * BS, True),
+        (3 * BS, 4 * BS, False),
+        (4 * BS, 4 * BS + 10, True),
+    ]
+    assert diskimage.zero_runs(buf, BS) == [(0, BS, False)]
+
+
+@pytest.mark.parametrize("fmt", diskimage.FORMATS)
+def test_write(tmpdir, fmt):
+    data = disk_image()
+    path = source(tmpdir, data, fmt)
+    dev = device(str(tmpdir.join("dev")), len(data) + MB)
+
+    stats = diskimage.write(path, dev, sha256=sha256(path), threads=2)
+
+    assert stats["size"] == len(data)
+    assert stats["sha256"] == sha256(path)
+    assert stats["written"] + stats["zeroed"] == len(data)
+    # the zero chunk is not block aligned, one block of it has data
+    assert stats["zeroed"] >= diskimage.CHUNK_SIZE + 2 * BS
+    with open(dev, "rb") as f:
+        out = f.read()
+    assert out[: len(data)] == data
+    # nothing past the image is touched
+    assert out[len(data) :] == b"\xff" * MB
+
+
+def test_write_skip_zeros(tmpdir):
+    data = b"\x01" * BS + bytes(BS) + b"\x02" * BS
+    path = source(tmpdir, data, "raw")
+    dev = device(str(tmpdir.join("dev")), len(data))
+
+    stats = diskimage.write(path, dev, skip_zeros=True)
+
+    assert stats["skipped"] == BS
+    assert stats["written"] == 2 * BS
+    with open(dev, "rb") as f:
+        assert f.read() == b"\x01" * BS + b"\xff" * BS + b"\x02" * BS
+
+
+def test_write_extends_plain_files(tmpdir):
+    data = b"\x01" * BS + bytes(2 * BS)
+    path = source(tmpdir, data, "raw")
+    dev = str(tmpdir.join("dev"))
+    open(dev, "wb").close()
+
+    diskimage.write(path, dev, skip_zeros=True)
+
+    with open(dev, "rb") as f:
+        assert f.read() == data
+
+
+def test_write_checksum_mismatch(tmpdir):
+    data = disk_image()
+    path = source(tmpdir, data, "gz")
+    dev = device(str(tmpdir.join("dev")), len(data) + 2 * MB)
+
+    with pytest.raises(diskimage.ImageError, match="checksum mismatch"):
+        diskimage.write(path, dev, sha256="0" * 64)
+
+    # the partition tables are wiped, the data in between is left alone
+    with open(dev, "rb") as f:
+        out = f.read()
+    assert out[: diskimage.WIPE_SIZE] == bytes(diskimage.WIPE_SIZE)
+    assert out[-diskimage.WIPE_SIZE :] == bytes(diskimage.WIPE_SIZE)
+    assert out[diskimage.WIPE_SIZE : len(data)] == data[diskimage.WIPE_SIZE :]
+
+
+def test_write_corrupt_gzip(tmpdir):
+    path = source(tmpdir, disk_image(), "gz")
+    with open(path, "r+b") as f:
+        f.seek(-8, os.SEEK_END)
+        f.write(b"\0" * 4)
+    dev = device(str(tmpdir.join("dev")), diskimage.CHUNK_SIZE * 3)
+
+    with pytest.raises(diskimage.ImageError, match="decompressing"):
+        diskimage.write(path, dev)
+
+
+def test_write_empty_tar(tmpdir):
+    path = str(tmpdir.join("image.tar"))
+    tarfile.open(path, "w").close()
+    dev = device(str(tmpdir.join("dev")), MB)
+
+    with pytest.raises(diskimage.ImageError, match="no image file"):
+        diskimage.write(path, dev)
+
+
+def test_read_sha256_file(tmpdir):
+    path = tmpdir.join("image.tar.gz.sha256")
+    path.write("%s  image.tar.gz\n" % ("AB" * 32))
+    assert diskimage.read_sha256_file(str(path)) == "ab" * 32
+
+    path.write("")
+    with pytest.raises(diskimage.ImageError):
+        diskimage.read_sha256_file(str(path))
+
+
+def test_main(tmpdir):
+    data = disk_image()
+    path = source(tmpdir, data, "tar.gz")
+    dev = device(str(tmpdir.join("dev")), len(data))
+    digest = tmpdir.join("sha256")
+    digest.write(sha256(path) + "  image.tar.gz\n")
+
+    assert diskimage.main(["write", "--sha256-file", str(digest), path, dev]) == 0
+    with open(dev, "rb") as f:
+        assert f.read() == data
+    assert diskimage.main(["write", "--sha256", "0" * 64, path, dev]) == 1
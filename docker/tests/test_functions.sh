@@ -122,5 +122,294 @@ test_filter_bad_devs() {
 
 }
 
+test_stage_run() {
+	# shellcheck disable=SC2034
+	stage_dir=$(mktemp -d)
+
+	stage_run first sh -c 'sleep 0.3; echo first >>'"$stage_dir/order"
+	stage_run second sh -c 'echo second >>'"$stage_dir/order"
+	stage_wait first second
+	assertTrue 'stages should succeed' $?
+	assertEquals 'stages should run concurrently' "$(printf 'second\nfirst')" "$(cat "$stage_dir/order")"
+
+	stage_run failing false
+	stage_wait failing 2>/dev/null
+	assertFalse 'failed stage should fail the wait' $?
+
+	rm -rf "$stage_dir"
+}
+
+test_wait_for() {
+	local flag
+	flag=$(mktemp -u)
+
+	(sleep 0.3 && touch "$flag") &
+	wait_for 5 test -e "$flag"
+	assertTrue 'should wait for the condition' $?
+
+	wait_for 0 false
+	assertFalse 'should time out' $?
+
+	rm -f "$flag"
+	(sleep 0.3 && touch "$flag") &
+	wait_for "" test -e "$flag"
+	assertTrue 'should wait without a timeout' $?
+
+	rm -f "$flag"
+}
+
+test_list_disks_override() {
+	assertEquals 'OSIE_DISKS should replace the detected disks' \
+		"$(printf '/dev/loop3\n/dev/loop4')" "$(OSIE_DISKS='/dev/loop3 /dev/loop4' list_disks)"
+	OSIE_DISKS=/dev/loop3 is_uefi
+	assertFalse 'explicit disks should never be treated as uefi booted' $?
+}
+
+test_md_on_disks() {
+	local sys_class_block=$SHUNIT_TMPDIR/class/block devices=$SHUNIT_TMPDIR/devices
+	mkdir -p "$sys_class_block" "$devices"/{loop1,loop10/loop10p1,sda,sdaa/sdaa1,md0/slaves}
+	touch "$devices"/loop10/loop10p1/partition "$devices"/sdaa/sdaa1/partition
+	ln -s ../../devices/loop10/loop10p1 "$sys_class_block"/loop10p1
+	ln -s ../../devices/sdaa/sdaa1 "$sys_class_block"/sdaa1
+	ln -s ../../devices/md0 "$sys_class_block"/md0
+	touch "$devices"/md0/slaves/{loop10p1,sdaa1}
+
+	assertFalse 'loop1 is not the disk of loop10p1' 'md_on_disks md0 /dev/loop1'
+	assertFalse 'sda is not the disk of sdaa1' 'md_on_disks md0 /dev/sda'
+	assertTrue 'partition members should match their disk' 'md_on_disks md0 /dev/loop10'
+	assertTrue 'partition members should match their disk' 'md_on_disks md0 /dev/sda /dev/sdaa'
+
+	rm -rf "$sys_class_block" "$devices"
+}
+
+test_lfs_pull_includes() {
+	local pulled=""
+	git() {
+		if [[ $4 == ls-files ]]; then
+			printf '%s * %s\n' 1111 image.bmap.json 2222 image.img.gz 3333 image.tar.gz
+			return
+		fi
+		pulled="$*"
+	}
+
+	lfs_pull repo image.bmap.json 'image.img*' >/dev/null
+	assertEquals 'only the matching objects should be pulled' '-C repo lfs pull --include=image.bmap.json,image.img.gz' "$pulled"
+
+	pulled=""
+	lfs_pull repo kernel.tar.gz >/dev/null
+	assertEquals 'nothing should be pulled without a match' '' "$pulled"
+
+	lfs_pull repo
+	assertEquals 'everything should be pulled without includes' '-C repo lfs pull' "$pulled"
+
+	unset -f git
+}
+
+test_preflight_reacquires_for_mirror() {
+	local answered
+	reacquire_dhcp() {
+		echo reacquired >>"$SHUNIT_TMPDIR/preflight-calls"
+	}
+	ip_choose_if() {
+		echo eth0
+	}
+	# every probe fails, the mirror answered as $SHUNIT_TMPDIR/answered says
+	cat >"$SHUNIT_TMPDIR/preflight.py" <<-'EOF'
+		#!/usr/bin/env bash
+		[[ $1 == answered ]] && exit "$(cat answered)"
+		exit 1
+	EOF
+	chmod +x "$SHUNIT_TMPDIR/preflight.py"
+
+	for answered in 0 1; do
+		echo $answered >"$SHUNIT_TMPDIR/answered"
+		(cd "$SHUNIT_TMPDIR" && preflight tinkerbell=http://a mirror=https://b >/dev/null)
+	done
+	(cd "$SHUNIT_TMPDIR" && preflight tinkerbell=http://a image=https://c >/dev/null)
+	assertEquals 'only a mirror that did not answer should reacquire dhcp' reacquired "$(cat "$SHUNIT_TMPDIR/preflight-calls")"
+
+	unset -f reacquire_dhcp ip_choose_if
+	rm -f "$SHUNIT_TMPDIR"/{preflight.py,preflight-calls,answered}
+}
+
+# recorded controller tool output, see raid/
+raid_fixtures=$PWD/raid
+
+# usage: raid_calls
+# prints the mutating controller commands the stubs below recorded, once
+function raid_calls() {
+	cat "$SHUNIT_TMPDIR/raid-calls" 2>/dev/null || :
+	rm -f "$SHUNIT_TMPDIR/raid-calls"
+}
+
+test_raid_query() {
+	local raid_state_dir=$SHUNIT_TMPDIR/raid
+
+	raid_query megaraid foreign sh -c 'echo "There is no foreign configuration on controller 0."; exit 2'
+	assertTrue 'exit codes should be ignored' $?
+	assertEquals 'output should be kept' 'There is no foreign configuration on controller 0.' "$(cat "$raid_state_dir/megaraid/foreign")"
+
+	rm -rf "$raid_state_dir"
+}
+
+test_raid_plan() {
+	local raid_state_dir=$SHUNIT_TMPDIR/raid
+	mkdir -p "$raid_state_dir"
+
+	raid_plan perc '/c0 /vall delete force' '/c0 set jbod=on force' >/dev/null
+	assertEquals 'steps should be recorded' "$(printf '/c0 /vall delete force\n/c0 set jbod=on force')" "$(cat "$raid_state_dir/perc.plan")"
+
+	assertEquals 'an empty plan means clean' 'perc controller is already clean, nothing to do' "$(raid_plan perc)"
+	assertTrue 'an empty plan should be recorded' "[[ -f $raid_state_dir/perc.plan ]]"
+	assertFalse 'an empty plan should be empty' "[[ -s $raid_state_dir/perc.plan ]]"
+
+	rm -rf "$raid_state_dir"
+}
+
+# usage: megaraid_state $pds $ldpd $jbod $foreign
+# puts the named recorded MegaCli64 outputs where megaraid_clean looks
+function megaraid_state() {
+	local dir=$raid_state_dir/megaraid
+	mkdir -p "$dir"
+	cp "$raid_fixtures/megaraid/$1" "$dir/pds"
+	cp "$raid_fixtures/megaraid/$2" "$dir/ldpd"
+	cp "$raid_fixtures/megaraid/$3" "$dir/jbod"
+	cp "$raid_fixtures/megaraid/$4" "$dir/foreign"
+}
+
+test_megaraid_clean() {
+	local raid_state_dir=$SHUNIT_TMPDIR/raid
+
+	megaraid_state pds-online ldpd-raid0-each jbod-disabled foreign-none
+	assertTrue 'a raid0 per drive should be clean' 'megaraid_clean Supermicro'
+	assertFalse 'a raid0 per drive is not what a Dell is left with' 'megaraid_clean "Dell Inc."'
+
+	megaraid_state pds-online ldpd-raid1-split jbod-disabled foreign-none
+	assertFalse 'a raid1 split into as many volumes as drives is a tenant layout' 'megaraid_clean Supermicro'
+	megaraid_state pds-online ldpd-raid0-span jbod-disabled foreign-none
+	assertFalse 'a raid0 over two drives is a tenant layout' 'megaraid_clean Supermicro'
+	megaraid_state pds-online ldpd-raid0-writeback jbod-disabled foreign-none
+	assertFalse 'a raid0 per drive with another cache policy is a tenant layout' 'megaraid_clean Supermicro'
+	megaraid_state pds-bad ldpd-raid0-each jbod-disabled foreign-none
+	assertFalse 'a bad drive needs a reset' 'megaraid_clean Supermicro'
+	megaraid_state pds-online ldpd-raid0-each jbod-disabled foreign-one
+	assertFalse 'a foreign config needs a reset' 'megaraid_clean Supermicro'
+
+	megaraid_state pds-jbod ldpd-none jbod-enabled foreign-none
+	assertTrue 'every drive a JBOD should be clean on a Dell' 'megaraid_clean "Dell Inc."'
+	assertFalse 'JBODs are not what others are left with' 'megaraid_clean Supermicro'
+	megaraid_state pds-online ldpd-none jbod-enabled foreign-none
+	assertFalse 'drives that are not JBODs need a reset on a Dell' 'megaraid_clean "Dell Inc."'
+
+	rm -rf "$raid_state_dir"
+}
+
+test_megaraid_reset_clean() {
+	local raid_state_dir=$SHUNIT_TMPDIR/raid
+	dmidecode() {
+		echo Supermicro
+	}
+	MegaCli64() {
+		case "$*" in
+		'-PDList -a0') cat "$raid_fixtures/megaraid/pds-online" ;;
+		'-LdPdInfo -a0') cat "$raid_fixtures/megaraid/ldpd-raid0-each" ;;
+		'-CfgForeign -Scan -a0') cat "$raid_fixtures/megaraid/foreign-none" ;;
+		'-AdpGetProp -EnableJBOD -a0') cat "$raid_fixtures/megaraid/jbod-disabled" ;;
+		*) echo "MegaCli64 $*" >>"$SHUNIT_TMPDIR/raid-calls" ;;
+		esac
+	}
+
+	megaraid_reset >/dev/null
+	assertEquals 'a clean controller should not be touched' '' "$(raid_calls)"
+	assertFalse 'the plan should be empty' "[[ -s $raid_state_dir/megaraid.plan ]]"
+
+	unset -f dmidecode MegaCli64
+	rm -rf "$raid_state_dir"
+}
+
+test_perc_reset() {
+	local raid_state_dir=$SHUNIT_TMPDIR/raid vds=vds
+	dmidecode() {
+		echo "Dell Inc."
+	}
+	perccli64() {
+		case "$*" in
+		'show all') cat "$raid_fixtures/perc/show-all" ;;
+		'/call/eall/sall show all') cat "$raid_fixtures/perc/drives" ;;
+		'/c0 show personality') cat "$raid_fixtures/perc/personality" ;;
+		'/c0 /vall show') cat "$raid_fixtures/perc/$vds" ;;
+		'/c0 show jbod') cat "$raid_fixtures/perc/jbod" ;;
+		*) echo "perccli64 $*" >>"$SHUNIT_TMPDIR/raid-calls" ;;
+		esac
+	}
+
+	perc_reset >/dev/null
+	assertEquals 'a clean controller should not be touched' '' "$(raid_calls)"
+	assertFalse 'the plan should be empty' "[[ -s $raid_state_dir/perc.plan ]]"
+
+	vds='vds-raid1'
+	perc_reset >/dev/null
+	assertEquals 'only the vds should be deleted' 'perccli64 /c0 /vall delete force' "$(raid_calls)"
+
+	unset -f dmidecode perccli64
+	rm -rf "$raid_state_dir"
+}
+
+test_marvell_reset() {
+	local raid_state_dir=$SHUNIT_TMPDIR/raid vdlist=vd
+	dmidecode() {
+		echo Supermicro
+	}
+	mvcli() {
+		case "$*" in
+		'info -o vd') cat "$raid_fixtures/marvell/$vdlist" ;;
+		'info -o pd') cat "$raid_fixtures/marvell/pd" ;;
+		*) echo "mvcli $*" >>"$SHUNIT_TMPDIR/raid-calls" ;;
+		esac
+	}
+	udevadm() {
+		echo "udevadm $*" >>"$SHUNIT_TMPDIR/raid-calls"
+	}
+	# marvell_reset waits for the drives with ./devwatch.py
+	printf '#!/bin/sh\n' >"$SHUNIT_TMPDIR/devwatch.py"
+	chmod +x "$SHUNIT_TMPDIR/devwatch.py"
+
+	(cd "$SHUNIT_TMPDIR" && marvell_reset >/dev/null)
+	assertTrue 'a clean controller should be ready' $?
+	assertEquals 'a clean controller should not be touched' '' "$(raid_calls)"
+	assertFalse 'the plan should be empty' "[[ -s $raid_state_dir/marvell.plan ]]"
+
+	vdlist='vd-raid1'
+	(cd "$SHUNIT_TMPDIR" && marvell_reset >/dev/null)
+	assertEquals 'the vd should be deleted' "$(printf 'mvcli delete -f -o vd -i 0\nudevadm settle')" "$(raid_calls)"
+
+	unset -f dmidecode mvcli udevadm
+	rm -rf "$raid_state_dir" "$SHUNIT_TMPDIR/devwatch.py"
+}
+
+test_smartarray_reset() {
+	local raid_state_dir=$SHUNIT_TMPDIR/raid config=config out
+	dmidecode() {
+		echo HPE
+	}
+	ssacli() {
+		case "$*" in
+		'ctrl all show config') cat "$raid_fixtures/smartarray/$config" ;;
+		*) echo "ssacli $*" >>"$SHUNIT_TMPDIR/raid-calls" ;;
+		esac
+	}
+
+	out=$(smartarray_reset)
+	assertEquals 'a clean controller should not be touched' '' "$(raid_calls)"
+	assertFalse 'nothing should be said to be cleared' "grep -q clearing <<<'$out'"
+
+	config='config-raid1'
+	smartarray_reset >/dev/null
+	assertEquals 'the logical drives should be deleted' 'ssacli controller slot=0 logicaldrive all delete forced' "$(raid_calls)"
+
+	unset -f dmidecode ssacli
+	rm -rf "$raid_state_dir"
+}
+
 # shellcheck disable=SC1091
 source ./shunit/shunit2
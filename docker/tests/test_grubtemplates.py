@@ -0,0 +1,114 @@
+import json
+import os
+
+import pytest
+
+import grubtemplates
+
+grub = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "grub")
+
+
+def write(d, *names):
+    for name in names:
+        d.join(name).write(name)
+
+
+@pytest.fixture
+def src(tmpdir):
+    d = tmpdir.mkdir("grub")
+    write(
+        d,
+        "ubuntu_18_04-default-grub.template",
+        "ubuntu_18_04-default-grub.template.default",
+        "ubuntu_18_04-c1.large.arm-grub.template.default",
+        "ubuntu_18_04-c3.medium.x86-grub.template",
+        "ubuntu_18_04-c3.medium.x86-grub.template.default",
+        "README",
+    )
+    return d
+
+
+def test_index(src):
+    idx = grubtemplates.index(grubtemplates.scan(str(src)))
+    assert idx == {
+        "ubuntu_18_04": {
+            "default": [
+                "ubuntu_18_04-default-grub.template",
+                "ubuntu_18_04-default-grub.template.default",
+            ],
+            # only a plan template replaces the default one, as osie.sh did
+            "c1.large.arm": [
+                "ubuntu_18_04-default-grub.template",
+                "ubuntu_18_04-default-grub.template.default",
+            ],
+            "c3.medium.x86": [
+                "ubuntu_18_04-c3.medium.x86-grub.template",
+                "ubuntu_18_04-c3.medium.x86-grub.template.default",
+            ],
+        }
+    }
+
+
+def test_resolve(src):
+    idx = grubtemplates.index(grubtemplates.scan(str(src)))
+    assert grubtemplates.resolve(idx, "ubuntu_18_04", "c3.medium.x86")[0] == (
+        "ubuntu_18_04-c3.medium.x86-grub.template"
+    )
+    assert grubtemplates.resolve(idx, "ubuntu_18_04", "m3.large.x86")[0] == (
+        "ubuntu_18_04-default-grub.template"
+    )
+    assert grubtemplates.resolve(idx, "rocky_8", "default") is None
+
+
+@pytest.mark.parametrize(
+    "names",
+    [
+        ["centos_7-default-grub.template.default"],
+        [
+            "centos_7-default-grub.template",
+            "centos_7-default-grub.template.default",
+            "centos_7-c2.medium.x86-grub.template",
+        ],
+    ],
+)
+def test_index_incomplete(tmpdir, names):
+    write(tmpdir, *names)
+    with pytest.raises(grubtemplates.TemplateError):
+        grubtemplates.index(grubtemplates.scan(str(tmpdir)))
+
+
+def test_repo_templates():
+    idx = grubtemplates.index(grubtemplates.scan(grub))
+    for os_name, plans in idx.items():
+        for template, defaults in plans.values():
+            assert os.path.exists(os.path.join(grub, template))
+            assert os.path.exists(os.path.join(grub, defaults))
+
+
+def test_bundle_and_resolve(src, tmpdir):
+    dest = tmpdir.join("bundle")
+    assert grubtemplates.main(["bundle", str(src), str(dest)]) == 0
+    with open(str(dest.join("index.json"))) as f:
+        assert sorted(json.load(f)["ubuntu_18_04"]) == [
+            "c1.large.arm",
+            "c3.medium.x86",
+            "default",
+        ]
+    # the plan .default that is never used is left out
+    assert not dest.join("ubuntu_18_04-c1.large.arm-grub.template.default").check()
+
+    template, defaults = tmpdir.join("grub.template"), tmpdir.join("grub.default")
+    args = ["resolve", "--bundle", str(dest)]
+    assert (
+        grubtemplates.main(
+            args + ["ubuntu_18_04", "c3.medium.x86", str(template), str(defaults)]
+        )
+        == 0
+    )
+    assert template.read() == "ubuntu_18_04-c3.medium.x86-grub.template"
+    assert defaults.read() == "ubuntu_18_04-c3.medium.x86-grub.template.default"
+
+    assert (
+        grubtemplates.main(args + ["rocky_8", "default", str(template), str(defaults)])
+        == 1
+    )
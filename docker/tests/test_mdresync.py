@@ -0,0 +1,104 @@
+import json
+
+import pytest
+
+import mdresync
+
+
+def md(sysfs, name, **attrs):
+    values = {
+        "level": "raid1",
+        "sync_action": "resync",
+        "sync_completed": "1000 / 4000",
+        "resync_start": "1000",
+        "component_size": "2000",
+        "sync_speed_min": "1000 (system)",
+        "sync_speed_max": "200000 (system)",
+    }
+    values.update(attrs)
+    d = sysfs.mkdir(name).mkdir("md")
+    for k, v in values.items():
+        d.join(k).write(v)
+    return d
+
+
+def attr(d, name):
+    return d.join(name).read()
+
+
+@pytest.fixture
+def sysfs(tmpdir):
+    return tmpdir.mkdir("block")
+
+
+def test_status(sysfs):
+    md(sysfs, "md126")
+    md(sysfs, "md127", sync_action="frozen", sync_completed="none")
+    md(sysfs, "md125", sync_action="idle", sync_completed="none", resync_start="none")
+    md(sysfs, "md124", level="raid0", sync_action="none")
+
+    st = {
+        a: mdresync.status(mdresync.md_dir(a, str(sysfs)))
+        for a in mdresync.arrays(str(sysfs))
+    }
+
+    assert st["md126"]["remaining"] == 3000
+    assert st["md126"]["remaining_pct"] == 75.0
+    # frozen resyncs are tracked by the checkpoint
+    assert st["md127"]["action"] == "frozen"
+    assert st["md127"]["remaining"] == 3000
+    assert st["md125"]["remaining"] == 0
+    assert st["md124"] == {"level": "raid0", "action": "none"}
+
+
+def test_throttle(sysfs):
+    d = md(sysfs, "md127")
+    mdresync.throttle(str(d), 500)
+    assert attr(d, "sync_speed_max") == "500"
+    assert attr(d, "sync_speed_min") == "500"
+
+    d = md(sysfs, "md126")
+    mdresync.throttle(str(d), 5000)
+    assert attr(d, "sync_speed_max") == "5000"
+    assert attr(d, "sync_speed_min") == "1000 (system)"
+
+
+def test_defer_and_resume(sysfs):
+    d = md(sysfs, "md127")
+    mdresync.defer(str(d))
+    assert attr(d, "sync_action") == "frozen"
+
+    mdresync.resume(str(d))
+    assert attr(d, "sync_action") == "idle"
+    assert attr(d, "sync_speed_min") == "system"
+    assert attr(d, "sync_speed_max") == "system"
+
+
+def test_md_dir(sysfs, tmpdir):
+    md(sysfs, "md127")
+    dev = tmpdir.join("md127")
+    dev.write("")
+    link = tmpdir.join("ROOT")
+    link.mksymlinkto(dev)
+
+    assert mdresync.md_dir(str(link), str(sysfs)) == str(sysfs.join("md127", "md"))
+    assert mdresync.md_dir("md127", str(sysfs)) == str(sysfs.join("md127", "md"))
+    with pytest.raises(mdresync.ResyncError):
+        mdresync.md_dir("sda", str(sysfs))
+
+
+def test_main(sysfs, capsys):
+    d = md(sysfs, "md127")
+    r0 = md(sysfs, "md126", level="raid0", sync_action="none")
+
+    assert mdresync.main(["--sysfs", str(sysfs), "defer"]) == 0
+    assert attr(d, "sync_action") == "frozen"
+    # nothing to resync on raid0
+    assert attr(r0, "sync_action") == "none"
+
+    capsys.readouterr()
+    assert mdresync.main(["--sysfs", str(sysfs), "status", "md127"]) == 0
+    out = json.loads(capsys.readouterr().out)
+    assert out["md127"]["remaining"] == 3000
+
+    assert mdresync.main(["--sysfs", str(sysfs), "resume", "md1"]) == 1
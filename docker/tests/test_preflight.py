@@ -0,0 +1,193 @@
+import http.server
+import json
+import socket
+import socketserver
+import threading
+import time
+
+import pytest
+
+import preflight
+
+OID = "7b331c02e313c7599d5a90212e17e6d3cb729bd2e1c9b873c302a63c95a2f9bf"
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.path.startswith("/slow"):
+            time.sleep(0.5)
+        status = 206
+        if self.path.startswith("/missing"):
+            status = 404
+        elif self.path.startswith("/error"):
+            status = 503
+        self.send_response(status)
+        self.send_header("Content-Length", "1")
+        self.end_headers()
+        self.wfile.write(b"x")
+
+    def do_POST(self):
+        """A git-lfs batch api, /good.git has OID in /objects, /broken.git
+        hands out links to storage that lost it."""
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])).decode())
+        self.server.requests.append(self.path)
+        self.server.batches.append(body)
+        obj = dict(body["objects"][0])
+        if self.path.startswith("/garbage.git/"):
+            reply = b"<html>"
+        else:
+            if obj["oid"] != OID:
+                obj["error"] = {"code": 404, "message": "Object does not exist"}
+            else:
+                store = "/missing" if self.path.startswith("/broken.git/") else ""
+                href = "http://%s:%d%s/objects/%s" % (
+                    self.server.server_address + (store, OID)
+                )
+                obj["actions"] = {"download": {"href": href, "header": {"X-A": "1"}}}
+            reply = json.dumps({"objects": [obj]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", preflight.LFS_JSON)
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def server():
+    s = Server(("127.0.0.1", 0), Handler)
+    s.requests = []
+    s.batches = []
+    threading.Thread(target=s.serve_forever, daemon=True).start()
+    yield s
+    s.shutdown()
+    s.server_close()
+
+
+def url(server, path):
+    return "http://127.0.0.1:%d%s" % (server.server_address[1], path)
+
+
+def closed_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return "http://127.0.0.1:%d/" % port
+
+
+def test_probe(server, tmpdir):
+    cache = str(tmpdir.join("preflight.json"))
+    results = preflight.run(
+        {
+            "grub": url(server, "/grub.template"),
+            "class": url(server, "/missing/grub.template"),
+            "down": closed_port(),
+        },
+        cache,
+    )
+
+    assert results["grub"]["status"] == 206
+    assert preflight.ok(results["grub"])
+    assert results["class"]["status"] == 404
+    assert preflight.missing(results["class"])
+    assert not preflight.ok(results["class"])
+    assert results["down"]["status"] is None
+    assert results["down"]["error"]
+    assert not preflight.answered(results["down"])
+    with open(cache) as f:
+        assert json.load(f) == results
+
+
+def test_lfs(server, tmpdir):
+    batch = "/info/lfs/objects/batch#"
+    results = preflight.run(
+        {
+            "good": url(server, "/good.git" + batch + OID),
+            "gone": url(server, "/good.git" + batch + "0" * 64),
+            "broken": url(server, "/broken.git" + batch + OID),
+            "garbage": url(server, "/garbage.git" + batch + OID),
+        },
+        str(tmpdir.join("preflight.json")),
+    )
+
+    assert preflight.ok(results["good"])
+    assert "/objects/" + OID in server.requests
+    assert server.batches[0]["operation"] == "download"
+    # the lfs api answers, but can not hand out the object
+    assert preflight.missing(results["gone"])
+    assert preflight.missing(results["broken"])
+    assert "/missing/objects/" + OID in server.requests
+    assert not preflight.answered(results["garbage"])
+    assert results["garbage"]["error"] == "bad lfs batch response"
+
+
+def test_concurrent(server, tmpdir):
+    probes = {"p%d" % i: url(server, "/slow/%d" % i) for i in range(4)}
+    start = time.monotonic()
+    preflight.run(probes, str(tmpdir.join("preflight.json")))
+    assert time.monotonic() - start < 1.5
+    assert len(server.requests) == 4
+
+
+def test_cached(server, tmpdir):
+    cache = str(tmpdir.join("preflight.json"))
+    probes = {
+        "tinkerbell": url(server, "/"),
+        "grub": url(server, "/missing"),
+        "mirror": url(server, "/error"),
+        "down": closed_port(),
+    }
+
+    preflight.run(probes, cache)
+    results = preflight.run(probes, cache)
+    assert results["tinkerbell"]["cached"]
+    assert results["grub"]["cached"]
+    # server errors and failures are probed again
+    assert "cached" not in results["mirror"]
+    assert "cached" not in results["down"]
+    assert sorted(server.requests) == ["/", "/error", "/error", "/missing"]
+    del server.requests[:]
+
+    preflight.run(probes, cache, refresh=True)
+    preflight.run(probes, cache, ttl=0)
+    preflight.run({"tinkerbell": url(server, "/other")}, cache)
+    assert len(server.requests) == 7
+
+
+def test_main(server, tmpdir, capsys):
+    cache = str(tmpdir.join("preflight.json"))
+    args = ["--cache", cache]
+    assert (
+        preflight.main(
+            args
+            + [
+                "probe",
+                "mirror=" + url(server, "/info/refs"),
+                "grub=" + url(server, "/missing"),
+            ]
+        )
+        == 0
+    )
+    assert sorted(json.loads(capsys.readouterr().out)) == ["grub", "mirror"]
+    assert preflight.main(args + ["ok", "mirror"]) == 0
+    assert preflight.main(args + ["ok", "grub"]) == 1
+    assert preflight.main(args + ["missing", "grub"]) == 0
+    assert preflight.main(args + ["missing", "mirror"]) == 1
+    assert preflight.main(args + ["ok", "image"]) == 1
+    assert preflight.main(args + ["answered", "grub"]) == 0
+
+    assert preflight.main(args + ["probe", "down=" + closed_port()]) == 1
+    assert preflight.main(args + ["answered", "down"]) == 1
+
+
+def test_main_bad_probe(tmpdir):
+    with pytest.raises(SystemExit):
+        preflight.main(["--cache", str(tmpdir.join("p.json")), "probe", "nourl"])
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+# Turns the boot driver lists recorded by init-x86_64 into module profiles.
+#
+# The initramfs records the drivers hardware it has no profile for needed, and
+# the osie container logs them to syslog as
+#
+#   modprobe-profile <fingerprint> <module> <module>...
+#
+# This reads those lines out of syslog files (or stdin) and writes a profile
+# per fingerprint into installer/alpine/module-profiles, which the build puts
+# into the initramfs. When several boots of one hardware class reported, the
+# profile is the drivers all of them needed, anything else is still loaded by
+# mdev. Existing profiles are left alone unless --update is given.
+#
+#   ./moduleprofiles.py /var/log/remote/*.log
+
+import argparse
+import os
+import re
+import sys
+
+LINE = re.compile(
+    r"\bmodprobe-profile (?P<fingerprint>[0-9a-f]{16})(?P<modules>(?: [\w-]+)*)\s*$"
+)
+DEST = os.path.join(os.path.dirname(os.path.abspath(__file__)), "module-profiles")
+
+
+def merge(profiles, reports):
+    """Keeps only the modules every report of a fingerprint had."""
+    for fingerprint, modules in reports.items():
+        if fingerprint in profiles:
+            profiles[fingerprint] &= modules
+        else:
+            profiles[fingerprint] = set(modules)
+    return profiles
+
+
+def parse(lines):
+    """{fingerprint: set of modules every report of it had}"""
+    profiles = {}
+    for line in lines:
+        m = LINE.search(line)
+        if m:
+            merge(profiles, {m.group("fingerprint"): set(m.group("modules").split())})
+    return profiles
+
+
+def write(profiles, dest, update=False):
+    """Writes the profiles that have modules, returns the fingerprints written."""
+    os.makedirs(dest, exist_ok=True)
+    written = []
+    for fingerprint, modules in sorted(profiles.items()):
+        path = os.path.join(dest, fingerprint)
+        if not modules or (os.path.exists(path) and not update):
+            continue
+        with open(path, "w") as f:
+            f.write("".join(m + "\n" for m in sorted(modules)))
+        written.append(fingerprint)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="collect boot module profiles from syslog"
+    )
+    parser.add_argument("--dest", default=DEST, help="profiles directory")
+    parser.add_argument(
+        "--update", action="store_true", help="rewrite existing profiles"
+    )
+    parser.add_argument("logs", nargs="*", help="syslog files, stdin if none")
+    args = parser.parse_args(argv)
+
+    profiles = {}
+    for log in args.logs or ["-"]:
+        if log == "-":
+            reports = parse(sys.stdin)
+        else:
+            with open(log, errors="replace") as f:
+                reports = parse(f)
+        merge(profiles, reports)
+    for fingerprint in write(profiles, args.dest, args.update):
+        print("moduleprofiles: wrote %s" % os.path.join(args.dest, fingerprint))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
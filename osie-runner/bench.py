@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the runner's hot data paths.
+
+Every hegel push goes through json decoding, cacher_to_metadata, the
+preinstall mismatch checks and a few userdata scans, so these are timed on
+synthetic documents, from a typical machine up to hundreds of network ports and
+multi-MB userdata. For each benchmark the best time per call and the peak
+memory allocated by a single call are recorded. With protobuf installed the
+typed hardware.proto decode is timed next to the JSON one, and the bytes each
+form of the push puts on the wire are recorded too.
+
+    ./bench.py --save bench-results.json
+    ./bench.py --compare bench-baseline.json
+
+--compare exits non-zero if any benchmark got slower or allocates more than the
+baseline allows for. Both sides have to come from the same interpreter and
+packages, CI runs master's bench.py (when master has one) next to the change's
+in one job and only compares the allocations (--time-tolerance 0), the times
+are too noisy there.
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+import urllib.parse as parse
+
+from faker import Factory
+from faker.providers import internet
+
+import handlers
+import util
+
+try:
+    import hardware
+    import hardware_pb2
+    import hegel_pb2
+except ImportError:  # no protobuf, JSON only
+    hardware_pb2 = None
+
+SIZES = {
+    "typical": {"ports": 4, "userdata": 1 << 10},
+    "large": {"ports": 128, "userdata": 256 << 10},
+    "huge": {"ports": 512, "userdata": 4 << 20},
+}
+
+fake = Factory.create()
+fake.add_provider(internet)
+fake.seed_instance(0)
+tinkerbell = parse.urlparse("http://tinkerbell.example.net")
+
+
+class NullLog:
+    def info(self, *args, **kwargs):
+        pass
+
+
+def userdata(size):
+    """A cloud-config script with the osie service and custom image lines at
+    the end, so scanning it has to go through all of it."""
+    lines = ["#cloud-config", "runcmd:"]
+    n = len(lines[0]) + len(lines[1]) + 2
+    while n < size:
+        line = "  - echo %s >> /etc/motd" % fake.sentence()
+        lines.append(line)
+        n += len(line) + 1
+    lines.append("image_repo=https://github.com/packethost/packet-images")
+    lines.append("image_tag=%s" % fake.sha1())
+    lines.append('# services={"osie": "%s"}' % fake.sha1())
+    return "\n".join(lines) + "\n"
+
+
+def hegel_push(ports, userdata_size):
+    """A provisioning push as hegel sends it."""
+    os_version = {"image_tag": fake.sha1(), "os_slug": "ubuntu_18_04"}
+    storage = {
+        "disks": [
+            {
+                "device": "/dev/sd%s" % chr(ord("a") + i),
+                "partitions": [{"label": "ROOT", "number": 1, "size": 0}],
+                "wipeTable": True,
+            }
+            for i in range(4)
+        ]
+    }
+    return {
+        "bonding_mode": 4,
+        "facility_code": "ewr1",
+        "id": fake.uuid4(),
+        "network_ports": [
+            {
+                "data": {"bond": "bond0", "mac": fake.mac_address()},
+                "name": "eth%d" % i,
+                "type": "data" if i % 8 else "ipmi",
+            }
+            for i in range(ports)
+        ],
+        "plan_slug": "c3.medium.x86",
+        "preinstalled_operating_system_version": dict(os_version, storage=storage),
+        "instance": {
+            "crypted_root_password": fake.sha256(),
+            "id": fake.uuid4(),
+            "hostname": fake.user_name(),
+            "ip_addresses": [
+                {
+                    "address": fake.ipv4_public(),
+                    "address_family": 4,
+                    "management": True,
+                    "public": True,
+                }
+                for _ in range(max(1, ports // 4))
+            ],
+            "operating_system_version": dict(os_version, image_tag=fake.sha1()),
+            "storage": storage,
+            "userdata": userdata(userdata_size),
+            "network_ready": True,
+        },
+        "state": "provisioning",
+    }
+
+
+def push(size):
+    return hegel_push(SIZES[size]["ports"], SIZES[size]["userdata"])
+
+
+def benchmarks(size):
+    doc = push(size)
+    raw = json.dumps(doc)
+    instance = doc["instance"]
+    pre = doc["preinstalled_operating_system_version"]
+    log = NullLog()
+    handler = handlers.Handler(None, log, tinkerbell, "/tmp")
+
+    def mismatch_checks():
+        handlers.tag_differs(log, pre, instance)
+        handlers.storage_differs(log, pre, instance)
+        handlers.wants_custom_image(log, pre, instance)
+
+    out = {
+        "json_decode": lambda: json.loads(raw),
+        "cacher_to_metadata": lambda: handlers.cacher_to_metadata(doc, tinkerbell),
+        "sanitize_cacher_data": lambda: util.sanitize_cacher_data(doc),
+        "wants_custom_osie": lambda: handler.wants_custom_osie(instance),
+        "get_custom_image_from_userdata": lambda: handlers.get_custom_image_from_userdata(
+            instance["userdata"]
+        ),
+        "mismatch_checks": mismatch_checks,
+    }
+    if hardware_pb2:
+        wire = hardware.from_dict(doc).SerializeToString()
+        out["typed_decode"] = lambda: hardware.to_dict(
+            hardware_pb2.Hardware.FromString(wire)
+        )
+    return out
+
+
+def wire_bytes(size):
+    """The bytes a push puts on the wire, per form."""
+    doc = push(size)
+    if not hardware_pb2:
+        return {"json": len(json.dumps(doc).encode())}
+    return {
+        "json": hegel_pb2.GetResponse(JSON=json.dumps(doc)).ByteSize(),
+        "typed": hardware.from_dict(doc).ByteSize(),
+    }
+
+
+def measure(fn, min_time=0.2, rounds=5):
+    """Returns the best seconds per call and the peak bytes allocated by a
+    call."""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        took = time.perf_counter() - start
+        if took >= min_time / rounds:
+            break
+        number *= 2
+
+    best = took / number
+    for _ in range(rounds - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": best, "peak_bytes": peak}
+
+
+def run(sizes=SIZES, min_time=0.2):
+    results = {}
+    for size in sizes:
+        for name, fn in benchmarks(size).items():
+            results["%s/%s" % (name, size)] = measure(fn, min_time)
+    return results
+
+
+def compare(results, baseline, time_tolerance=1.5, memory_tolerance=1.2):
+    """Returns a description of each regression against baseline, a tolerance
+    of 0 skips that check."""
+    regressions = []
+    for name, base in sorted(baseline.items()):
+        got = results.get(name)
+        if not got:
+            continue
+        if time_tolerance and got["seconds"] > base["seconds"] * time_tolerance:
+            regressions.append(
+                "%s: %.1fus per call, was %.1fus"
+                % (name, got["seconds"] * 1e6, base["seconds"] * 1e6)
+            )
+        if (
+            memory_tolerance
+            and got["peak_bytes"] > base["peak_bytes"] * memory_tolerance
+        ):
+            regressions.append(
+                "%s: %d bytes peak, was %d"
+                % (name, got["peak_bytes"], base["peak_bytes"])
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="benchmark the runner's hot data paths"
+    )
+    parser.add_argument(
+        "--size", action="append", choices=sorted(SIZES), help="default all"
+    )
+    parser.add_argument(
+        "--min-time", type=float, default=0.2, help="seconds to spend per benchmark"
+    )
+    parser.add_argument("--save", metavar="FILE", help="write the results to FILE")
+    parser.add_argument(
+        "--compare", metavar="FILE", help="fail on regressions against FILE"
+    )
+    parser.add_argument(
+        "--time-tolerance", type=float, default=1.5, help="0 skips the time check"
+    )
+    parser.add_argument(
+        "--memory-tolerance", type=float, default=1.2, help="0 skips the memory check"
+    )
+    args = parser.parse_args(argv)
+
+    sizes = args.size or SIZES
+    results = run(sizes, args.min_time)
+    for name, r in sorted(results.items()):
+        print("%-45s %12.1fus %12d bytes" % (name, r["seconds"] * 1e6, r["peak_bytes"]))
+    wire = {size: wire_bytes(size) for size in sizes}
+    for size, forms in sorted(wire.items()):
+        for form, n in sorted(forms.items()):
+            print("%-45s %27d bytes" % ("wire/%s/%s" % (form, size), n))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(
+                {
+                    "python": sys.version.split()[0],
+                    "results": results,
+                    "wire_bytes": wire,
+                },
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(
+            results, baseline, args.time_tolerance, args.memory_tolerance
+        )
+        for r in regressions:
+            print("regression: " + r, file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,8 +4,16 @@ import json
 import os
 import re
 import subprocess
+import time
 import urllib.parse as parse
 
+import statestore
+import util
+
+# passed on to the osie container when set in bench mode, hermetic runs
+# (ci/bench/e2e.py) point osie at their own disks and servers with these
+PASSTHROUGH_ENV = ("OSIE_DISKS", "BASEURL", "CURL_CA_BUNDLE")
+
 
 class Handler:
     def __init__(
@@ -21,10 +29,16 @@ class Handler:
     def run_osie(
         hardware_id, instance_id, tinkerbell, statedir, command, args=(), env={}
     ):
+        wait_for_image()
         cmd = ("docker", "run", "--rm", "--privileged", "-ti", "-h", hardware_id)
 
         rloghost = os.getenv("RLOGHOST", tinkerbell.hostname)
 
+        env = dict(env)
+        for name in PASSTHROUGH_ENV:
+            if util.bench_env(name):
+                env.setdefault(name, util.bench_env(name))
+
         envs = (f"container_uuid={instance_id}", f"RLOGHOST={rloghost}")
         envs += tuple(itertools.starmap("=".join, zip(env.items())))
         # prepends a '-e' before each env
@@ -38,7 +52,8 @@ class Handler:
         )
         # prepends a '-v' before each volume
         cmd += tuple(itertools.chain(*zip(("-v",) * len(volumes), volumes)))
-        cmd += ("--net", "host", "osie:x86_64", f"/home/packet/{command}")
+        net = util.bench_env("OSIE_DOCKER_NET", "host")
+        cmd += ("--net", net, "osie:x86_64", f"/home/packet/{command}")
         cmd += args
 
         return subprocess.run(cmd)
@@ -267,15 +282,44 @@ def cacher_to_metadata(j, tinkerbell):
     }  # noqa: E122
 
 
+image_loaded = False
+
+
+def wait_for_image(status="/statedir/osie-image", timeout=1800):
+    """Waits for runner.sh to finish loading the osie image, which it does in
+    the background while the runner starts up."""
+    global image_loaded
+    if image_loaded:
+        return
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with open(status) as f:
+                rc = f.read().strip()
+        except FileNotFoundError:
+            # loaded by an older runner.sh, before the runner was started
+            rc = "0"
+
+        if rc == "0":
+            image_loaded = True
+            return
+        if rc != "loading":
+            raise Exception("unable to fetch/load osie image")
+        if time.monotonic() > deadline:
+            raise Exception("timed out waiting for the osie image to load")
+        time.sleep(0.1)
+
+
+store = statestore.StateStore()
+
+
 def write_statefile(name, content, mode=0o644):
-    with open(name, "w") as f:
-        f.write(content)
-        f.flush()
-        os.fchmod(f.fileno(), mode)
+    return store.write(name, content, mode)
 
 
 def remove_statefile(name):
-    os.remove(name)
+    store.remove(name)
 
 
 def get_slug_tag(os):
@@ -291,12 +335,30 @@ def get_slug_tag(os):
     return os_slug + ":" + tag
 
 
+def userdata_value(userdata, key):
+    """Returns what re.search(r".*\\bkey=(\\S+).*", userdata) would match, the
+    value of the last key= on the first line that has one. The regex retries its
+    leading .* from every position of every line, which takes seconds on
+    multi-MB userdata, so lines are only looked at once key= is found."""
+    for m in re.finditer(re.escape(key) + r"=(?=\S)", userdata):
+        i = m.start()
+        if i and re.match(r"\w", userdata[i - 1]):
+            continue
+        start = userdata.rfind("\n", 0, i) + 1
+        end = userdata.find("\n", i)
+        if end == -1:
+            end = len(userdata)
+        line = userdata[start:end]
+        return re.findall(r"(?=\b" + re.escape(key) + r"=(\S+))", line)[-1]
+    return None
+
+
 def get_custom_image_from_userdata(userdata):
     # needs to stay in sync with osie's code
-    repo = re.search(r".*\bimage_repo=(\S+).*", userdata)
-    tag = re.search(r".*\bimage_tag=(\S+).*", userdata)
+    repo = userdata_value(userdata, "image_repo")
+    tag = userdata_value(userdata, "image_tag")
     if repo and tag:
-        return repo.group(1) + "#" + tag.group(1)
+        return repo + "#" + tag
 
 
 def tag_differs(log, pre, instance):
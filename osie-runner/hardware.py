@@ -0,0 +1,136 @@
+"""
+The hardware document as hegel sends it, JSON or typed (hardware.proto).
+
+The handlers work on the dict json.loads makes of the JSON form. to_dict makes
+the same dict of a typed message: singular scalars are always there, messages
+only when set and repeated fields only when not empty, and Scalar values are
+unwrapped to the int or string they stand for. Keys the schema has no field
+for travel in each message's extra_json and are merged back in, so nothing the
+JSON form carries is lost. from_dict goes the other way, for hegel stand-ins.
+
+The typed form is smaller on the wire, but only decodes faster than json.loads
+with protobuf's compiled backend, with the pure python one it is several times
+slower (see bench.py). So unless the hegel_hardware kernel option (or the
+HEGEL_HARDWARE environment variable) says which, the runner prefers it only
+when the compiled backend is there. The osie-runner image ships the pure python
+backend, so it takes JSON unless booted with hegel_hardware=typed.
+"""
+
+import json
+import os
+
+SCALAR = "hegel.Scalar"
+EXTRA = "extra_json"
+# keys the JSON form has even when empty
+ALWAYS = {
+    "hegel.Hardware": ("network_ports",),
+    "hegel.Instance": ("ip_addresses",),
+}
+
+
+def prefer_typed(form=None):
+    form = form or os.getenv("HEGEL_HARDWARE")
+    if form:
+        return form == "typed"
+
+    from google.protobuf.internal import api_implementation
+
+    return api_implementation.Type() != "python"
+
+
+def decode_json(resp):
+    return json.loads(resp.JSON)
+
+
+def to_dict(msg):
+    out = {}
+    for fd in msg.DESCRIPTOR.fields:
+        if fd.name == EXTRA:
+            continue
+        value = getattr(msg, fd.name)
+        if fd.label == fd.LABEL_REPEATED:
+            if not value:
+                continue
+            if _is_map(fd):
+                out[fd.name] = dict(value)
+            elif fd.message_type is not None:
+                out[fd.name] = [_to_value(fd, v) for v in value]
+            else:
+                out[fd.name] = list(value)
+        elif fd.message_type is not None:
+            if msg.HasField(fd.name):
+                out[fd.name] = _to_value(fd, value)
+        else:
+            out[fd.name] = value
+    for name in ALWAYS.get(msg.DESCRIPTOR.full_name, ()):
+        out.setdefault(name, [])
+    extra = getattr(msg, EXTRA, "")
+    if extra:
+        out.update(json.loads(extra))
+    return out
+
+
+def from_dict(doc, msg=None):
+    if msg is None:
+        import hardware_pb2
+
+        msg = hardware_pb2.Hardware()
+
+    fields = msg.DESCRIPTOR.fields_by_name
+    if EXTRA in fields:
+        extra = {k: v for k, v in doc.items() if k not in fields}
+        if extra:
+            setattr(msg, EXTRA, json.dumps(extra, sort_keys=True))
+
+    for fd in msg.DESCRIPTOR.fields:
+        if fd.name == EXTRA:
+            continue
+        value = doc.get(fd.name)
+        if value is None:
+            continue
+        field = getattr(msg, fd.name)
+        if fd.label == fd.LABEL_REPEATED:
+            if _is_map(fd):
+                field.update(value)
+            elif fd.message_type is not None:
+                for v in value:
+                    _from_value(fd, field.add(), v)
+            else:
+                field.extend(value)
+        elif fd.message_type is not None:
+            _from_value(fd, field, value)
+        else:
+            setattr(msg, fd.name, value)
+    return msg
+
+
+def _is_map(fd):
+    return fd.message_type is not None and fd.message_type.GetOptions().map_entry
+
+
+def _to_value(fd, msg):
+    if fd.message_type.full_name == SCALAR:
+        which = msg.WhichOneof("value")
+        return getattr(msg, which) if which else None
+    return to_dict(msg)
+
+
+def _from_value(fd, msg, value):
+    msg.SetInParent()
+    if fd.message_type.full_name != SCALAR:
+        from_dict(value, msg)
+    elif isinstance(value, int):
+        msg.int = value
+    else:
+        msg.str = str(value)
+
+
+class Pushes:
+    """The documents of a hegel Subscribe stream, decoded."""
+
+    def __init__(self, stream, decode):
+        self.stream = stream
+        self.decode = decode
+
+    def next(self):
+        return self.decode(self.stream.next())
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# source: hardware.proto
+"""Generated protocol buffer code."""
+
+from google.protobuf.internal import builder as _builder
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import symbol_database as _symbol_database
+
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(
+    b'\n\x0ehardware.proto\x12\x05hegel"\x11\n\x0fHardwareRequest"&\n\x18HardwareSubscribeRequest\x12\n\n\x02ID\x18\x01 \x01(\t"\x95\x02\n\x08Hardware\x12\n\n\x02id\x18\x01 \x01(\t\x12\r\n\x05state\x18\x02 \x01(\t\x12\x11\n\tplan_slug\x18\x03 \x01(\t\x12\x15\n\rfacility_code\x18\x04 \x01(\t\x12\x14\n\x0c\x62onding_mode\x18\x05 \x01(\x05\x12)\n\rnetwork_ports\x18\x06 \x03(\x0b\x32\x12.hegel.NetworkPort\x12L\n%preinstalled_operating_system_version\x18\x07 \x01(\x0b\x32\x1d.hegel.OperatingSystemVersion\x12!\n\x08instance\x18\x08 \x01(\x0b\x32\x0f.hegel.Instance\x12\x12\n\nextra_json\x18\x0f \x01(\t"\x9b\x01\n\x0bNetworkPort\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x0c\n\x04type\x18\x02 \x01(\t\x12%\n\x04\x64\x61ta\x18\x03 \x01(\x0b\x32\x17.hegel.NetworkPort.Data\x12\x12\n\nextra_json\x18\x0f \x01(\t\x1a\x35\n\x04\x44\x61ta\x12\x0c\n\x04\x62ond\x18\x01 \x01(\t\x12\x0b\n\x03mac\x18\x02 \x01(\t\x12\x12\n\nextra_json\x18\x0f \x01(\t"q\n\x16OperatingSystemVersion\x12\x0f\n\x07os_slug\x18\x01 \x01(\t\x12\x11\n\timage_tag\x18\x02 \x01(\t\x12\x1f\n\x07storage\x18\x03 \x01(\x0b\x32\x0e.hegel.Storage\x12\x12\n\nextra_json\x18\x0f \x01(\t"\xff\x02\n\x08Instance\x12\n\n\x02id\x18\x01 \x01(\t\x12\r\n\x05state\x18\x02 \x01(\t\x12\x10\n\x08hostname\x18\x03 \x01(\t\x12\x1d\n\x15\x63rypted_root_password\x18\x04 \x01(\t\x12\x15\n\rnetwork_ready\x18\x05 \x01(\x08\x12\x10\n\x08userdata\x18\x06 \x01(\t\x12/\n\x08services\x18\x07 \x03(\x0b\x32\x1d.hegel.Instance.ServicesEntry\x12&\n\x0cip_addresses\x18\x08 \x03(\x0b\x32\x10.hegel.IPAddress\x12?\n\x18operating_system_version\x18\t \x01(\x0b\x32\x1d.hegel.OperatingSystemVersion\x12\x1f\n\x07storage\x18\n \x01(\x0b\x32\x0e.hegel.Storage\x12\x12\n\nextra_json\x18\x0f \x01(\t\x1a/\n\rServicesEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\t:\x02\x38\x01"\x9c\x01\n\tIPAddress\x12\x0f\n\x07\x61\x64\x64ress\x18\x01 \x01(\t\x12\x16\n\x0e\x61\x64\x64ress_family\x18\x02 \x01(\x05\x12\x0e\n\x06public\x18\x03 \x01(\x08\x12\x12\n\nmanagement\x18\x04 \x01(\x08\x12\x0c\n\x04\x63idr\x18\x05 \x01(\x05\x12\x0f\n\x07gateway\x18\x06 \x01(\t\x12\x0f\n\x07netmask\x18\x07 \x01(\t\x12\x12\n\nextra_json\x18\x0f \x01(\t"|\n\x07Storage\x12\x1a\n\x05\x64isks\x18\x01 \x03(\x0b\x32\x0b.hegel.Disk\x12\x19\n\x04raid\x18\x02 \x03(\x0b\x32\x0b.hegel.Raid\x12&\n\x0b\x66ilesystems\x18\x03 \x03(\x0b\x32\x11.hegel.Filesystem\x12\x12\n\nextra_json\x18\x0f \x01(\t"c\n\x04\x44isk\x12\x0e\n\x06\x64\x65vice\x18\x01 \x01(\t\x12\x11\n\twipeTable\x18\x02 \x01(\x08\x12$\n\npartitions\x18\x03 \x03(\x0b\x32\x10.hegel.Partition\x12\x12\n\nextra_json\x18\x0f \x01(\t"[\n\tPartition\x12\r\n\x05label\x18\x01 \x01(\t\x12\x0e\n\x06number\x18\x02 \x01(\x05\x12\x1b\n\x04size\x18\x03 \x01(\x0b\x32\r.hegel.Scalar\x12\x12\n\nextra_json\x18\x0f \x01(\t"H\n\x04Raid\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\r\n\x05level\x18\x02 \x01(\t\x12\x0f\n\x07\x64\x65vices\x18\x03 \x03(\t\x12\x12\n\nextra_json\x18\x0f \x01(\t"\x83\x02\n\nFilesystem\x12&\n\x05mount\x18\x01 \x01(\x0b\x32\x17.hegel.Filesystem.Mount\x12\x12\n\nextra_json\x18\x0f \x01(\t\x1a\xb8\x01\n\x05Mount\x12\x0e\n\x06\x64\x65vice\x18\x01 \x01(\t\x12\x0e\n\x06\x66ormat\x18\x02 \x01(\t\x12\r\n\x05point\x18\x03 \x01(\t\x12.\n\x06\x63reate\x18\x04 \x01(\x0b\x32\x1e.hegel.Filesystem.Mount.Create\x12\x12\n\nextra_json\x18\x0f \x01(\t\x1a<\n\x06\x43reate\x12\x1e\n\x07options\x18\x01 \x03(\x0b\x32\r.hegel.Scalar\x12\x12\n\nextra_json\x18\x0f \x01(\t"/\n\x06Scalar\x12\r\n\x03int\x18\x01 \x01(\x03H\x00\x12\r\n\x03str\x18\x02 \x01(\tH\x00\x42\x07\n\x05value2\x80\x01\n\rHardwareHegel\x12.\n\x03Get\x12\x16.hegel.HardwareRequest\x1a\x0f.hegel.Hardware\x12?\n\tSubscribe\x12\x1f.hegel.HardwareSubscribeRequest\x1a\x0f.hegel.Hardware0\x01\x62\x06proto3'
+)
+
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, "hardware_pb2", globals())
+if _descriptor._USE_C_DESCRIPTORS == False:
+
+    DESCRIPTOR._options = None
+    _INSTANCE_SERVICESENTRY._options = None
+    _INSTANCE_SERVICESENTRY._serialized_options = b"8\001"
+    _HARDWAREREQUEST._serialized_start = 25
+    _HARDWAREREQUEST._serialized_end = 42
+    _HARDWARESUBSCRIBEREQUEST._serialized_start = 44
+    _HARDWARESUBSCRIBEREQUEST._serialized_end = 82
+    _HARDWARE._serialized_start = 85
+    _HARDWARE._serialized_end = 362
+    _NETWORKPORT._serialized_start = 365
+    _NETWORKPORT._serialized_end = 520
+    _NETWORKPORT_DATA._serialized_start = 467
+    _NETWORKPORT_DATA._serialized_end = 520
+    _OPERATINGSYSTEMVERSION._serialized_start = 522
+    _OPERATINGSYSTEMVERSION._serialized_end = 635
+    _INSTANCE._serialized_start = 638
+    _INSTANCE._serialized_end = 1021
+    _INSTANCE_SERVICESENTRY._serialized_start = 974
+    _INSTANCE_SERVICESENTRY._serialized_end = 1021
+    _IPADDRESS._serialized_start = 1024
+    _IPADDRESS._serialized_end = 1180
+    _STORAGE._serialized_start = 1182
+    _STORAGE._serialized_end = 1306
+    _DISK._serialized_start = 1308
+    _DISK._serialized_end = 1407
+    _PARTITION._serialized_start = 1409
+    _PARTITION._serialized_end = 1500
+    _RAID._serialized_start = 1502
+    _RAID._serialized_end = 1574
+    _FILESYSTEM._serialized_start = 1577
+    _FILESYSTEM._serialized_end = 1836
+    _FILESYSTEM_MOUNT._serialized_start = 1652
+    _FILESYSTEM_MOUNT._serialized_end = 1836
+    _FILESYSTEM_MOUNT_CREATE._serialized_start = 1776
+    _FILESYSTEM_MOUNT_CREATE._serialized_end = 1836
+    _SCALAR._serialized_start = 1838
+    _SCALAR._serialized_end = 1885
+    _HARDWAREHEGEL._serialized_start = 1888
+    _HARDWAREHEGEL._serialized_end = 2016
+# @@protoc_insertion_point(module_scope)
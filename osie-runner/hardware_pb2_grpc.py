@@ -0,0 +1,64 @@
+# Generated by the gRPC Python protocol compiler plugin. DO NOT EDIT!
+import grpc
+
+import hardware_pb2 as hardware__pb2
+
+
+class HardwareHegelStub(object):
+    # missing associated documentation comment in .proto file
+    pass
+
+    def __init__(self, channel):
+        """Constructor.
+
+        Args:
+          channel: A grpc.Channel.
+        """
+        self.Get = channel.unary_unary(
+            "/hegel.HardwareHegel/Get",
+            request_serializer=hardware__pb2.HardwareRequest.SerializeToString,
+            response_deserializer=hardware__pb2.Hardware.FromString,
+        )
+        self.Subscribe = channel.unary_stream(
+            "/hegel.HardwareHegel/Subscribe",
+            request_serializer=hardware__pb2.HardwareSubscribeRequest.SerializeToString,
+            response_deserializer=hardware__pb2.Hardware.FromString,
+        )
+
+
+class HardwareHegelServicer(object):
+    # missing associated documentation comment in .proto file
+    pass
+
+    def Get(self, request, context):
+        # missing associated documentation comment in .proto file
+        pass
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def Subscribe(self, request, context):
+        # missing associated documentation comment in .proto file
+        pass
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+
+def add_HardwareHegelServicer_to_server(servicer, server):
+    rpc_method_handlers = {
+        "Get": grpc.unary_unary_rpc_method_handler(
+            servicer.Get,
+            request_deserializer=hardware__pb2.HardwareRequest.FromString,
+            response_serializer=hardware__pb2.Hardware.SerializeToString,
+        ),
+        "Subscribe": grpc.unary_stream_rpc_method_handler(
+            servicer.Subscribe,
+            request_deserializer=hardware__pb2.HardwareSubscribeRequest.FromString,
+            response_serializer=hardware__pb2.Hardware.SerializeToString,
+        ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler(
+        "hegel.HardwareHegel", rpc_method_handlers
+    )
+    server.add_generic_rpc_handlers((generic_handler,))
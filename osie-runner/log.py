@@ -1,16 +1,28 @@
+import json
+import logging
 import os
+import sys
 
 import structlog
 
-if os.getenv("LOG_RENDER_JSON"):
-    renderer = structlog.processors.JSONRenderer()
-else:
+import loghandlers
+
+
+def dumps(obj, **kw):
+    return json.dumps(obj, separators=(",", ":"), **kw)
+
+
+# rendering happens in the caller, so it is kept cheap unless asked otherwise.
+# JSON used to need LOG_RENDER_JSON, which still wins over LOG_RENDER_PRETTY.
+if os.getenv("LOG_RENDER_PRETTY") and not os.getenv("LOG_RENDER_JSON"):
     try:
         import colorama  # noqa
 
         renderer = structlog.dev.ConsoleRenderer()
     except ImportError:
         renderer = structlog.dev.ConsoleRenderer(colors=False)
+else:
+    renderer = structlog.processors.JSONRenderer(serializer=dumps)
 
 structlog.configure(
     processors=[
@@ -31,5 +43,9 @@ structlog.configure(
 )
 
 
+def setup(rloghost=None, stream=sys.stdout, level=logging.INFO):
+    return loghandlers.setup(stream, rloghost, level)
+
+
 def logger(logger):
     return structlog.get_logger(logger)
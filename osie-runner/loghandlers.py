@@ -0,0 +1,169 @@
+"""
+Non-blocking log output for the runner.
+
+Log records are handed to a background thread per destination, so a slow
+serial console or an unreachable syslog host never stalls the subscription
+loop. Each destination buffers a bounded number of records and drops the oldest
+ones when it can't keep up.
+"""
+
+import atexit
+import collections
+import logging
+import socket
+import threading
+import time
+
+# syslog facility user
+FACILITY = 1
+SEVERITIES = {
+    logging.CRITICAL: 2,
+    logging.ERROR: 3,
+    logging.WARNING: 4,
+    logging.INFO: 6,
+    logging.DEBUG: 7,
+}
+# what syslog servers accept by default (rsyslog's maxMessageSize), well below
+# the largest UDP datagram
+MAX_DATAGRAM = 8192
+
+
+class AsyncHandler(logging.Handler):
+    """Formats and writes records from a background thread.
+
+    `write` is called with a list of up to `batch` formatted records at a time.
+    At most `capacity` records are buffered, the oldest are dropped first.
+    """
+
+    def __init__(self, write, capacity=10000, batch=100, name="log"):
+        super().__init__()
+        self.write = write
+        self.batch = batch
+        self.records = collections.deque(maxlen=capacity)
+        self.dropped = 0
+        self.busy = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def emit(self, record):
+        with self.cond:
+            if len(self.records) == self.records.maxlen:
+                self.dropped += 1
+            self.records.append(record)
+            self.cond.notify()
+
+    def _take(self):
+        with self.cond:
+            while not self.records:
+                self.busy = False
+                self.cond.notify_all()
+                self.cond.wait()
+            self.busy = True
+            n = min(len(self.records), self.batch)
+            records = [self.records.popleft() for _ in range(n)]
+            dropped, self.dropped = self.dropped, 0
+        return records, dropped
+
+    def _run(self):
+        while True:
+            records, dropped = self._take()
+            lines = []
+            if dropped:
+                lines.append(
+                    (
+                        logging.WARNING,
+                        "log output fell behind, dropped %d messages" % dropped,
+                    )
+                )
+            for record in records:
+                try:
+                    lines.append((record.levelno, self.format(record)))
+                except Exception:
+                    self.handleError(record)
+            try:
+                self.write(lines)
+            except Exception:
+                # nowhere to report this, the next batch may fare better
+                pass
+
+    def flush(self, timeout=5):
+        """Waits up to timeout seconds for the buffered records to be written."""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while self.records or self.busy:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self.cond.wait(left)
+        return True
+
+
+def stream_writer(stream):
+    def write(lines):
+        stream.write("".join(line + "\n" for _, line in lines))
+        stream.flush()
+
+    return write
+
+
+def split_utf8(data, size):
+    """data in pieces of at most size bytes, without cutting a utf-8 character
+    in two."""
+    pieces = []
+    while len(data) > size:
+        cut = size
+        while cut > 0 and data[cut] & 0xC0 == 0x80:
+            cut -= 1
+        cut = cut or size
+        pieces.append(data[:cut])
+        data = data[cut:]
+    pieces.append(data)
+    return pieces
+
+
+def syslog_writer(host, port=514, ident="osie-runner", max_bytes=MAX_DATAGRAM):
+    """Sends each line as a syslog datagram, lines that can't be sent right
+    away are dropped. Lines that don't fit in max_bytes are split over several
+    datagrams."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    address = []
+
+    def write(lines):
+        if not address:
+            # resolved on first use, from the log thread
+            address.append(
+                socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_DGRAM)[0][4]
+            )
+        for level, line in lines:
+            pri = FACILITY * 8 + SEVERITIES.get(level, 6)
+            header = ("<%d>%s: " % (pri, ident)).encode()
+            body = line.encode(errors="replace")
+            for piece in split_utf8(body, max(max_bytes - len(header), 4)):
+                try:
+                    sock.sendto(header + piece, address[0])
+                except OSError:
+                    # full socket buffer, EMSGSIZE, no route: drop this line
+                    # and carry on with the next one
+                    break
+
+    return write
+
+
+def setup(stream, rloghost=None, level=logging.INFO):
+    """Replaces the root logger's handlers with async console (and syslog if
+    rloghost is set) handlers."""
+    root = logging.getLogger()
+    for h in root.handlers[:]:
+        root.removeHandler(h)
+    root.setLevel(level)
+
+    handlers = [AsyncHandler(stream_writer(stream), name="log-console")]
+    if rloghost:
+        handlers.append(AsyncHandler(syslog_writer(rloghost), name="log-syslog"))
+    for h in handlers:
+        h.setFormatter(logging.Formatter("%(message)s"))
+        root.addHandler(h)
+        atexit.register(h.flush)
+    return handlers
@@ -0,0 +1,125 @@
+"""
+Opt-in profiling of the runner.
+
+Enabled with the osie_profile kernel option, either `osie_profile=cpu`,
+`osie_profile=mem` or both (`osie_profile=cpu,mem`, `osie_profile=1`). Every
+profiled section writes a cProfile dump (cpu) and the allocation growth since
+the previous section as reported by tracemalloc (mem) to timestamped files in
+the output directory, the oldest files are removed to stay under a size cap.
+"""
+
+import contextlib
+import cProfile
+import os
+import pstats
+import time
+import tracemalloc
+
+MODES = {"cpu", "mem"}
+
+
+def modes_from_kopt(value):
+    if not value:
+        return set()
+    if value.lower() in ("1", "true", "all"):
+        return set(MODES)
+    return set(value.split(",")) & MODES
+
+
+class Profiler:
+    def __init__(self, directory, modes=(), cap=64 << 20, top=10):
+        self.directory = directory
+        self.modes = set(modes)
+        self.cap = cap
+        self.top = top
+        self.count = 0
+        self.functions = []
+        self.allocations = []
+        self.snapshot = None
+        if "mem" in self.modes:
+            tracemalloc.start()
+            self.snapshot = tracemalloc.take_snapshot()
+
+    @property
+    def enabled(self):
+        return bool(self.modes)
+
+    @contextlib.contextmanager
+    def profile(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        prof = None
+        if "cpu" in self.modes:
+            prof = cProfile.Profile()
+            prof.enable()
+        try:
+            yield
+        finally:
+            if prof:
+                prof.disable()
+            self._save(name, prof)
+
+    def _save(self, name, prof):
+        os.makedirs(self.directory, exist_ok=True)
+        self.count += 1
+        base = "%s-%04d-%s" % (time.strftime("%Y%m%dT%H%M%S"), self.count, name)
+        base = os.path.join(self.directory, base)
+
+        if prof:
+            prof.dump_stats(base + ".prof")
+            stats = pstats.Stats(prof)
+            self.functions = [
+                {
+                    "function": "%s:%d(%s)" % func,
+                    "calls": nc,
+                    "cumulative": round(ct, 6),
+                }
+                for func, (_, nc, _, ct, _) in sorted(
+                    stats.stats.items(), key=lambda s: -s[1][3]
+                )[: self.top]
+            ]
+
+        if self.snapshot:
+            snapshot = tracemalloc.take_snapshot()
+            diff = snapshot.compare_to(self.snapshot, "lineno")
+            self.snapshot = snapshot
+            with open(base + ".mem.txt", "w") as f:
+                for stat in diff[:100]:
+                    f.write(str(stat) + "\n")
+            self.allocations = [
+                {
+                    "location": str(stat.traceback),
+                    "size": stat.size,
+                    "size_diff": stat.size_diff,
+                }
+                for stat in diff[: self.top]
+            ]
+
+        self._trim()
+
+    def _trim(self):
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            st = os.stat(path)
+            files.append((st.st_mtime, st.st_size, path))
+        files.sort()
+        total = sum(f[1] for f in files)
+        while files and total > self.cap:
+            _, size, path = files.pop(0)
+            os.remove(path)
+            total -= size
+
+    def summary(self):
+        """The hottest functions and top allocators of the last profiled
+        section, empty if profiling is disabled."""
+        if not self.enabled:
+            return {}
+        return {"functions": self.functions, "allocations": self.allocations}
+
+    def stop(self):
+        if self.snapshot:
+            tracemalloc.stop()
+            self.snapshot = None
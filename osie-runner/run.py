@@ -1,9 +1,9 @@
 #!/usr/bin/env python3
 
-import copy
+# first, so the imports below are timed (see startup.py)
+import startup
+
 import itertools
-import json
-import logging
 import os
 import sys
 import time
@@ -17,11 +17,14 @@ import hegel_pb2 as hegel
 import hegel_pb2_grpc
 import log
 import handlers
+import hardware
+import profiling
 
 import util
 
-logging.basicConfig(format="%(message)s", stream=sys.stdout, level=logging.INFO)
+log.setup(rloghost=os.getenv("RLOGHOST"))
 log = log.logger("runner")
+startup.mark("logging")
 
 
 def phone_homer(url):
@@ -36,12 +39,19 @@ def phone_homer(url):
 
 def failer():
     def func(reason):
-        return phone_home({"type": "failure", "reason": reason})
+        body = {"type": "failure", "reason": reason}
+        summary = profiler.summary()
+        if summary:
+            body["profile"] = summary
+        return phone_home(body)
 
     return func
 
 
 def get_hegel_authority(facility):
+    if util.bench_env("HEGEL_AUTHORITY"):
+        return util.bench_env("HEGEL_AUTHORITY")
+
     try:
         srv = srvlookup.lookup("grpc", domain=f"hegel.{facility}.packet.net")[0]
         return f"{srv.hostname}:{srv.port}"
@@ -54,7 +64,16 @@ def get_hegel_authority(facility):
 
 
 def connect_hegel(facility):
-    creds = grpc.ssl_channel_credentials()
+    if util.bench_env("HEGEL_INSECURE"):
+        # a local hegel stand-in, see ci/bench/e2e.py
+        def make_channel(authority, options):
+            return grpc.insecure_channel(authority, options=options)
+
+    else:
+        creds = grpc.ssl_channel_credentials()
+
+        def make_channel(authority, options):
+            return grpc.secure_channel(authority, creds, options=options)
 
     iterations = 0
     for backoff in itertools.chain((0, 1, 2, 5, 10), itertools.repeat(10)):
@@ -62,9 +81,8 @@ def connect_hegel(facility):
         authority = get_hegel_authority(facility)
         log.info("connecting to", authority=authority)
         # Timeouts: https://cs.mcgill.ca/~mxia3/2019/02/23/Using-gRPC-in-Production/
-        channel = grpc.secure_channel(
+        channel = make_channel(
             authority,
-            creds,
             options=[
                 ("grpc.keepalive_time_ms", 10000),
                 ("grpc.keepalive_timeout_ms", 5000),
@@ -74,34 +92,53 @@ def connect_hegel(facility):
                 ("grpc.http2.min_ping_interval_without_data_ms", 5000),
             ],
         )
-        stub = hegel_pb2_grpc.HegelStub(channel)
-
         try:
             if backoff > 0:
                 log.info("failed to connect, sleeping for %s seconds" % backoff)
                 time.sleep(backoff)
                 log.info("attempting to reconnect to hegel", attempt=iterations)
 
-            resp = stub.Get(hegel.GetRequest())
-            watch = stub.Subscribe(hegel.SubscribeRequest())
-            return watch, resp
+            return subscribe(channel)
         except grpc.RpcError:
             pass
 
 
-def sanitize_cacher_data(j):
-    j = copy.deepcopy(j)
-    try:
-        j["instance"]["userdata"] = "~~ OMITTED ~~"
-    except Exception as e:
-        pass
-    return j
-
+def subscribe(channel):
+    """Gets the hardware document and subscribes to its updates, as typed
+    messages if preferred and hegel serves hardware.proto and as JSON
+    otherwise. Returns the pushes and the document, decoded the same either
+    way."""
+    if hardware.prefer_typed(hegel_hardware):
+        import hardware_pb2
+        import hardware_pb2_grpc
 
-with open("/proc/cmdline", "r") as cmdline:
+        stub = hardware_pb2_grpc.HardwareHegelStub(channel)
+        try:
+            j = hardware.to_dict(stub.Get(hardware_pb2.HardwareRequest()))
+        except grpc.RpcError as e:
+            if e.code() != grpc.StatusCode.UNIMPLEMENTED:
+                raise
+            log.info("hegel does not serve typed hardware, using json")
+        else:
+            watch = stub.Subscribe(hardware_pb2.HardwareSubscribeRequest())
+            return hardware.Pushes(watch, hardware.to_dict), j
+
+    stub = hegel_pb2_grpc.HegelStub(channel)
+    resp = stub.Get(hegel.GetRequest())
+    watch = stub.Subscribe(hegel.SubscribeRequest())
+    return hardware.Pushes(watch, hardware.decode_json), hardware.decode_json(resp)
+
+
+with open(util.bench_env("KERNEL_CMDLINE_FILE", "/proc/cmdline"), "r") as cmdline:
     cmdline_content = cmdline.read()
     tinkerbell = parse.urlparse(util.value_from_kopt(cmdline_content, "tinkerbell"))
     facility = util.value_from_kopt(cmdline_content, "facility")
+    hegel_hardware = util.value_from_kopt(cmdline_content, "hegel_hardware")
+    profile_modes = profiling.modes_from_kopt(
+        util.value_from_kopt(cmdline_content, "osie_profile")
+    )
+
+profiler = profiling.Profiler("/statedir/profiles", profile_modes)
 
 phone_home = phone_homer(parse.urljoin(tinkerbell.geturl(), "phone-home"))
 fail = failer()
@@ -110,27 +147,34 @@ statedir = os.getenv("STATEDIR_HOST")
 if not statedir:
     fail("STATEDIR_HOST env var is missing, unable to proceed")
 
-watch, resp = connect_hegel(facility)
+watch, j = connect_hegel(facility)
+startup.mark("hegel")
+try:
+    startup.report("/statedir/startup.json")
+except OSError:
+    log.exception("unable to write startup report")
+startup.uninstall()
 
 # TODO decide to keep or remove? means we'd ignore a failed deprov
 log.info("wiping disk partitions")
 handlers = handlers.Handler(phone_home, log, tinkerbell, statedir)
-handlers.wipe(json.loads(resp.JSON))
+with profiler.profile("wipe"):
+    handlers.wipe(j)
 
 log.info("running subscribe loop")
 while True:
-    j = json.loads(resp.JSON)
     # note: do not try to ignore pushes with out state changes, network
     # sometimes comes in after state:provisioning for example
     state = j["state"]
     i = j.get("instance", {"state": ""})
     log.info("context updated", state=state, instance_state=i.get("state", ""))
-    print(json.dumps(sanitize_cacher_data(j), indent=2))
+    log.info("hardware data", data=util.sanitize_cacher_data(j))
 
     handler = handlers.handler(state)
     if handler:
         try:
-            exit = handler(j)
+            with profiler.profile("handle_" + state):
+                exit = handler(j)
             if exit:
                 break
         except Exception as e:
@@ -142,12 +186,13 @@ while True:
 
     log.info("about to monitor")
     try:
-        resp = watch.next()
+        with profiler.profile("subscribe"):
+            j = watch.next()
     except grpc.RpcError as e:
         log.info("hegel went away, attempting to reconnect")
         while True:
             try:
-                watch, resp = connect_hegel(facility)
+                watch, j = connect_hegel(facility)
                 break
             except Exception as e:
                 log.error("could not connect to hegel, sleeping a bit")
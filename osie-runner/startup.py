@@ -0,0 +1,108 @@
+"""
+Records how long the runner takes to start up.
+
+The runner starts from a ramdisk with a cold page cache, so the time spent
+importing modules matters. Importing this module wraps the import statement
+(builtins.__import__) to time every module it loads, the same breakdown
+`python -X importtime` prints, so run.py imports it first. Module specs and
+loaders are left alone, and importlib.import_module calls are not timed.
+uninstall() removes the wrapper. mark() records when each startup phase is
+reached, and report() writes both to the statedir as json.
+"""
+
+import builtins
+import importlib.util
+import json
+import os
+import sys
+import time
+
+start = time.monotonic()
+phases = []
+imports = {}
+_stack = []
+_import = builtins.__import__
+
+
+def process_age():
+    """Seconds since the process was started, includes interpreter startup."""
+    try:
+        with open("/proc/self/stat") as f:
+            started = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return uptime - started / os.sysconf("SC_CLK_TCK")
+
+
+def _absolute(name, globals, level):
+    if not level:
+        return name
+    package = (globals or {}).get("__package__") or ""
+    return importlib.util.resolve_name("." * level + name, package).rstrip(".")
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    try:
+        absolute = _absolute(name, globals, level)
+    except (ImportError, ValueError):
+        # the import itself raises the right error
+        return _import(name, globals, locals, fromlist, level)
+    # "from pkg import mod" loads pkg.mod, other names in fromlist never show
+    # up in sys.modules and are ignored
+    wanted = [absolute] + [absolute + "." + f for f in fromlist or () if f != "*"]
+    new = [m for m in wanted if m not in sys.modules]
+    if not new:
+        return _import(name, globals, locals, fromlist, level)
+
+    _stack.append(0.0)
+    begin = time.monotonic()
+    try:
+        return _import(name, globals, locals, fromlist, level)
+    finally:
+        cumulative = time.monotonic() - begin
+        children = _stack.pop()
+        if _stack:
+            _stack[-1] += cumulative
+        loaded = [m for m in new if m in sys.modules]
+        if loaded:
+            imports[", ".join(loaded)] = {
+                "self_us": int((cumulative - children) * 1e6),
+                "cumulative_us": int(cumulative * 1e6),
+            }
+
+
+def install():
+    builtins.__import__ = _timed_import
+
+
+def uninstall():
+    if builtins.__import__ is _timed_import:
+        builtins.__import__ = _import
+
+
+def mark(phase):
+    phases.append((phase, time.monotonic() - start))
+
+
+def report(path, top=30):
+    """Writes the phases and the slowest imports to path, and returns the
+    report."""
+    slowest = sorted(imports.items(), key=lambda i: -i[1]["cumulative_us"])
+    doc = {
+        "process_age_at_start": process_age_at_start,
+        "phases": [{"phase": p, "seconds": round(s, 6)} for p, s in phases],
+        "imports": len(imports),
+        "import_seconds": round(sum(i["self_us"] for i in imports.values()) / 1e6, 6),
+        "slowest_imports": [dict(module=n, **t) for n, t in slowest[:top]],
+    }
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(doc, f, indent=2)
+    os.rename(tmp, path)
+    return doc
+
+
+process_age_at_start = process_age()
+install()
@@ -0,0 +1,86 @@
+"""
+The files the runner keeps in the statedir for osie.
+
+Every push rewrote metadata and userdata in place, even when nothing changed,
+and osie could read them half written. A StateStore writes each file to a
+temporary one next to it and renames it over the old one, so readers see either
+the old or the new content, and skips the write altogether if the content and
+mode are the ones it last wrote and the file was not touched since (checked
+with a stat, osie rewrites some of these files itself).
+
+Every write or removal that did happen bumps the counter in the directory's
+generation file, so a reader can tell whether anything changed since it last
+looked by comparing one number instead of reading and parsing every file again.
+"""
+
+import hashlib
+import os
+import tempfile
+
+GENERATION = "generation"
+
+
+class StateStore:
+    def __init__(self):
+        # path -> (sha256, mode, stat) of what was last written there
+        self.index = {}
+        # directory -> generation
+        self.generations = {}
+
+    def write(self, name, content, mode=0o644):
+        """Writes content to name unless it is already there, returns whether
+        it wrote."""
+        data = content.encode() if isinstance(content, str) else content
+        digest = hashlib.sha256(data).digest()
+        known = self.index.get(name)
+        if known and known[:2] == (digest, mode) and known[2] == _stat(name):
+            return False
+
+        self._replace(name, data, mode)
+        self.index[name] = (digest, mode, _stat(name))
+        self.bump(os.path.dirname(name))
+        return True
+
+    def remove(self, name):
+        os.remove(name)
+        self.index.pop(name, None)
+        self.bump(os.path.dirname(name))
+
+    def generation(self, directory):
+        gen = self.generations.get(directory)
+        if gen is None:
+            try:
+                with open(os.path.join(directory, GENERATION)) as f:
+                    gen = int(f.read().strip() or 0)
+            except (OSError, ValueError):
+                gen = 0
+            self.generations[directory] = gen
+        return gen
+
+    def bump(self, directory):
+        gen = self.generation(directory) + 1
+        self._replace(os.path.join(directory, GENERATION), b"%d\n" % gen, 0o644)
+        self.generations[directory] = gen
+        return gen
+
+    @staticmethod
+    def _replace(name, data, mode):
+        directory, base = os.path.split(name)
+        fd, tmp = tempfile.mkstemp(dir=directory or ".", prefix="." + base + ".")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fchmod(f.fileno(), mode)
+            os.rename(tmp, name)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+def _stat(name):
+    try:
+        st = os.stat(name)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns, st.st_mode)
@@ -0,0 +1,56 @@
+import bench
+
+
+def test_run_typical():
+    results = bench.run(["typical"], min_time=0.001)
+    assert sorted(results) == sorted(
+        n + "/typical" for n in bench.benchmarks("typical")
+    )
+    for r in results.values():
+        assert r["seconds"] > 0
+        assert r["peak_bytes"] >= 0
+
+
+def test_hegel_push_sizes():
+    doc = bench.hegel_push(ports=300, userdata_size=1 << 20)
+    assert len(doc["network_ports"]) == 300
+    assert len(doc["instance"]["userdata"]) >= 1 << 20
+
+
+def test_compare():
+    baseline = {
+        "a/typical": {"seconds": 1.0, "peak_bytes": 100},
+        "b/typical": {"seconds": 1.0, "peak_bytes": 100},
+        "gone/typical": {"seconds": 1.0, "peak_bytes": 100},
+    }
+    results = {
+        "a/typical": {"seconds": 1.4, "peak_bytes": 110},
+        "b/typical": {"seconds": 2.0, "peak_bytes": 200},
+    }
+    assert bench.compare(results, baseline) == [
+        "b/typical: 2000000.0us per call, was 1000000.0us",
+        "b/typical: 200 bytes peak, was 100",
+    ]
+    assert bench.compare(results, baseline, time_tolerance=0) == [
+        "b/typical: 200 bytes peak, was 100",
+    ]
+
+
+def test_save_and_compare(tmpdir):
+    path = str(tmpdir.join("results.json"))
+    args = ["--size", "typical", "--min-time", "0.001"]
+    assert bench.main(args + ["--save", path]) == 0
+    assert (
+        bench.main(
+            args
+            + [
+                "--compare",
+                path,
+                "--time-tolerance",
+                "1000",
+                "--memory-tolerance",
+                "1000",
+            ]
+        )
+        == 0
+    )
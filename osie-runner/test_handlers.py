@@ -543,3 +543,87 @@ def test_wants_custom_osie(handler, instance, want):
 )
 def test_wants_custom_image(pre, instance, want):
     assert handlers.wants_custom_image(logging.getLogger(), pre, instance) == want
+
+
+def test_wait_for_image(tmpdir, monkeypatch):
+    status = tmpdir.join("osie-image")
+    monkeypatch.setattr(handlers, "image_loaded", False)
+
+    status.write("1\n")
+    with pytest.raises(Exception, match="unable to fetch/load osie image"):
+        handlers.wait_for_image(str(status))
+
+    status.write("loading\n")
+    with pytest.raises(Exception, match="timed out"):
+        handlers.wait_for_image(str(status), timeout=0.2)
+    assert not handlers.image_loaded
+
+    status.write("0\n")
+    handlers.wait_for_image(str(status))
+    assert handlers.image_loaded
+
+    # only waited for once
+    status.write("1\n")
+    handlers.wait_for_image(str(status))
+
+
+def test_wait_for_image_missing_status(tmpdir, monkeypatch):
+    monkeypatch.setattr(handlers, "image_loaded", False)
+    handlers.wait_for_image(str(tmpdir.join("osie-image")))
+    assert handlers.image_loaded
+
+
+@pytest.mark.parametrize(
+    "userdata",
+    [
+        "",
+        "image_repo=a",
+        "image_repo= a\nimage_repo=b",
+        "ximage_repo=a\n image_repo=b c image_repo=d\nimage_repo=e",
+        "-image_repo=a-image_repo=b",
+        "\u00e9image_repo=a image_repo=image_tag=b",
+        "#cloud-config\n" + "  - echo hello >> /etc/motd\n" * 1000 + "image_repo=z\n",
+    ],
+)
+def test_userdata_value(userdata):
+    want = re.search(r".*\bimage_repo=(\S+).*", userdata)
+    want = want and want.group(1)
+    assert handlers.userdata_value(userdata, "image_repo") == want
+
+
+def test_run_osie_command(monkeypatch):
+    monkeypatch.setattr(handlers, "image_loaded", True)
+    run = MagicMock()
+    monkeypatch.setattr(subprocess, "run", run)
+    for name in handlers.PASSTHROUGH_ENV + ("OSIE_DOCKER_NET", "RLOGHOST"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.delenv("OSIE_BENCH", raising=False)
+
+    handlers.Handler.run_osie(
+        "hw", "inst", tinkerbell, "/state", "osie.sh", ("-M", "m"), {"A": "1"}
+    )
+    cmd = run.call_args[0][0]
+    assert cmd[-6:] == (
+        "--net",
+        "host",
+        "osie:x86_64",
+        "/home/packet/osie.sh",
+        "-M",
+        "m",
+    )
+    assert "A=1" in cmd
+    assert not any(c.startswith("OSIE_DISKS=") for c in cmd)
+
+    monkeypatch.setenv("OSIE_DISKS", "/dev/loop0 /dev/loop1")
+    monkeypatch.setenv("OSIE_DOCKER_NET", "osie-bench")
+    handlers.Handler.run_osie("hw", "inst", tinkerbell, "/state", "wipe.sh")
+    cmd = run.call_args[0][0]
+    # the overrides are ignored outside bench mode
+    assert not any(c.startswith("OSIE_DISKS=") for c in cmd)
+    assert cmd[-4:] == ("--net", "host", "osie:x86_64", "/home/packet/wipe.sh")
+
+    monkeypatch.setenv("OSIE_BENCH", "1")
+    handlers.Handler.run_osie("hw", "inst", tinkerbell, "/state", "wipe.sh")
+    cmd = run.call_args[0][0]
+    assert "OSIE_DISKS=/dev/loop0 /dev/loop1" in cmd
+    assert cmd[-4:] == ("--net", "osie-bench", "osie:x86_64", "/home/packet/wipe.sh")
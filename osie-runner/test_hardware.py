@@ -0,0 +1,123 @@
+import glob
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import bench
+import hardware
+
+cpr = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ci", "cpr")
+
+
+def typed():
+    """The generated module, the tests using it are skipped without
+    protobuf."""
+    pytest.importorskip("google.protobuf")
+    import hardware_pb2
+
+    return hardware_pb2
+
+
+def assert_covers(want, got):
+    """got has everything want has, any other keys of got are zero values."""
+    if isinstance(want, dict):
+        for k, v in got.items():
+            if k in want:
+                assert_covers(want[k], v)
+            else:
+                assert not v, k
+        assert set(want) <= set(got)
+    elif isinstance(want, list):
+        assert len(want) == len(got)
+        for a, b in zip(want, got):
+            assert_covers(a, b)
+    else:
+        assert want == got
+
+
+def roundtrip(doc):
+    hardware_pb2 = typed()
+    wire = hardware.from_dict(doc).SerializeToString()
+    return hardware.to_dict(hardware_pb2.Hardware.FromString(wire))
+
+
+def test_roundtrip_push():
+    doc = bench.hegel_push(ports=16, userdata_size=1 << 10)
+    assert_covers(doc, roundtrip(doc))
+
+
+@pytest.mark.parametrize("path", sorted(glob.glob(os.path.join(cpr, "*.cpr.json"))))
+def test_roundtrip_storage(path):
+    with open(path) as f:
+        storage = json.load(f)
+    got = roundtrip({"instance": {"storage": storage}})
+    assert_covers(storage, got["instance"]["storage"])
+
+
+def test_scalar():
+    doc = {
+        "instance": {
+            "storage": {
+                "disks": [{"partitions": [{"size": 4096}, {"size": "100%"}]}],
+                "filesystems": [{"mount": {"create": {"options": ["-L", 8]}}}],
+            }
+        }
+    }
+    storage = roundtrip(doc)["instance"]["storage"]
+    assert [p["size"] for p in storage["disks"][0]["partitions"]] == [4096, "100%"]
+    assert storage["filesystems"][0]["mount"]["create"]["options"] == ["-L", 8]
+
+
+def test_empty():
+    hardware_pb2 = typed()
+    j = hardware.to_dict(hardware_pb2.Hardware())
+    assert j["network_ports"] == []
+    assert j["state"] == ""
+    assert "instance" not in j
+
+    j = roundtrip({"instance": {}})
+    assert j["instance"]["ip_addresses"] == []
+    assert "services" not in j["instance"]
+    assert "storage" not in j["instance"]
+
+
+def test_unknown_keys_kept():
+    os_version = {
+        "os_slug": "virtuozzo_7",
+        "license_activation": {"key": "vz-license"},
+        "null": None,
+    }
+    doc = {
+        "state": "provisioning",
+        "not_in_schema": {"a": [1, "b"]},
+        "instance": {"operating_system_version": os_version},
+    }
+    j = roundtrip(doc)
+    assert j["not_in_schema"] == {"a": [1, "b"]}
+    os_version = j["instance"]["operating_system_version"]
+    assert os_version["license_activation"]["key"] == "vz-license"
+    assert os_version["null"] is None
+    assert "extra_json" not in os_version
+
+
+@pytest.mark.parametrize("form,want", [("typed", True), ("json", False)])
+def test_prefer_typed_env(monkeypatch, form, want):
+    monkeypatch.setenv("HEGEL_HARDWARE", form)
+    assert hardware.prefer_typed() is want
+
+
+@pytest.mark.parametrize("form,want", [("typed", True), ("json", False)])
+def test_prefer_typed_kopt(monkeypatch, form, want):
+    # the kernel option wins over the environment
+    monkeypatch.setenv("HEGEL_HARDWARE", "json" if want else "typed")
+    assert hardware.prefer_typed(form) is want
+
+
+def test_pushes():
+    stream = iter([SimpleNamespace(JSON='{"state": "provisioning"}')])
+    pushes = hardware.Pushes(
+        SimpleNamespace(next=lambda: next(stream)), hardware.decode_json
+    )
+    assert pushes.next() == {"state": "provisioning"}
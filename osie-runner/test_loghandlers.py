@@ -0,0 +1,155 @@
+import errno
+import io
+import logging
+import socket
+import threading
+
+import loghandlers
+
+
+def record(msg, level=logging.INFO):
+    return logging.makeLogRecord({"msg": msg, "levelno": level})
+
+
+def test_async_handler_batches():
+    batches = []
+    h = loghandlers.AsyncHandler(batches.append, batch=2)
+    for i in range(5):
+        h.handle(record("msg %d" % i))
+    assert h.flush()
+
+    lines = [line for batch in batches for _, line in batch]
+    assert lines == ["msg %d" % i for i in range(5)]
+    assert all(len(b) <= 2 for b in batches)
+
+
+def test_async_handler_drops_oldest():
+    release = threading.Event()
+    written = []
+
+    def write(lines):
+        release.wait()
+        written.extend(lines)
+
+    h = loghandlers.AsyncHandler(write, capacity=3, batch=10)
+    h.handle(record("first"))
+    # wait for the first record to be picked up and block the writer
+    while h.records:
+        pass
+    for i in range(10):
+        # must not block while the writer is stuck
+        h.handle(record("msg %d" % i))
+    release.set()
+    assert h.flush()
+
+    lines = [line for _, line in written]
+    assert lines == [
+        "first",
+        "log output fell behind, dropped 7 messages",
+        "msg 7",
+        "msg 8",
+        "msg 9",
+    ]
+
+
+def test_async_handler_survives_write_errors():
+    calls = []
+
+    def write(lines):
+        calls.append(lines)
+        if len(calls) == 1:
+            raise IOError("console went away")
+
+    h = loghandlers.AsyncHandler(write)
+    h.handle(record("lost"))
+    assert h.flush()
+    h.handle(record("kept"))
+    assert h.flush()
+    assert calls[-1] == [(logging.INFO, "kept")]
+
+
+def test_stream_writer():
+    out = io.StringIO()
+    loghandlers.stream_writer(out)([(logging.INFO, "a"), (logging.ERROR, "b")])
+    assert out.getvalue() == "a\nb\n"
+
+
+def test_syslog_writer():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+    server.settimeout(5)
+    port = server.getsockname()[1]
+
+    write = loghandlers.syslog_writer("127.0.0.1", port)
+    write([(logging.INFO, '{"event":"hi"}'), (logging.ERROR, "oops")])
+
+    assert server.recv(1024) == b'<14>osie-runner: {"event":"hi"}'
+    assert server.recv(1024) == b"<11>osie-runner: oops"
+    server.close()
+
+
+def test_syslog_writer_splits_long_lines():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+    server.settimeout(5)
+    port = server.getsockname()[1]
+
+    write = loghandlers.syslog_writer("127.0.0.1", port, max_bytes=64)
+    line = "é" * 100
+    write([(logging.INFO, line), (logging.INFO, "next")])
+
+    got = []
+    while True:
+        msg = server.recv(1024)
+        assert len(msg) <= 64
+        assert msg.startswith(b"<14>osie-runner: ")
+        if msg.endswith(b"next"):
+            break
+        got.append(msg[len(b"<14>osie-runner: ") :].decode())
+    assert "".join(got) == line
+    server.close()
+
+
+def test_syslog_writer_survives_send_errors(monkeypatch):
+    sent = []
+
+    class Sock:
+        def __init__(self, *args):
+            pass
+
+        def setblocking(self, flag):
+            pass
+
+        def sendto(self, data, address):
+            if b"big" in data:
+                raise OSError(errno.EMSGSIZE, "Message too long")
+            if b"unreachable" in data:
+                raise OSError(errno.ENETUNREACH, "Network is unreachable")
+            sent.append(data)
+
+    monkeypatch.setattr(socket, "socket", Sock)
+    write = loghandlers.syslog_writer("127.0.0.1", 514)
+    write(
+        [
+            (logging.INFO, "big"),
+            (logging.INFO, "unreachable"),
+            (logging.INFO, "fine"),
+        ]
+    )
+    assert sent == [b"<14>osie-runner: fine"]
+
+
+def test_setup(monkeypatch):
+    root = logging.getLogger()
+    monkeypatch.setattr(root, "handlers", [])
+    monkeypatch.setattr(root, "level", root.level)
+    out = io.StringIO()
+
+    handlers = loghandlers.setup(out, rloghost="127.0.0.1")
+    assert len(handlers) == 2
+
+    logging.getLogger("test").info("hello")
+    assert handlers[0].flush()
+    assert out.getvalue() == "hello\n"
+    for h in handlers:
+        root.removeHandler(h)
@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+import profiling
+
+
+@pytest.mark.parametrize(
+    "value,modes",
+    [
+        [None, set()],
+        ["", set()],
+        ["1", {"cpu", "mem"}],
+        ["all", {"cpu", "mem"}],
+        ["cpu", {"cpu"}],
+        ["mem,bogus", {"mem"}],
+    ],
+)
+def test_modes_from_kopt(value, modes):
+    assert profiling.modes_from_kopt(value) == modes
+
+
+def busy():
+    return [list(range(100)) for _ in range(1000)]
+
+
+def test_disabled(tmpdir):
+    p = profiling.Profiler(str(tmpdir.join("profiles")))
+    with p.profile("handle_provisioning"):
+        busy()
+    assert not tmpdir.join("profiles").exists()
+    assert p.summary() == {}
+
+
+def test_profile(tmpdir):
+    directory = str(tmpdir.join("profiles"))
+    p = profiling.Profiler(directory, {"cpu", "mem"})
+    try:
+        kept = []
+        with pytest.raises(ValueError):
+            with p.profile("handle_provisioning"):
+                kept.append(busy())
+                raise ValueError()
+    finally:
+        p.stop()
+
+    files = sorted(os.listdir(directory))
+    assert len(files) == 2
+    assert files[0].endswith("-0001-handle_provisioning.mem.txt")
+    assert files[1].endswith("-0001-handle_provisioning.prof")
+
+    summary = p.summary()
+    assert any("busy" in f["function"] for f in summary["functions"])
+    assert any("test_profiling.py" in a["location"] for a in summary["allocations"])
+
+
+def test_size_cap(tmpdir):
+    directory = str(tmpdir.join("profiles"))
+    p = profiling.Profiler(directory, {"cpu"})
+    with p.profile("one"):
+        busy()
+    (first,) = os.listdir(directory)
+    p.cap = os.path.getsize(os.path.join(directory, first))
+
+    with p.profile("two"):
+        busy()
+    assert first not in os.listdir(directory)
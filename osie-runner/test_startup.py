@@ -0,0 +1,80 @@
+import builtins
+import importlib.machinery
+import json
+import sys
+
+import startup
+
+
+def test_import_timings(tmpdir, monkeypatch):
+    tmpdir.join("startup_outer.py").write(
+        "import startup_inner\nfrom startup_pkg import sub\n"
+    )
+    tmpdir.join("startup_inner.py").write("import time\ntime.sleep(0.05)\n")
+    tmpdir.mkdir("startup_pkg").join("__init__.py").write("")
+    tmpdir.join("startup_pkg", "sub.py").write("from . import sibling\n")
+    tmpdir.join("startup_pkg", "sibling.py").write("")
+    monkeypatch.syspath_prepend(str(tmpdir))
+
+    startup.install()
+    try:
+        import startup_outer  # noqa: F401
+    finally:
+        startup.uninstall()
+        for name in list(sys.modules):
+            if name.startswith("startup_"):
+                del sys.modules[name]
+
+    outer = startup.imports["startup_outer"]
+    inner = startup.imports["startup_inner"]
+    assert inner["self_us"] >= 50000
+    assert outer["cumulative_us"] >= inner["cumulative_us"]
+    assert outer["self_us"] < inner["self_us"]
+    assert "startup_pkg, startup_pkg.sub" in startup.imports
+    assert "startup_pkg.sibling" in startup.imports
+    assert builtins.__import__ is startup._import
+
+
+def test_loaders_untouched(tmpdir, monkeypatch):
+    tmpdir.join("startup_plain.py").write("")
+    monkeypatch.syspath_prepend(str(tmpdir))
+
+    startup.install()
+    try:
+        import startup_plain
+    finally:
+        startup.uninstall()
+        sys.modules.pop("startup_plain", None)
+
+    assert type(startup_plain.__spec__.loader) is importlib.machinery.SourceFileLoader
+    assert startup_plain.__loader__ is startup_plain.__spec__.loader
+
+
+def test_report(tmpdir, monkeypatch):
+    monkeypatch.setattr(startup, "phases", [])
+    monkeypatch.setattr(
+        startup,
+        "imports",
+        {
+            "fast": {"self_us": 10, "cumulative_us": 10},
+            "slow": {"self_us": 500, "cumulative_us": 900},
+        },
+    )
+    startup.mark("hegel")
+
+    path = str(tmpdir.join("startup.json"))
+    doc = startup.report(path, top=1)
+    with open(path) as f:
+        assert json.load(f) == doc
+
+    assert doc["phases"][0]["phase"] == "hegel"
+    assert doc["imports"] == 2
+    assert doc["import_seconds"] == 0.00051
+    assert doc["slowest_imports"] == [
+        {"module": "slow", "self_us": 500, "cumulative_us": 900}
+    ]
+
+
+def test_process_age():
+    age = startup.process_age()
+    assert age is None or age >= 0
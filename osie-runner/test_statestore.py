@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+import statestore
+
+
+def files(tmpdir):
+    return sorted(os.listdir(str(tmpdir)))
+
+
+def generation(tmpdir):
+    with open(str(tmpdir.join("generation"))) as f:
+        return int(f.read())
+
+
+def test_write(tmpdir):
+    store = statestore.StateStore()
+    name = str(tmpdir.join("metadata"))
+
+    assert store.write(name, '{"state": "provisioning"}')
+    with open(name) as f:
+        assert f.read() == '{"state": "provisioning"}'
+    assert os.stat(name).st_mode & 0o777 == 0o644
+    assert generation(tmpdir) == 1
+    assert files(tmpdir) == ["generation", "metadata"]
+
+
+def test_unchanged_write_skipped(tmpdir):
+    store = statestore.StateStore()
+    name = str(tmpdir.join("userdata"))
+
+    assert store.write(name, "#!/bin/sh\n")
+    ino = os.stat(name).st_ino
+    assert not store.write(name, "#!/bin/sh\n")
+    assert os.stat(name).st_ino == ino
+    assert generation(tmpdir) == 1
+
+    assert store.write(name, "#!/bin/sh\n", 0o700)
+    assert os.stat(name).st_mode & 0o777 == 0o700
+    assert store.write(name, "#!/bin/bash\n", 0o700)
+    assert generation(tmpdir) == 3
+
+
+def test_touched_file_rewritten(tmpdir):
+    store = statestore.StateStore()
+    name = str(tmpdir.join("cleanup.sh"))
+
+    store.write(name, "reboot\n", 0o700)
+    # osie writes cleanup.sh itself
+    with open(name, "w") as f:
+        f.write("kexec\n")
+    assert store.write(name, "reboot\n", 0o700)
+    with open(name) as f:
+        assert f.read() == "reboot\n"
+
+    os.remove(name)
+    assert store.write(name, "reboot\n", 0o700)
+    assert os.path.exists(name)
+
+
+def test_remove(tmpdir):
+    store = statestore.StateStore()
+    name = str(tmpdir.join("disks-partioned-image-extracted"))
+
+    store.write(name, "")
+    store.remove(name)
+    assert not os.path.exists(name)
+    assert generation(tmpdir) == 2
+    assert store.write(name, "")
+
+
+def test_generation_survives_restart(tmpdir):
+    statestore.StateStore().write(str(tmpdir.join("metadata")), "{}")
+    store = statestore.StateStore()
+    assert store.generation(str(tmpdir)) == 1
+    store.write(str(tmpdir.join("metadata")), "{}")
+    assert generation(tmpdir) == 2
+
+
+def test_failed_write_keeps_old_file(tmpdir, monkeypatch):
+    store = statestore.StateStore()
+    name = str(tmpdir.join("metadata"))
+    store.write(name, "old")
+
+    def rename(src, dst):
+        raise OSError("no space left on device")
+
+    monkeypatch.setattr(os, "rename", rename)
+    with pytest.raises(OSError):
+        store.write(name, "new")
+    monkeypatch.undo()
+
+    with open(name) as f:
+        assert f.read() == "old"
+    assert files(tmpdir) == ["generation", "metadata"]
+    assert store.write(name, "new")
@@ -16,3 +16,42 @@ import util
 def test_value_from_kopt(cmdline, key, value):
     got = util.value_from_kopt(cmdline, key)
     assert value == got
+
+
+def test_sanitize_cacher_data():
+    j = {"id": "x", "instance": {"userdata": "secret"}}
+    got = util.sanitize_cacher_data(j)
+    assert got == {"id": "x", "instance": {"userdata": "~~ OMITTED ~~"}}
+    assert j["instance"]["userdata"] == "secret"
+    assert util.sanitize_cacher_data({"id": "x"}) == {"id": "x"}
+
+
+def test_sanitize_cacher_data_credentials():
+    j = {
+        "instance": {
+            "crypted_root_password": "$6$salt$hash",
+            "operating_system_version": {
+                "slug": "virtuozzo_7",
+                "license_activation": {"state": "unlicensed", "key": "VZ-KEY"},
+            },
+            "ip_addresses": [{"address": "10.0.0.2", "password": "pw"}],
+        }
+    }
+    got = util.sanitize_cacher_data(j)
+    assert "$6$salt$hash" not in str(got)
+    assert "VZ-KEY" not in str(got)
+    assert "pw" not in str(got)
+    assert got["instance"]["operating_system_version"]["slug"] == "virtuozzo_7"
+    assert got["instance"]["ip_addresses"][0]["address"] == "10.0.0.2"
+    assert j["instance"]["crypted_root_password"] == "$6$salt$hash"
+
+
+def test_bench_env(monkeypatch):
+    monkeypatch.delenv("OSIE_BENCH", raising=False)
+    monkeypatch.setenv("HEGEL_AUTHORITY", "10.0.0.1:50060")
+    assert util.bench_env("HEGEL_AUTHORITY") is None
+    assert util.bench_env("KERNEL_CMDLINE_FILE", "/proc/cmdline") == "/proc/cmdline"
+
+    monkeypatch.setenv("OSIE_BENCH", "1")
+    assert util.bench_env("HEGEL_AUTHORITY") == "10.0.0.1:50060"
+    assert util.bench_env("KERNEL_CMDLINE_FILE", "/proc/cmdline") == "/proc/cmdline"
@@ -1,3 +1,4 @@
+import os
 import re
 
 
@@ -8,3 +9,32 @@ def value_from_kopt(cmdline, key):
         return match.group(1)
 
     return None
+
+
+# never logged, wherever they are in the hardware document: the logs go to the
+# console and to RLOGHOST
+OMITTED_KEYS = frozenset(
+    ("userdata", "crypted_root_password", "license_activation", "password")
+)
+
+
+def sanitize_cacher_data(j):
+    """A copy of the hardware document without userdata and credentials."""
+    if isinstance(j, dict):
+        return {
+            k: "~~ OMITTED ~~" if k in OMITTED_KEYS else sanitize_cacher_data(v)
+            for k, v in j.items()
+        }
+    if isinstance(j, list):
+        return [sanitize_cacher_data(v) for v in j]
+    return j
+
+
+def bench_env(name, default=None):
+    """
+    The value of a hermetic benchmark override (ci/bench/e2e.py), only honored
+    when OSIE_BENCH=1 so a stray variable can't redirect a real machine.
+    """
+    if os.getenv("OSIE_BENCH") != "1":
+        return default
+    return os.getenv(name, default)
@@ -1,149 +1,42 @@
 from __future__ import print_function
 
 import copy
-import re
 
 
 def _perform_action(device, disk=None, pretend=False):
-    actions = ["-o"]
-    infos = ["-p"]
-    if disk:
-        guid = disk.get("guid", None)
-        if guid is not None:
-            actions.append("-U%s" % guid)
-
-        autoinc = 1
-        for num, p in sorted(disk["partitions"].items()):
-            num = p.get("number", 0)
-            start = p.get("start", 0)
-            end = p.get("end", 0)
-            cmdlet = ["-n{num}:{start}:{end}"]
-
-            guid = p.get("guid", None)
-            if guid:
-                cmdlet.append("-u{num}:{guid}")
-
-            type = p.get("type", None)
-            if type:
-                cmdlet.append("-t{num}:{type}")
-
-            name = p.get("name", None)
-            if name:
-                cmdlet.append("-c{num}:{name}")
-
-            cmdlet = " ".join(cmdlet)
-            cmdlet = cmdlet.format(
-                num=num, start=start, end=end, guid=guid, type=type, name=device
-            )
-            actions.append(cmdlet)
-
-            if num == 0:
-                num = autoinc
-                autoinc += 1
-
-            infos.append("-i%d" % num)
-
-        actions = " ".join(actions)
-        infos = " ".join(infos)
-
-    cmd = "sgdisk -P {actions} {infos} {name}".format(
-        actions=actions, infos=infos, name=device
-    )
-    out = __salt__["cmd.run"](cmd)
-    info = _parse_disk_info(out)
-
-    if info is None:
-        return info
-
-    if disk is None and len(info["partitions"]) > 0:
-        info = _get_disk_info(name, info["partitions"].keys())
-
-    return info
-
-
-def _get_disk_info(disk, partitions=None):
-    parts = ""
-    if partitions:
-        parts = " ".join(["-i%d" % p for p in partitions])
-
-    cmd = "sgdisk -P -p %s %s" % (parts, disk)
-    out = __salt__["cmd.run"](cmd)
-    info = _parse_disk_info(out)
-
-    if info is None:
-        return info
-
-    if partitions is None and len(info["partitions"]) > 0:
-        info = _get_disk_info(disk, info["partitions"].keys())
-
-    return info
-
-
-disk_guid_re = re.compile("^Disk identifier \(GUID\): (\S*)", re.M)
-partition_basic_re = "^\s+(?P<number>\d+)\s+(?P<start>\d+)\s+(?P<end>\d+)"
-partition_basic_re = re.compile(partition_basic_re, re.M)
-partition_flags_re = re.compile("Attribute flags: (\d+)")
-partition_type_re = re.compile("Partition GUID code: (\S*)")
-partition_guid_re = re.compile("Partition unique GUID: (\S*)")
-partition_name_re = re.compile("Partition name: '(\w*)'", re.U)
-
-
-def _parse_disk_info(out):
-    disk_guid = disk_guid_re.findall(out)
-    if not disk_guid:
+    if disk is None:
+        return _get_disk_info(device)
+
+    # same as `sgdisk -o -U... -n... -t... -c...`, a fresh table with disk's partitions
+    table = __utils__["gpt.new"](device, disk.get("guid", None))
+    for _, p in sorted(disk["partitions"].items()):
+        table.add(
+            number=p.get("number", 0),
+            start=p.get("start", 0),
+            end=p.get("end", 0),
+            type=p.get("type", None),
+            guid=p.get("guid", None),
+            name=p.get("name", None) or "",
+        )
+
+    if not pretend:
+        table.write(device)
+
+    return table.info()
+
+
+def _get_disk_info(disk):
+    table = __utils__["gpt.read"](disk)
+    if table is None:
         return None
 
-    assert len(disk_guid) == 1
-    disk = {"guid": disk_guid[0], "partitions": {}}
-
-    basics = partition_basic_re.findall(out)
-    if not basics:
-        return disk
-
-    regexes = (
-        partition_type_re,
-        partition_guid_re,
-        partition_flags_re,
-        partition_name_re,
-    )
-    types, guids, flags, names = [regex.findall(out) for regex in regexes]
-
-    assert len(types) == len(guids) == len(flags) == len(names), (
-        "mismatched lengths: types=%d guids=%d flags=%d names=%d"
-        % (len(types), len(guids), len(flags), len(names))
-    )
-
-    if len(basics) != len(types):
-        assert len(basics) > len(
-            types
-        ), "basic info must be >= detailed info: %d, %d" % (len(basics), len(types))
-
-        n = len(basics) - len(types)
-        for info in (types, guids, flags, names):
-            info += [""] * n
-
-    partitions = {}
-    for info in zip(basics, types, guids, flags, names):
-        part = {
-            "number": int(info[0][0]),
-            "start": info[0][1],
-            "end": info[0][2],
-            "type": info[1],
-            "guid": info[2],
-            "flags": info[3],
-            "name": info[4],
-        }
-        partitions[part["number"]] = part
-
-    disk["partitions"] = partitions
-    return disk
+    return table.info()
 
 
 def absent(name):
     ret = {"name": name, "changes": {}, "result": False, "comment": "", "pchanges": {}}
 
-    print("info:", __salt__["partition.list"](name)["info"])
-    _label = __salt__["partition.list"](name)["info"]["partition table"]
+    _label = __utils__["gpt.label"](name)
 
     if _label == "unknown":
         ret["result"] = True
@@ -158,7 +51,7 @@ def absent(name):
 def labeled(name):
     ret = {"name": name, "changes": {}, "result": False, "comment": "", "pchanges": {}}
 
-    label = __salt__["partition.list"](name)["info"]["partition table"]
+    label = __utils__["gpt.label"](name)
 
     if label == "gpt":
         ret["result"] = True
@@ -212,7 +105,7 @@ def _merge_disks(new, old):
 
         # lets delete all falsy values so that when we do
         # oldpart.update(part) the falsy values don't override what oldpart had
-        for key, value in part.items():
+        for key, value in list(part.items()):
             if not value:
                 part.pop(key)
 
@@ -231,7 +124,8 @@ def partioned(name, guid=None, partitions=None):
     arg = _render_disk(guid, partitions)
     arg = _merge_disks(arg, current)
 
-    new = _perform_action(name, arg)
+    # like sgdisk -P, only work out what the disk would look like
+    new = _perform_action(name, arg, pretend=True)
 
     if new != current:
         ret["result"] = None
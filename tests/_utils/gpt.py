@@ -0,0 +1,391 @@
+"""
+GUID partition table reader/writer.
+
+Reads and writes the primary and backup GPT headers and partition entry arrays
+of a disk (or disk image) directly, instead of going through sgdisk. Partitions
+are described the way the block states expect them, as `sgdisk -i` prints them.
+"""
+
+import errno
+import fcntl
+import mmap
+import os
+import struct
+import uuid
+import zlib
+
+SIGNATURE = b"EFI PART"
+REVISION = 0x00010000
+HEADER = struct.Struct("<8sIIIIQQQQ16sQIII")
+ENTRY = struct.Struct("<16s16sQQQ72s")
+NUM_ENTRIES = 128
+ALIGNMENT = 2048
+
+BLKSSZGET = 0x1268
+BLKRRPART = 0x125F
+
+# sgdisk type codes
+TYPE_CODES = {
+    "0700": "EBD0A0A2-B9E5-4433-87C0-68B6B72699C7",
+    "8200": "0657FD6D-A4AB-43C4-84E5-0933C84B4F4F",
+    "8300": "0FC63DAF-8483-4772-8E79-3D69D8477DE4",
+    "8E00": "E6D6D379-F507-44C2-A23C-238F2A3DF928",
+    "EF00": "C12A7328-F81F-11D2-BA4B-00A0C93EC93B",
+    "EF02": "21686148-6449-6E6F-744E-656564454649",
+    "FD00": "A19D880F-05FC-4D3B-A006-743F0F84911E",
+}
+DEFAULT_TYPE = TYPE_CODES["8300"]
+
+SUFFIXES = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40, "P": 1 << 50}
+
+
+class GPTError(Exception):
+    pass
+
+
+def _crc(data):
+    return zlib.crc32(data) & 0xFFFFFFFF
+
+
+def _guid(raw):
+    return str(uuid.UUID(bytes_le=raw)).upper()
+
+
+def _raw_guid(guid):
+    return uuid.UUID(guid).bytes_le
+
+
+def type_guid(code):
+    """Accepts a GUID or an sgdisk hex code (8300, ef02, ...)."""
+    if not code:
+        return DEFAULT_TYPE
+    code = str(code).upper()
+    if code in TYPE_CODES:
+        return TYPE_CODES[code]
+    try:
+        return str(uuid.UUID(code)).upper()
+    except ValueError:
+        raise GPTError("unknown partition type: %s" % code)
+
+
+class Partition(object):
+    def __init__(
+        self, number, start, end, type=DEFAULT_TYPE, guid=None, flags=0, name=""
+    ):
+        self.number = number
+        self.start = start
+        self.end = end
+        self.type = type
+        self.guid = guid or str(uuid.uuid4()).upper()
+        self.flags = flags
+        self.name = name
+
+    def info(self):
+        return {
+            "number": self.number,
+            "start": str(self.start),
+            "end": str(self.end),
+            "type": self.type,
+            "guid": self.guid,
+            "flags": "%016X" % self.flags,
+            "name": self.name,
+        }
+
+
+class Table(object):
+    def __init__(self, sectors, sector_size=512, guid=None, partitions=None):
+        self.sectors = sectors
+        self.sector_size = sector_size
+        self.guid = guid or str(uuid.uuid4()).upper()
+        self.partitions = partitions or {}
+
+        self.entry_sectors = NUM_ENTRIES * ENTRY.size // sector_size
+        self.first_usable = 2 + self.entry_sectors
+        self.last_usable = sectors - 2 - self.entry_sectors
+        if self.last_usable < self.first_usable:
+            raise GPTError("disk is too small for a GPT: %d sectors" % sectors)
+
+    def info(self):
+        """The table as the block states describe disks."""
+        return {
+            "guid": self.guid,
+            "partitions": dict((n, p.info()) for n, p in self.partitions.items()),
+        }
+
+    def _free(self):
+        """Free blocks as (first, last) sector tuples."""
+        free = []
+        start = self.first_usable
+        for p in sorted(self.partitions.values(), key=lambda p: p.start):
+            if p.start > start:
+                free.append((start, p.start - 1))
+            start = max(start, p.end + 1)
+        if start <= self.last_usable:
+            free.append((start, self.last_usable))
+        return free
+
+    def _sectors(self, value):
+        value = str(value)
+        n = value.lstrip("+-")
+        mult = 1
+        if n and n[-1].upper() in SUFFIXES:
+            mult = SUFFIXES[n[-1].upper()] // self.sector_size
+            n = n[:-1]
+        try:
+            return int(n) * mult
+        except ValueError:
+            raise GPTError("bad sector value: %s" % value)
+
+    def add(self, number=0, start=0, end=0, type=None, guid=None, name=""):
+        """Adds a partition like `sgdisk -n number:start:end` does.
+
+        0 picks the defaults, the first free number, the start of the largest
+        free block and the end of that block. start and end can be relative,
+        +size for start/end after the start of the block/partition and -size for
+        end before the end of the block.
+        """
+        if not number:
+            number = 1
+            while number in self.partitions:
+                number += 1
+        if number in self.partitions or not 0 < number <= NUM_ENTRIES:
+            raise GPTError("partition number %d is not available" % number)
+
+        free = self._free()
+        if not free:
+            raise GPTError("no free space left for partition %d" % number)
+        block = max(free, key=lambda b: b[1] - b[0])
+
+        start = str(start)
+        if start in ("", "0"):
+            first = block[0]
+        elif start.startswith("+"):
+            first = block[0] + self._sectors(start)
+        else:
+            first = self._sectors(start)
+            block = [b for b in free if b[0] <= first <= b[1]] or [(first, first - 1)]
+            block = block[0]
+        first = (first + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        first = max(first, block[0])
+
+        end = str(end)
+        if end in ("", "0"):
+            last = block[1]
+        elif end.startswith("+"):
+            last = first + self._sectors(end) - 1
+        elif end.startswith("-"):
+            last = block[1] - self._sectors(end)
+        else:
+            last = self._sectors(end)
+
+        if not block[0] <= first <= last <= block[1]:
+            raise GPTError(
+                "partition %d (%d-%d) does not fit free space %d-%d"
+                % (number, first, last, block[0], block[1])
+            )
+
+        p = Partition(
+            number, first, last, type_guid(type), guid and str(guid).upper(), 0, name
+        )
+        self.partitions[number] = p
+        return p
+
+    def _entries(self):
+        entries = bytearray(NUM_ENTRIES * ENTRY.size)
+        for n, p in self.partitions.items():
+            name = p.name.encode("utf-16-le")[:72]
+            ENTRY.pack_into(
+                entries,
+                (n - 1) * ENTRY.size,
+                _raw_guid(p.type),
+                _raw_guid(p.guid),
+                p.start,
+                p.end,
+                p.flags,
+                name,
+            )
+        return bytes(entries)
+
+    def _header(self, current, backup, entries_lba, entries_crc):
+        fields = [
+            SIGNATURE,
+            REVISION,
+            HEADER.size,
+            0,
+            0,
+            current,
+            backup,
+            self.first_usable,
+            self.last_usable,
+            _raw_guid(self.guid),
+            entries_lba,
+            NUM_ENTRIES,
+            ENTRY.size,
+            entries_crc,
+        ]
+        fields[3] = _crc(HEADER.pack(*fields))
+        header = HEADER.pack(*fields)
+        return header + b"\0" * (self.sector_size - len(header))
+
+    def _protective_mbr(self):
+        mbr = bytearray(self.sector_size)
+        size = min(self.sectors - 1, 0xFFFFFFFF)
+        struct.pack_into(
+            "<B3sB3sII", mbr, 446, 0, b"\x00\x02\x00", 0xEE, b"\xff\xff\xff", 1, size
+        )
+        mbr[510:512] = b"\x55\xaa"
+        return bytes(mbr)
+
+    def pack(self):
+        """Returns the (primary, backup) areas, to be written at sector 0 and
+        at sector `self.last_usable + 1` respectively."""
+        entries = self._entries()
+        crc = _crc(entries)
+        last = self.sectors - 1
+        backup_entries = last - self.entry_sectors
+
+        primary = self._protective_mbr() + self._header(1, last, 2, crc) + entries
+        backup = entries + self._header(last, 1, backup_entries, crc)
+        return primary, backup
+
+    def write(self, path):
+        primary, backup = self.pack()
+        fd = os.open(path, os.O_WRONLY)
+        try:
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.write(fd, primary)
+            os.lseek(fd, (self.last_usable + 1) * self.sector_size, os.SEEK_SET)
+            os.write(fd, backup)
+            os.fsync(fd)
+            try:
+                fcntl.ioctl(fd, BLKRRPART)
+            except (IOError, OSError) as e:
+                # not a block device, or the disk is in use
+                if e.errno not in (errno.ENOTTY, errno.EINVAL, errno.EBUSY):
+                    raise
+        finally:
+            os.close(fd)
+
+
+def sector_size(fd):
+    try:
+        buf = fcntl.ioctl(fd, BLKSSZGET, b"\0\0\0\0")
+        return struct.unpack("<I", buf)[0]
+    except (IOError, OSError):
+        # a regular file
+        return 512
+
+
+def _map(fd, offset, length):
+    # mmap offsets must be page aligned
+    skew = offset % mmap.ALLOCATIONGRANULARITY
+    m = mmap.mmap(
+        fd, length + skew, mmap.MAP_SHARED, mmap.PROT_READ, offset=offset - skew
+    )
+    try:
+        return m[skew : skew + length]
+    finally:
+        m.close()
+
+
+def _parse(area, lba, sectors, ssize, entries_area=None):
+    """Parses the header in `area` (the header sector, followed by the entries
+    for a primary header) and returns a Table, or None if it is not valid."""
+    fields = list(HEADER.unpack_from(area, 0))
+    (
+        sig,
+        rev,
+        hsize,
+        hcrc,
+        _,
+        current,
+        _,
+        first,
+        last,
+        guid,
+        entries_lba,
+        n,
+        esize,
+        ecrc,
+    ) = fields
+    if sig != SIGNATURE or hsize < HEADER.size or current != lba:
+        return None
+    fields[3] = 0
+    if _crc(HEADER.pack(*fields) + bytes(area[HEADER.size : hsize])) != hcrc:
+        return None
+    if esize != ENTRY.size or n > NUM_ENTRIES:
+        return None
+
+    entries = entries_area
+    if entries is None:
+        entries = area[ssize : ssize + n * esize]
+    entries = bytes(entries[: n * esize])
+    if len(entries) != n * esize or _crc(entries) != ecrc:
+        return None
+
+    table = Table(sectors, ssize, _guid(guid))
+    table.first_usable, table.last_usable = first, last
+    for i in range(n):
+        ptype, pguid, start, end, flags, name = ENTRY.unpack_from(entries, i * esize)
+        if ptype == b"\0" * 16:
+            continue
+        name = name.decode("utf-16-le").split("\0", 1)[0]
+        table.partitions[i + 1] = Partition(
+            i + 1, start, end, _guid(ptype), _guid(pguid), flags, name
+        )
+    return table
+
+
+def read(path):
+    """Returns the partition table of `path`, or None if it has no valid GPT.
+
+    The primary header and entries are read with a single mapping of the start
+    of the disk, the backup is only looked at if the primary is corrupt.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        ssize = sector_size(fd)
+        size = os.lseek(fd, 0, os.SEEK_END)
+        sectors = size // ssize
+        entry_sectors = NUM_ENTRIES * ENTRY.size // ssize
+        if sectors < 3 + 2 * entry_sectors:
+            return None
+
+        area = _map(fd, 0, (2 + entry_sectors) * ssize)
+        table = _parse(area[ssize:], 1, sectors, ssize)
+        if table is not None:
+            return table
+
+        last = sectors - 1
+        area = _map(fd, (last - entry_sectors) * ssize, (entry_sectors + 1) * ssize)
+        return _parse(area[-ssize:], last, sectors, ssize, area[:-ssize])
+    finally:
+        os.close(fd)
+
+
+def label(path):
+    """Returns "gpt", "msdos" or "unknown", like parted's partition table type."""
+    if read(path) is not None:
+        return "gpt"
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        mbr = os.read(fd, 512)
+    finally:
+        os.close(fd)
+    if len(mbr) == 512 and mbr[510:512] == b"\x55\xaa":
+        # a protective mbr without a valid gpt is not a msdos label
+        if bytearray(mbr)[450] != 0xEE:
+            return "msdos"
+    return "unknown"
+
+
+def new(path, guid=None):
+    """Returns an empty table sized for `path`, like `sgdisk -o` would create."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        ssize = sector_size(fd)
+        size = os.lseek(fd, 0, os.SEEK_END)
+    finally:
+        os.close(fd)
+    return Table(size // ssize, ssize, guid and str(guid).upper())
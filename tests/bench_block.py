@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the block states on generated disk layouts.
+
+Each machine shape is a set of sparse disk images with GPTs written by the gpt
+module, from a couple of disks with a few partitions up to dense JBODs and full
+128 entry tables. For every shape this times reading the tables
+(_get_disk_info), a whole `partioned` state run over all the disks and the
+merge/render of the requested layout, and counts the commands the states run
+through __salt__["cmd.run"], which should stay at zero.
+
+    ./bench_block.py --save bench-block.json
+    ./bench_block.py --compare bench-block.json
+
+CI compares the command counts against bench-block-baseline.json, the times
+are only comparable on one machine.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+for d in ("_utils", "_states"):
+    sys.path.insert(0, os.path.join(here, d))
+
+import block  # noqa: E402
+import gpt  # noqa: E402
+
+GB = 1 << 30
+
+# disks, partitions per disk, disk size
+SHAPES = {
+    "typical": (2, 3, 480 * GB),
+    "jbod": (24, 4, 8000 * GB),
+    "full-gpt": (4, 128, 2000 * GB),
+}
+
+
+class CountingCmd(object):
+    """Stands in for __salt__["cmd.run"], remembering what it was asked to run."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, cmd, *args, **kwargs):
+        self.calls.append(cmd)
+        return ""
+
+
+def setup_salt():
+    cmd = CountingCmd()
+    block.__salt__ = {"cmd.run": cmd}
+    block.__utils__ = {"gpt.new": gpt.new, "gpt.read": gpt.read, "gpt.label": gpt.label}
+    block.__opts__ = {"test": True}
+    return cmd
+
+
+def make_disk(path, partitions, size):
+    """Writes a GPT with `partitions` equal partitions to a sparse image and
+    returns the partitions as a state would request them."""
+    with open(path, "wb") as f:
+        f.truncate(size)
+    table = gpt.new(path)
+    # partitions start on the first aligned sector
+    each = (table.last_usable + 1 - gpt.ALIGNMENT) // partitions
+    each -= each % gpt.ALIGNMENT
+    for n in range(1, partitions + 1):
+        table.add(n, 0, "+%d" % each, type="8300", name="DATA%d" % n)
+    table.write(path)
+    return [
+        {
+            "number": p.number,
+            "start": str(p.start),
+            "end": str(p.end),
+            "type": "8300",
+            "name": p.name,
+        }
+        for p in sorted(table.partitions.values(), key=lambda p: p.number)
+    ]
+
+
+def make_machine(directory, shape):
+    disks, partitions, size = SHAPES[shape]
+    machine = {}
+    for i in range(disks):
+        path = os.path.join(directory, "%s-%02d.img" % (shape, i))
+        machine[path] = make_disk(path, partitions, size)
+    return machine
+
+
+def best(fn, rounds=5, min_time=0.1):
+    """The best seconds per call of fn."""
+    number = 1
+    while True:
+        start = time.time()
+        for _ in range(number):
+            fn()
+        took = time.time() - start
+        if took >= min_time / rounds:
+            break
+        number *= 2
+
+    result = took / number
+    for _ in range(rounds - 1):
+        start = time.time()
+        for _ in range(number):
+            fn()
+        result = min(result, (time.time() - start) / number)
+    return result
+
+
+def bench_shape(directory, shape, min_time=0.1):
+    machine = make_machine(directory, shape)
+    cmd = setup_salt()
+
+    def read():
+        for path in machine:
+            block._get_disk_info(path)
+
+    def render():
+        for path, parts in machine.items():
+            block._merge_disks(
+                block._render_disk(None, parts), block._get_disk_info(path)
+            )
+
+    changed = []
+
+    def state():
+        del changed[:]
+        for path, parts in machine.items():
+            ret = block.partioned(path, partitions=parts)
+            if ret["changes"]:
+                changed.append(path)
+
+    results = {
+        "read": best(read, min_time=min_time),
+        "render": best(render, min_time=min_time),
+        "partioned": best(state, min_time=min_time),
+    }
+    disks = len(machine)
+    out = {}
+    for name, seconds in results.items():
+        out["%s/%s" % (name, shape)] = {"seconds": seconds, "per_disk": seconds / disks}
+    out["partioned/%s" % shape].update(changed=len(changed), commands=len(cmd.calls))
+    return out
+
+
+def run(shapes=SHAPES, min_time=0.1):
+    directory = tempfile.mkdtemp(prefix="bench-block-")
+    try:
+        results = {}
+        for shape in shapes:
+            results.update(bench_shape(directory, shape, min_time))
+        return results
+    finally:
+        shutil.rmtree(directory)
+
+
+def compare(results, baseline, tolerance=1.5):
+    """Regressions against baseline, a tolerance of 0 only compares the command
+    counts, which unlike the times do not depend on the machine."""
+    regressions = []
+    for name, base in sorted(baseline.items()):
+        got = results.get(name)
+        if not got:
+            continue
+        if tolerance and got["seconds"] > base["seconds"] * tolerance:
+            regressions.append(
+                "%s: %.1fms, was %.1fms"
+                % (name, got["seconds"] * 1e3, base["seconds"] * 1e3)
+            )
+        if got.get("commands", 0) > base.get("commands", 0):
+            regressions.append(
+                "%s: runs %d commands, was %d"
+                % (name, got["commands"], base["commands"])
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark the block states")
+    parser.add_argument(
+        "--shape", action="append", choices=sorted(SHAPES), help="default all"
+    )
+    parser.add_argument(
+        "--min-time", type=float, default=0.1, help="seconds to spend per benchmark"
+    )
+    parser.add_argument("--save", metavar="FILE", help="write the results to FILE")
+    parser.add_argument(
+        "--compare", metavar="FILE", help="fail on regressions against FILE"
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=1.5, help="0 only compares command counts"
+    )
+    args = parser.parse_args(argv)
+
+    results = run(args.shape or SHAPES, args.min_time)
+    for name, r in sorted(results.items()):
+        extra = ""
+        if "commands" in r:
+            extra = " %d commands, %d changed" % (r["commands"], r["changed"])
+        print(
+            "%-25s %10.3fms %10.3fms/disk%s"
+            % (name, r["seconds"] * 1e3, r["per_disk"] * 1e3, extra)
+        )
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(
+                {"python": sys.version.split()[0], "results": results},
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for r in regressions:
+            print("regression: " + r, file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
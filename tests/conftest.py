@@ -0,0 +1,10 @@
+import os
+import sys
+
+# salt loads these as its own custom modules, make them importable as plain ones
+here = os.path.dirname(os.path.abspath(__file__))
+for d in ("_utils", "_states"):
+    sys.path.insert(0, os.path.join(here, d))
+
+# build tooling that lives next to what it builds
+sys.path.insert(0, os.path.join(here, "..", "installer", "alpine"))
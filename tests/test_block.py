@@ -0,0 +1,103 @@
+import random
+
+import pytest
+
+import bench_block
+import block
+import gpt
+
+GB = 1 << 30
+
+
+@pytest.fixture
+def salt():
+    return bench_block.setup_salt()
+
+
+@pytest.mark.parametrize("partitions", [1, 4, 128])
+def test_partioned_unchanged(tmpdir, salt, partitions):
+    path = str(tmpdir.join("disk.img"))
+    parts = bench_block.make_disk(path, partitions, 100 * GB)
+
+    ret = block.partioned(path, partitions=parts)
+    assert ret["result"] is True
+    assert ret["changes"] == {}
+    assert salt.calls == []
+
+
+def test_partioned_changes(tmpdir, salt):
+    path = str(tmpdir.join("disk.img"))
+    parts = bench_block.make_disk(path, 2, 100 * GB)
+    current = block._get_disk_info(path)
+
+    parts[1]["name"] = "ROOT"
+    ret = block.partioned(path, partitions=parts)
+    assert ret["result"] is None
+    assert ret["changes"]["old"] == current
+    assert ret["changes"]["new"]["partitions"][2]["name"] == "ROOT"
+    # only pretended, the disk is untouched
+    assert block._get_disk_info(path) == current
+    assert salt.calls == []
+
+
+def test_merge_keeps_old_values_for_falsy_ones():
+    old = {
+        "guid": "G",
+        "partitions": {
+            1: {
+                "number": 1,
+                "start": "2048",
+                "end": "4095",
+                "guid": "P",
+                "type": "T",
+                "name": "BIOS",
+            }
+        },
+    }
+    new = block._render_disk(None, [{"number": 1, "name": "BOOT"}])
+    merged = block._merge_disks(new, old)
+    assert merged["guid"] == "G"
+    assert merged["partitions"][1] == dict(old["partitions"][1], name="BOOT")
+
+
+def test_fuzz_corrupt_tables(tmpdir, salt):
+    """Random damage to a table must never crash the states, it either reads
+    back (from the backup) or is reported as not partitioned."""
+    path = str(tmpdir.join("disk.img"))
+    bench_block.make_disk(path, 8, GB)
+    with open(path, "rb") as f:
+        primary = f.read(34 * 512)
+
+    rng = random.Random(0)
+    for _ in range(200):
+        damaged = bytearray(primary)
+        for _ in range(rng.randint(1, 16)):
+            damaged[rng.randrange(512, len(damaged))] = rng.randrange(256)
+        with open(path, "r+b") as f:
+            f.write(damaged)
+
+        table = gpt.read(path)
+        assert table is None or len(table.partitions) == 8
+        assert block.labeled(path)["name"] == path
+        block.partioned(path, partitions=[{"number": 1}])
+    assert salt.calls == []
+
+
+def test_bench_runs():
+    results = bench_block.run(["typical"], min_time=0.001)
+    assert results["partioned/typical"]["commands"] == 0
+    assert results["partioned/typical"]["changed"] == 0
+    assert bench_block.compare(results, results) == []
+
+
+def test_bench_compare_commands():
+    baseline = {"partioned/typical": {"seconds": 1.0, "commands": 0}}
+    results = {"partioned/typical": {"seconds": 9.0, "commands": 2}}
+    assert bench_block.compare(results, baseline) == [
+        "partioned/typical: 9000.0ms, was 1000.0ms",
+        "partioned/typical: runs 2 commands, was 0",
+    ]
+    # the time is not compared when the baseline is from another machine
+    assert bench_block.compare(results, baseline, tolerance=0) == [
+        "partioned/typical: runs 2 commands, was 0"
+    ]
@@ -0,0 +1,94 @@
+import struct
+import zlib
+
+import pytest
+
+import gpt
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def disk(tmpdir):
+    path = str(tmpdir.join("disk.img"))
+    with open(path, "wb") as f:
+        f.truncate(100 * MB)
+    return path
+
+
+def layout(path):
+    table = gpt.new(path)
+    table.add(1, 0, "+1M", type="ef02", name="BIOS")
+    table.add(0, 0, "+20M", type="8200", name="SWAP")
+    table.add(3, name="ROOT")
+    return table
+
+
+def test_new_disk(disk):
+    assert gpt.read(disk) is None
+    assert gpt.label(disk) == "unknown"
+
+
+def test_add_defaults(disk):
+    table = layout(disk)
+    parts = table.info()["partitions"]
+
+    assert sorted(parts) == [1, 2, 3]
+    assert (parts[1]["start"], parts[1]["end"]) == ("2048", "4095")
+    assert (parts[2]["start"], parts[2]["end"]) == ("4096", "45055")
+    # like sgdisk, the last usable sector leaves room for the backup gpt
+    assert (parts[3]["start"], parts[3]["end"]) == ("45056", str(100 * 2048 - 34))
+    assert parts[1]["type"] == gpt.TYPE_CODES["EF02"]
+    assert parts[3]["type"] == gpt.DEFAULT_TYPE
+    assert parts[3]["flags"] == "0000000000000000"
+
+
+def test_add_errors(disk):
+    table = layout(disk)
+    with pytest.raises(gpt.GPTError):
+        table.add(1)
+    with pytest.raises(gpt.GPTError):
+        table.add(4)
+    with pytest.raises(gpt.GPTError):
+        gpt.new(disk).add(1, type="zz99")
+
+
+def test_roundtrip(disk):
+    table = layout(disk)
+    table.write(disk)
+
+    assert gpt.label(disk) == "gpt"
+    assert gpt.read(disk).info() == table.info()
+
+
+def test_headers(disk):
+    layout(disk).write(disk)
+    with open(disk, "rb") as f:
+        data = f.read()
+
+    assert data[510:512] == b"\x55\xaa"
+    for lba in (1, 100 * 2048 - 1):
+        header = data[lba * 512 : lba * 512 + 92]
+        assert header[:8] == b"EFI PART"
+        crc = struct.unpack_from("<I", header, 16)[0]
+        assert zlib.crc32(header[:16] + b"\0" * 4 + header[20:]) & 0xFFFFFFFF == crc
+
+
+def test_backup_is_used_when_primary_is_corrupt(disk):
+    table = layout(disk)
+    table.write(disk)
+    with open(disk, "r+b") as f:
+        f.seek(512 + 40)
+        f.write(b"garbage")
+
+    assert gpt.read(disk).info() == table.info()
+
+
+def test_msdos_label(disk):
+    with open(disk, "r+b") as f:
+        f.seek(446 + 4)
+        f.write(b"\x83")
+        f.seek(510)
+        f.write(b"\x55\xaa")
+
+    assert gpt.label(disk) == "msdos"
@@ -0,0 +1,33 @@
+import moduleprofiles
+
+LOG = """\
+Oct 19 10:00:01 10.1.2.3 1b2f-uuid: modprobe-profile 0123456789abcdef ahci e1000e nvme
+Oct 19 10:00:02 10.1.2.3 1b2f-uuid: some other osie line
+Oct 19 11:00:01 10.1.2.4 77aa-uuid: modprobe-profile 0123456789abcdef ahci nvme ixgbe
+Oct 19 11:00:02 10.1.2.5 8c1d-uuid: modprobe-profile fedcba9876543210 mlx5_core
+Oct 19 11:00:03 10.1.2.6 9f00-uuid: modprobe-profile 00000000000000ff
+"""
+
+
+def test_parse_keeps_common_modules():
+    assert moduleprofiles.parse(LOG.splitlines()) == {
+        "0123456789abcdef": {"ahci", "nvme"},
+        "fedcba9876543210": {"mlx5_core"},
+        "00000000000000ff": set(),
+    }
+
+
+def test_main(tmpdir):
+    log = tmpdir.join("osie.log")
+    log.write(LOG)
+    dest = tmpdir.join("module-profiles")
+    dest.mkdir().join("fedcba9876543210").write("mlx4_core\n")
+
+    assert moduleprofiles.main(["--dest", str(dest), str(log)]) == 0
+    assert dest.join("0123456789abcdef").read() == "ahci\nnvme\n"
+    # committed profiles are kept, empty ones are not written
+    assert dest.join("fedcba9876543210").read() == "mlx4_core\n"
+    assert not dest.join("00000000000000ff").check()
+
+    assert moduleprofiles.main(["--dest", str(dest), "--update", str(log)]) == 0
+    assert dest.join("fedcba9876543210").read() == "mlx5_core\n"